@@ -1,8 +1,24 @@
-import numpy as np
+"""
+    Command dataset generator for finetuning.
+    Samples are generated by a seeded process pool, deduplicated in the parent and streamed into size-bounded shards.
+
+    python dataset_creation.py                                   # 500 samples -> finetune_dataset.csv
+    python dataset_creation.py --samples 2000000 --shard_size 250000 --format parquet --dedup bloom --workers 8
+"""
+import os
+import sys
 import csv
+import json
+import math
+import time
 import random
-from collections import defaultdict
+import hashlib
+import argparse
+import numpy as np
+
+from collections import Counter
 from itertools import product
+from multiprocessing import Pool
 
 ITEMS_IN_SCENE = {
     'sugar_box' : ['sugar', 'sugar box', 'box of sugar', 'box'],
@@ -13,7 +29,7 @@ ITEMS_IN_SCENE = {
 
 LOCATIONS = {
     'redBin': ['red bin', 'red trashcan', 'red trash'],
-    'blueBin': ['blue bin', 'blue trashcan', 'blue trash'], 
+    'blueBin': ['blue bin', 'blue trashcan', 'blue trash'],
     'yellowBin': ['yellow bin', 'yellow trashcan', 'yellow trash']
 }
 
@@ -22,89 +38,309 @@ adverbs = ['inside', 'in', 'to']
 connectors = ['and', 'then', 'after that']
 
 sample_num = 500
-np.random.seed(42)
-random.seed(42)
-
-def generate_command():
-    item = random.choice(scene_items)
-    location = random.choice(scene_locations)
-    return (
-        f"{random.choice(verbs)} the {random.choice(ITEMS_IN_SCENE[item])} "
-        f"{random.choice(adverbs)} the {random.choice(LOCATIONS[location])}",
-        (item, location)
-    )
-
-scene_items = sorted(list(ITEMS_IN_SCENE))
-scene_locations = sorted(list(LOCATIONS.keys()))
-
-dataset = []
-counts = defaultdict(int)
-used_inputs = set()
-
-def add_to_dataset(cmd, outputs):
-    if cmd not in used_inputs:
-        used_inputs.add(cmd)
-        dataset.append({"input": cmd, "output": outputs})
-        for out in outputs:
-            counts[out] += 1
-        return True
-    return False
-
-single_samples = int(sample_num * 0.6)
-double_samples = int(sample_num * 0.3)
-triple_samples = sample_num - single_samples - double_samples
-
-# Generate single commands (60%)
-while len([d for d in dataset if len(d["output"]) == 1]) < single_samples:
-    cmd, output = generate_command()
-    add_to_dataset(cmd, [output])
-
-# Generate double commands (30%)
-while len([d for d in dataset if len(d["output"]) == 2]) < double_samples:
-    cmd1, out1 = generate_command()
-    cmd2, out2 = generate_command()
-    while out2 == out1:
-        cmd2, out2 = generate_command()
-    
-    combined_cmd = f"{cmd1} {random.choice(connectors)} {cmd2}"
-    add_to_dataset(combined_cmd, [out1, out2])
-
-# Generate triple commands (10%)
-while len([d for d in dataset if len(d["output"]) == 3]) < triple_samples:
-    cmd1, out1 = generate_command()
-    cmd2, out2 = generate_command()
-    cmd3, out3 = generate_command()
-    while out2 == out1 or out3 == out1 or out3 == out2:
-        cmd2, out2 = generate_command()
-        cmd3, out3 = generate_command()
-    
-    combined_cmd = f"{cmd1} {random.choice(connectors)} {cmd2} {random.choice(connectors)} {cmd3}"
-    add_to_dataset(combined_cmd, [out1, out2, out3])
-
-random.shuffle(dataset)
-
-file_path = "finetune_dataset.csv"
-with open(file_path, "w", newline='') as f:
-    writer = csv.writer(f)
-    writer.writerow(["input", "output"])
-    for data in dataset:
-        writer.writerow([data["input"], data["output"]])
-
-# Print distribution stats
-print("\nDistribution of outputs:")
-total = sum(counts.values())
-for item, location in product(scene_items, scene_locations):
-    key = (item, location)
-    percentage = (counts[key] / total) * 100
-    print(f"{key}: {counts[key]} ({percentage:.1f}%)")
-
-# Print command type distribution
-singles = len([d for d in dataset if len(d["output"]) == 1])
-doubles = len([d for d in dataset if len(d["output"]) == 2])
-triples = len([d for d in dataset if len(d["output"]) == 3])
-print(f"\nCommand distribution:")
-print(f"Singles: {singles} ({singles/len(dataset)*100:.1f}%)")
-print(f"Doubles: {doubles} ({doubles/len(dataset)*100:.1f}%)")
-print(f"Triples: {triples} ({triples/len(dataset)*100:.1f}%)")
-
-print(f"\nTotal unique commands: {len(dataset)}")
\ No newline at end of file
+
+# Share of single, double and triple commands
+COMMAND_MIX = (0.6, 0.3, 0.1)
+
+
+def default_vocab():
+    return {
+        'items': ITEMS_IN_SCENE,
+        'locations': LOCATIONS,
+        'verbs': verbs,
+        'adverbs': adverbs,
+        'connectors': connectors
+    }
+
+
+def load_vocab(path=None):
+    """Default scene vocabulary, with any of its tables replaced by the ones in a JSON file"""
+    vocab = default_vocab()
+    if path:
+        with open(path) as f:
+            vocab.update(json.load(f))
+    return vocab
+
+
+def scene_pairs(vocab):
+    return list(product(sorted(vocab['items']), sorted(vocab['locations'])))
+
+
+def generate_sample(rng, vocab, pairs, n_tasks):
+    """One command of n_tasks clauses over distinct (item, location) pairs, returns it with the pair indices"""
+    indices = rng.sample(range(len(pairs)), n_tasks)
+    outputs = [pairs[i] for i in indices]
+    clauses = [
+        f"{rng.choice(vocab['verbs'])} the {rng.choice(vocab['items'][item])} "
+        f"{rng.choice(vocab['adverbs'])} the {rng.choice(vocab['locations'][location])}"
+        for item, location in outputs
+    ]
+
+    cmd = clauses[0]
+    for clause in clauses[1:]:
+        cmd += f" {rng.choice(vocab['connectors'])} {clause}"
+    return cmd, outputs, indices
+
+
+def digest(cmd):
+    return hashlib.blake2b(cmd.encode(), digest_size=16).digest()
+
+
+def generate_chunk(task):
+    """
+        Worker: candidates for the requested count of each command length, seeded by the task index.
+        Returns the CSV rows, their digests, command lengths and pair indices (-1 padded), so the parent only filters.
+    """
+    seed, index, counts, vocab = task
+    rng = random.Random(seed * 1_000_003 + index)
+    pairs = scene_pairs(vocab)
+
+    samples = [generate_sample(rng, vocab, pairs, n_tasks) for n_tasks, count in counts.items() for _ in range(count)]
+    rng.shuffle(samples)
+
+    rows = [(cmd, str(outputs)) for cmd, outputs, _ in samples]
+    digests = [digest(cmd) for cmd, _, _ in samples]
+    lengths = np.array([len(outputs) for _, outputs, _ in samples], dtype=np.int64)
+    indices = np.full((len(samples), max(counts, default=1)), -1, dtype=np.int64)
+    for row, (_, _, sample_indices) in zip(indices, samples):
+        row[:len(sample_indices)] = sample_indices
+    return rows, digests, lengths, indices
+
+
+class ExactDedup:
+    """Set of 64-bit command hashes"""
+    def __init__(self):
+        self.seen = set()
+
+    def add_many(self, digests):
+        """Returns a mask of the digests seen for the first time, and records them"""
+        new = np.zeros(len(digests), dtype=bool)
+        for i, d in enumerate(digests):
+            key = int.from_bytes(d[:8], 'little')
+            if key not in self.seen:
+                self.seen.add(key)
+                new[i] = True
+        return new
+
+
+class BloomDedup:
+    """Bloom filter over command hashes, fixed memory at the cost of rarely dropping a unique command"""
+    def __init__(self, capacity, error_rate=1e-4):
+        self.m = max(8, int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)))
+        self.k = max(1, int(round(self.m / capacity * math.log(2))))
+        self.bits = np.zeros((self.m + 7) // 8, dtype=np.uint8)
+
+    def add_many(self, digests):
+        if not digests:
+            return np.zeros(0, dtype=bool)
+
+        # Double hashing, positions of all digests at once
+        raw = np.frombuffer(b''.join(digests), dtype=np.uint64).reshape(-1, 2)
+        with np.errstate(over='ignore'):
+            positions = (raw[:, :1] + np.arange(self.k, dtype=np.uint64) * (raw[:, 1:] | np.uint64(1))) % np.uint64(self.m)
+        byte, bit = positions // 8, (positions % 8).astype(np.uint8)
+
+        seen = ((self.bits[byte] >> bit) & 1).all(axis=1)
+
+        # Only the first of repeats inside this batch is new
+        _, first = np.unique(raw, axis=0, return_index=True)
+        new = np.zeros(len(digests), dtype=bool)
+        new[first] = True
+        new &= ~seen
+
+        np.bitwise_or.at(self.bits, byte.reshape(-1), (np.uint8(1) << bit).reshape(-1))
+        return new
+
+
+class ShardWriter:
+    """Buffers rows and writes them as shuffled shards of at most shard_size rows"""
+    def __init__(self, out_dir, prefix, fmt, shard_size, total, seed):
+        self.out_dir, self.prefix, self.fmt = out_dir, prefix, fmt
+        self.shard_size = shard_size
+        self.single = total <= shard_size
+        self.rng = random.Random(seed)
+        self.buffer = []
+        self.files = []
+        os.makedirs(out_dir, exist_ok=True)
+
+    def write(self, rows):
+        while rows:
+            space = self.shard_size - len(self.buffer)
+            self.buffer.extend(rows[:space])
+            rows = rows[space:]
+            if len(self.buffer) >= self.shard_size:
+                self.flush()
+
+    def flush(self):
+        if not self.buffer:
+            return
+        self.rng.shuffle(self.buffer)
+
+        name = self.prefix if self.single else f'{self.prefix}-{len(self.files):05d}'
+        file_path = os.path.join(self.out_dir, f'{name}.{self.fmt}')
+        if self.fmt == 'parquet':
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            inputs, outputs = zip(*self.buffer)
+            pq.write_table(pa.table({'input': list(inputs), 'output': list(outputs)}), file_path)
+        else:
+            with open(file_path, 'w', newline='') as f:
+                writer = csv.writer(f)
+                writer.writerow(['input', 'output'])
+                writer.writerows(self.buffer)
+
+        self.files.append(file_path)
+        self.buffer = []
+
+
+class DatasetStats:
+    """Command length mix and per (item, location) balance, updated per accepted chunk"""
+    def __init__(self, vocab, targets):
+        self.targets = targets  # Requested commands per length
+        self.pair_names = scene_pairs(vocab)
+        self.lengths = Counter()
+        self.pairs = np.zeros(len(self.pair_names), dtype=np.int64)
+
+    def add(self, lengths, indices):
+        self.lengths.update(lengths.tolist())
+        self.pairs += np.bincount(indices[indices >= 0], minlength=len(self.pairs))
+
+    def total(self):
+        return sum(self.lengths.values())
+
+    def shortfall(self):
+        """Requested commands of each length that the vocabulary couldn't supply"""
+        return {n: t - self.lengths[n] for n, t in self.targets.items() if self.lengths[n] < t}
+
+    def mix(self):
+        n = self.total()
+        return [self.lengths[length] / n if n else 0.0 for length in (1, 2, 3)]
+
+    def report(self):
+        print("\nDistribution of outputs:")
+        total = self.pairs.sum()
+        for key, count in zip(self.pair_names, self.pairs):
+            print(f"{key}: {count} ({count / total * 100:.1f}%)")
+
+        n = self.total()
+        print(f"\nCommand distribution:")
+        for length, name in ((1, 'Singles'), (2, 'Doubles'), (3, 'Triples')):
+            print(f"{name}: {self.lengths[length]} ({self.lengths[length] / n * 100:.1f}%)")
+
+        print(f"\nTotal unique commands: {n}")
+
+    def to_dict(self):
+        return {
+            'requested': {str(k): v for k, v in sorted(self.targets.items())},
+            'shortfall': {str(k): v for k, v in sorted(self.shortfall().items())},
+            'mix': self.mix(),
+            'lengths': {str(k): v for k, v in sorted(self.lengths.items())},
+            'pairs': {f'{item},{location}': int(v) for (item, location), v in zip(self.pair_names, self.pairs)}
+        }
+
+
+def generate(samples=sample_num, mix=COMMAND_MIX, seed=42, workers=None, out_dir='.', prefix='finetune_dataset',
+             fmt='csv', shard_size=100_000, dedup='exact', vocab=None, chunk_size=5_000, max_stalls=3):
+    """Generate a deduplicated dataset into shards, returns the stats and the written files"""
+    vocab = vocab or default_vocab()
+    workers = workers or os.cpu_count()
+
+    # Targets per command length, the remainder goes to singles
+    targets = {n_tasks: int(samples * share) for n_tasks, share in enumerate(mix, start=1)}
+    targets[1] += samples - sum(targets.values())
+    remaining = {n: t for n, t in targets.items() if t > 0}
+
+    dedup = BloomDedup(samples) if dedup == 'bloom' else ExactDedup()
+    writer = ShardWriter(out_dir, prefix, fmt, shard_size, samples, seed)
+    stats = DatasetStats(vocab, targets)
+    stalls = Counter()
+    task_index = 0
+    start = time.perf_counter()
+
+    with Pool(workers) as pool:
+        while remaining:
+            # Ask for a little more than needed, duplicates get dropped. Tasks depend on the demand only, not on
+            # the number of workers, so a seed always gives the same dataset
+            wanted = {n: math.ceil(r * 1.1) + 1 for n, r in remaining.items()}
+            n_tasks = math.ceil(sum(wanted.values()) / chunk_size)
+            tasks = [
+                (seed, task_index + i, {n: w // n_tasks + (i < w % n_tasks) for n, w in wanted.items()}, vocab)
+                for i in range(n_tasks)
+            ]
+            task_index += n_tasks
+
+            accepted = Counter()
+            for rows, digests, lengths, indices in pool.imap(generate_chunk, tasks):
+                new = dedup.add_many(digests)
+
+                # Keep the first new commands of each length, up to what is still missing
+                keep = np.zeros(len(rows), dtype=bool)
+                for n in remaining:
+                    candidates = np.flatnonzero(new & (lengths == n))[:remaining[n]]
+                    keep[candidates] = True
+                    remaining[n] -= len(candidates)
+                    accepted[n] += len(candidates)
+
+                keep = np.flatnonzero(keep)
+                writer.write([rows[i] for i in keep])
+                stats.add(lengths[keep], indices[keep])
+
+            # The vocabulary may not have enough unique commands of a length
+            for n in list(remaining):
+                stalls[n] = 0 if accepted[n] else stalls[n] + 1
+                if remaining[n] == 0:
+                    del remaining[n]
+                elif stalls[n] >= max_stalls:
+                    print(f"Only {targets[n] - remaining[n]} unique commands with {n} tasks could be generated")
+                    del remaining[n]
+
+            elapsed = time.perf_counter() - start
+            print(f"{stats.total()}/{samples} samples, {stats.total() / elapsed:.0f} samples/s")
+
+    writer.flush()
+    return stats, writer.files
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate the finetuning command dataset")
+    parser.add_argument("--samples", type=int, default=sample_num, help="Number of unique commands")
+    parser.add_argument("--mix", type=float, nargs=3, default=COMMAND_MIX, metavar=('SINGLE', 'DOUBLE', 'TRIPLE'), help="Share of each command length")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--workers", type=int, default=None, help="Generator processes, all cores by default")
+    parser.add_argument("--out_dir", default='.', help="Output directory")
+    parser.add_argument("--prefix", default='finetune_dataset', help="Shard file name prefix, a dataset that fits one shard is written to <prefix>.<format>")
+    parser.add_argument("--format", choices=['csv', 'parquet'], default='csv', help="Shard format, parquet needs pyarrow")
+    parser.add_argument("--shard_size", type=int, default=100_000, help="Rows per shard")
+    parser.add_argument("--dedup", choices=['exact', 'bloom'], default='exact', help="Hash set, or a fixed-size Bloom filter for very large datasets")
+    parser.add_argument("--vocab", default=None, help="JSON with items, locations, verbs, adverbs and/or connectors replacing the default scene's")
+    parser.add_argument("--allow_shortfall", action="store_true", help="Succeed with fewer samples, and a different mix, than requested when the vocabulary runs out of unique commands")
+    args = parser.parse_args()
+
+    # Fail before generating anything
+    if args.format == 'parquet':
+        try:
+            import pyarrow
+        except ImportError:
+            parser.error("--format parquet needs pyarrow, pip install pyarrow")
+
+    vocab = load_vocab(args.vocab)
+    stats, files = generate(args.samples, args.mix, args.seed, args.workers, args.out_dir, args.prefix,
+                            args.format, args.shard_size, args.dedup, vocab)
+    stats.report()
+
+    # Manifest next to the shards
+    manifest = {'files': [os.path.basename(f) for f in files], 'seed': args.seed, 'samples': stats.total(), **stats.to_dict()}
+    with open(os.path.join(args.out_dir, f'{args.prefix}.json'), 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+    shortfall = stats.shortfall()
+    if shortfall and not args.allow_shortfall:
+        missing = ', '.join(f'{count} with {n} tasks' for n, count in sorted(shortfall.items()))
+        mix = ', '.join(f'{share * 100:.0f}%' for share in stats.mix())
+        print(f"\nError: {stats.total()}/{args.samples} samples, missing {missing}. The mix is {mix} instead of the requested one, "
+              f"extend the vocabulary, lower --samples or pass --allow_shortfall")
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
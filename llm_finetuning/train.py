@@ -0,0 +1,287 @@
+"""
+    Finetune Flan-T5 on the output of dataset_creation.py, the scripted version of finetune_t5_llm.ipynb.
+    The dataset is tokenized once into a memory-mapped cache, batches group prompts of similar length and are padded
+    to their longest one. After every epoch the model directory is saved and loaded back with LLM to run evaluate_model.
+
+    python train.py --data finetune_dataset.csv
+    python train.py --data finetune_dataset.json --batch_size 16 --grad_accum 4 --threads 8 --output ../src/nlp/flan-t5-finetuned
+
+    Smoke run of the whole loop, training through evaluation, with a tiny model:
+    python train.py --model google/t5-efficient-tiny --epochs 1 --max_steps 1 --eval_limit 4 --output /tmp/t5-smoke --cache_dir /tmp/token_cache
+"""
+import os
+import sys
+import ast
+import json
+import math
+import time
+import hashlib
+import argparse
+
+import numpy as np
+import pandas as pd
+import torch
+
+from transformers import AutoTokenizer, AutoModelForSeq2SeqLM, get_linear_schedule_with_warmup
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(PROJECT_DIR, 'src'))
+
+from nlp.llm import LLM, SYSTEM_TEXT, INFERENCE_MODES, evaluate_model
+
+
+def dataset_files(paths):
+    """Shard files of the given paths, a manifest written by dataset_creation.py expands to its shards"""
+    files = []
+    for path in paths:
+        if path.endswith('.json'):
+            with open(path) as f:
+                manifest = json.load(f)
+            files.extend(os.path.join(os.path.dirname(path), name) for name in manifest['files'])
+        else:
+            files.append(path)
+    return files
+
+
+def load_dataset(files):
+    frames = [pd.read_parquet(f) if f.endswith('.parquet') else pd.read_csv(f) for f in files]
+    return pd.concat(frames, ignore_index=True)
+
+
+class TokenCache:
+    """
+        Token ids of every prompt and label, concatenated into flat arrays with row offsets and memory-mapped from disk.
+        The cache directory is keyed by the dataset files, the tokenizer and the truncation lengths.
+    """
+    FIELDS = ('inputs', 'labels')
+
+    def __init__(self, directory):
+        self.arrays = {
+            name: (np.load(os.path.join(directory, f'{name}.npy'), mmap_mode='r'),
+                   np.load(os.path.join(directory, f'{name}_offsets.npy')))
+            for name in self.FIELDS
+        }
+        ids, offsets = self.arrays['inputs']
+        self.input_lengths = np.diff(offsets)
+
+    def __len__(self):
+        return len(self.input_lengths)
+
+    def get(self, name, i):
+        ids, offsets = self.arrays[name]
+        return ids[offsets[i]:offsets[i + 1]]
+
+    @staticmethod
+    def key(files, model_name, max_input_length, max_output_length):
+        stats = [(os.path.abspath(f), os.path.getsize(f), os.path.getmtime(f)) for f in files]
+        spec = json.dumps([stats, model_name, max_input_length, max_output_length, SYSTEM_TEXT])
+        return hashlib.sha1(spec.encode()).hexdigest()[:16]
+
+    @classmethod
+    def build(cls, directory, data, tokenizer, max_input_length, max_output_length, chunk_size=10_000):
+        """Tokenize the dataset in chunks without padding and save it, returns the loaded cache"""
+        columns = {
+            'inputs': ([f"{SYSTEM_TEXT} {text}" for text in data['input']], max_input_length),
+            'labels': (list(data['output']), max_output_length)
+        }
+
+        os.makedirs(directory, exist_ok=True)
+        for name, (texts, max_length) in columns.items():
+            parts, lengths = [], []
+            for start in range(0, len(texts), chunk_size):
+                encoded = tokenizer(texts[start:start + chunk_size], max_length=max_length, truncation=True)['input_ids']
+                parts.extend(np.asarray(ids, dtype=np.int32) for ids in encoded)
+                lengths.extend(len(ids) for ids in encoded)
+
+            offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+            np.save(os.path.join(directory, f'{name}.npy'), np.concatenate(parts))
+            np.save(os.path.join(directory, f'{name}_offsets.npy'), offsets)
+
+        return cls(directory)
+
+
+def length_bucketed_batches(lengths, indices, batch_size, rng, pool_batches=50):
+    """
+        Shuffle, sort each pool of pool_batches batches by length and cut it into batches, then shuffle the batches.
+        Batches hold prompts of similar length while their order stays random.
+    """
+    indices = rng.permutation(indices)
+    pool = batch_size * pool_batches
+    batches = []
+    for start in range(0, len(indices), pool):
+        chunk = indices[start:start + pool]
+        chunk = chunk[np.argsort(lengths[chunk], kind='stable')]
+        batches.extend(chunk[b:b + batch_size] for b in range(0, len(chunk), batch_size))
+    return [batches[i] for i in rng.permutation(len(batches))]
+
+
+def collate(cache, batch, pad_token_id):
+    """Pad a batch to its longest prompt and label, padded label positions are ignored by the loss"""
+    inputs = [cache.get('inputs', i) for i in batch]
+    labels = [cache.get('labels', i) for i in batch]
+    input_len = max(len(ids) for ids in inputs)
+    label_len = max(len(ids) for ids in labels)
+
+    input_ids = np.full((len(batch), input_len), pad_token_id, dtype=np.int64)
+    attention_mask = np.zeros((len(batch), input_len), dtype=np.int64)
+    label_ids = np.full((len(batch), label_len), -100, dtype=np.int64)
+    for row, (ids, label) in enumerate(zip(inputs, labels)):
+        input_ids[row, :len(ids)] = ids
+        attention_mask[row, :len(ids)] = 1
+        label_ids[row, :len(label)] = label
+
+    return {
+        'input_ids': torch.from_numpy(input_ids),
+        'attention_mask': torch.from_numpy(attention_mask),
+        'labels': torch.from_numpy(label_ids)
+    }
+
+
+def scene_vocab(data):
+    """Items and locations appearing in the ground truth, what LLM accepts in a response"""
+    items, locations = set(), set()
+    for output in data['output']:
+        for item, location in ast.literal_eval(output):
+            items.add(item)
+            locations.add(location)
+    return items, locations
+
+
+def train(args):
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    if args.interop_threads:
+        torch.set_num_interop_threads(args.interop_threads)
+    torch.manual_seed(args.seed)
+    rng = np.random.default_rng(args.seed)
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+
+    files = dataset_files(args.data)
+    data = load_dataset(files)
+    tokenizer = AutoTokenizer.from_pretrained(args.model)
+
+    # Tokenize once, later runs on the same data memory-map the cache
+    cache_dir = os.path.join(args.cache_dir, TokenCache.key(files, args.model, args.max_input_length, args.max_output_length))
+    if os.path.exists(os.path.join(cache_dir, 'labels_offsets.npy')):
+        cache = TokenCache(cache_dir)
+        print(f"Loaded token cache {cache_dir}")
+    else:
+        start = time.perf_counter()
+        cache = TokenCache.build(cache_dir, data, tokenizer, args.max_input_length, args.max_output_length)
+        print(f"Tokenized {len(cache)} samples in {time.perf_counter() - start:.1f}s into {cache_dir}")
+
+    # Held-out split, evaluated with the same code path the arm uses
+    order = rng.permutation(len(data))
+    n_eval = int(len(data) * args.eval_fraction)
+    train_indices, eval_indices = order[n_eval:], order[:n_eval]
+    eval_data = data.iloc[eval_indices[:args.eval_limit]].reset_index(drop=True)
+    items, locations = scene_vocab(eval_data)
+
+    model = AutoModelForSeq2SeqLM.from_pretrained(args.model).to(device)
+    optimizer = torch.optim.AdamW(model.parameters(), lr=args.lr, weight_decay=args.weight_decay)
+
+    # Pools always have the same sizes, so every epoch has the same number of batches
+    batches_per_epoch = len(length_bucketed_batches(cache.input_lengths, train_indices, args.batch_size, rng))
+    if args.max_steps:
+        batches_per_epoch = min(batches_per_epoch, args.max_steps * args.grad_accum)
+    steps_per_epoch = math.ceil(batches_per_epoch / args.grad_accum)
+    scheduler = get_linear_schedule_with_warmup(optimizer, args.warmup_steps, steps_per_epoch * args.epochs)
+
+    print(f"{len(train_indices)} training samples, {len(eval_data)} evaluated of {n_eval} held out, "
+          f"{batches_per_epoch} batches of {args.batch_size} x {args.grad_accum} accumulated per step on {device}")
+
+    history = []
+    for epoch in range(1, args.epochs + 1):
+        model.train()
+        batches = length_bucketed_batches(cache.input_lengths, train_indices, args.batch_size, rng)[:batches_per_epoch]
+        samples, tokens, padded, loss_sum = 0, 0, 0, 0.0
+        start = time.perf_counter()
+
+        optimizer.zero_grad()
+        for step, batch in enumerate(batches, start=1):
+            inputs = {k: v.to(device) for k, v in collate(cache, batch, tokenizer.pad_token_id).items()}
+            loss = model(**inputs).loss
+
+            # Average over the batches of this step, the last group of an epoch may be short
+            group_start = (step - 1) // args.grad_accum * args.grad_accum
+            (loss / min(args.grad_accum, len(batches) - group_start)).backward()
+
+            if step % args.grad_accum == 0 or step == len(batches):
+                torch.nn.utils.clip_grad_norm_(model.parameters(), args.max_grad_norm)
+                optimizer.step()
+                scheduler.step()
+                optimizer.zero_grad()
+
+            samples += len(batch)
+            tokens += int(inputs['attention_mask'].sum())
+            padded += inputs['attention_mask'].numel()
+            loss_sum += loss.item() * len(batch)
+
+            if step % args.log_every == 0:
+                print(f"epoch {epoch} step {step}/{len(batches)}: loss {loss_sum / samples:.4f}, "
+                      f"{samples / (time.perf_counter() - start):.1f} samples/s")
+
+        train_s = time.perf_counter() - start
+
+        # The saved directory is what LLM(model_name=...) loads
+        model.save_pretrained(args.output)
+        tokenizer.save_pretrained(args.output)
+
+        llm = LLM(args.output, items, locations, True, mode=args.eval_mode)
+        results = evaluate_model(llm, eval_data, batch_size=args.eval_batch_size)
+        del llm
+
+        record = {
+            'epoch': epoch,
+            'loss': loss_sum / samples,
+            'train_s': train_s,
+            'samples_per_s': samples / train_s,
+            'tokens_per_s': tokens / train_s,
+            'padding_efficiency': tokens / padded,
+            'success_rate': results['success_rate'],
+            'error_rate': results['error_rate'],
+            **results['metrics'],
+            'eval_prompts_per_s': results['throughput']
+        }
+        history.append(record)
+        print(f"epoch {epoch}: loss {record['loss']:.4f}, {record['samples_per_s']:.1f} samples/s, "
+              f"{record['tokens_per_s']:.0f} tokens/s, {record['padding_efficiency']:.0%} non-padding tokens | "
+              f"success {record['success_rate']:.3f}, f1 {record['f1']:.3f}, precision {record['precision']:.3f}, "
+              f"recall {record['recall']:.3f}")
+
+        with open(os.path.join(args.output, 'training_log.json'), 'w') as f:
+            json.dump({'config': vars(args), 'epochs': history}, f, indent=2)
+
+    return history
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Finetune Flan-T5 on the command dataset")
+    parser.add_argument("--data", nargs='+', default=['finetune_dataset.csv'], help="CSV/Parquet shards, or the JSON manifest of dataset_creation.py")
+    parser.add_argument("--model", default="google/flan-t5-base", help="Base model name or directory")
+    parser.add_argument("--output", default="./flan-t5-finetuned", help="Model directory to write, loadable with LLM(model_name=...)")
+    parser.add_argument("--cache_dir", default="./token_cache", help="Where tokenized datasets are cached")
+    parser.add_argument("--epochs", type=int, default=5)
+    parser.add_argument("--batch_size", type=int, default=8)
+    parser.add_argument("--grad_accum", type=int, default=1, help="Batches accumulated per optimizer step")
+    parser.add_argument("--lr", type=float, default=2e-5)
+    parser.add_argument("--weight_decay", type=float, default=0.05)
+    parser.add_argument("--warmup_steps", type=int, default=10)
+    parser.add_argument("--max_steps", type=int, default=None, help="Optimizer steps per epoch, all batches by default")
+    parser.add_argument("--max_grad_norm", type=float, default=1.0)
+    parser.add_argument("--max_input_length", type=int, default=256)
+    parser.add_argument("--max_output_length", type=int, default=128)
+    parser.add_argument("--eval_fraction", type=float, default=0.1, help="Share of the dataset held out")
+    parser.add_argument("--eval_limit", type=int, default=500, help="Held-out prompts evaluated after every epoch")
+    parser.add_argument("--eval_batch_size", type=int, default=16)
+    parser.add_argument("--eval_mode", choices=INFERENCE_MODES, default='default', help="LLM inference mode used for evaluation")
+    parser.add_argument("--threads", type=int, default=None, help="Intra-op CPU threads, usually the number of physical cores")
+    parser.add_argument("--interop_threads", type=int, default=None, help="Inter-op CPU threads")
+    parser.add_argument("--log_every", type=int, default=50, help="Steps between progress lines")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    train(args)
+
+if __name__ == '__main__':
+    main()
@@ -2,9 +2,18 @@ import time
 import utils
 import numpy as np
 
+from concurrent.futures import ThreadPoolExecutor
+
+from kinematics import UR5Kinematics, rank_configs, CONFIG_RANK_WEIGHTS
+from motion_cache import MotionCache, planner_settings
+from roadmap import Roadmap, densify
+from trajectory import shortcut, time_parameterize
+from joint_path import Path
+from instrumentation import traced
+
 class RobotArm:
-    def __init__(self, sim, script, vis_path=False, name='/UR5'):
-        self.sim = sim
+    def __init__(self, sim, script, vis_path=False, name='/UR5', analytic_ik=False, descent='step', upload_paths=False, motion_cache=None, roadmap=None, time_optimal=False, sleep=time.sleep):
+        self.sim = utils.CallCounter(sim)
         self.script = script
         self.name = name
         self.num_joints = 6
@@ -13,40 +22,266 @@ class RobotArm:
         # Get parameters
         self.params = utils.call_lua_function(self.sim, self.script, 'getParams')
 
+        # Ghost shapes are only built and posed in the simulator when visualizing
+        utils.call_lua_function(self.sim, self.script, 'setVisualization', vis_path)
+
+        # Local kinematics model, used instead of simIK for candidate configs when analytic_ik is set.
+        # Built here so the pipeline's plan thread never calls the simulator, otherwise on first use
+        self.analytic_ik = analytic_ik
+        self._kinematics = UR5Kinematics.from_sim(self.sim, self.params) if analytic_ik else None
+
+        # Descent mode: 'step' lowers 1mm per remote IK move, 'guided' moves once to just above contact
+        self.descent = descent
+        self.descent_standoff = 0.01
+        self.descent_step = 0.001
+
+        # Step descent gives up this far below the estimated surface, or after this many steps
+        self.descent_overshoot = 0.02
+        self.descent_max_steps = 500
+
+        # Send whole paths to the simulator instead of streaming joint targets
+        self.upload_paths = upload_paths
+        self.waypoint_duration = 0.075
+
+        # Shortcut paths and time them within fkMaxVel/fkMaxAccel instead of a fixed time per waypoint.
+        # Only the simulator can follow the dense timing, streaming pays several remote calls per waypoint
+        if time_optimal and not upload_paths:
+            raise ValueError('time_optimal requires upload_paths')
+        self.time_optimal = time_optimal
+        self.shortcut_resolution = 0.05
+        self.trajectory_resolution = 0.02
+
+        # Scheduled duration of all executed motions, for cycle time reports
+        self.motion_time = 0.0
+
+        # Host side waits for motions and demos, the simulator stand-in passes one that doesn't block
+        self.sleep = sleep
+
+        # Planned motions reused across queries and runs
+        self.motion_cache = motion_cache
+
+        # Multi-query roadmap, OMPL is only used when it fails to connect
+        self.roadmap = roadmap
+
         self.target_params = {}
+        self.last_pick_stats = None
+
+        # Bin the arm is parked above between chained tasks, None when at home
+        self.location = None
+
+        # Costs of the last ranked IK candidates, best first
+        self.last_config_ranking = None
 
     def _create_pose(self, position, quaternion):
         """Create a pose from position and quaternion"""
         return np.concatenate([position, quaternion])
 
+    def find_configs(self, pose):
+        """Candidate configs for a pose from the analytic IK or simIK, unranked"""
+        if self.analytic_ik:
+            return self.kinematics.valid_configs(pose)
+        return utils.call_lua_function(self.sim, self.script, 'findConfigs', list(pose))
+
+    def start_config(self):
+        """Config the next motion starts from, home or the bin the arm is parked above"""
+        if self.location:
+            return self.target_params[self.location]['config']
+        return self.params['homeConfig']
+
+    def _rank(self, configs, current):
+        """IK candidates ordered by motion cost from current, and the (index, cost) ranking, best first"""
+        if len(configs) == 0:
+            return configs, []
+
+        order, costs = rank_configs(configs, current, self.params['homeConfig'], self.params['jointLimits'], CONFIG_RANK_WEIGHTS)
+        return [configs[i] for i in order], [(int(i), float(costs[i])) for i in order]
+
+    def rank_configs(self, configs, current=None):
+        """
+            Order IK candidates by motion cost from current (default: start_config), the simulator takes the first
+            collision-free one. Keeps the ranking for diagnostics
+        """
+        configs, self.last_config_ranking = self._rank(configs, current if current is not None else self.start_config())
+        return configs
+
+    @property
+    def kinematics(self):
+        if self._kinematics is None:
+            self._kinematics = UR5Kinematics.from_sim(self.sim, self.params)
+        return self._kinematics
+
+    def compare_ik(self, pose):
+        """Compare the analytic IK against simIK for a pose"""
+        sim_configs = np.array(utils.call_lua_function(self.sim, self.script, 'findConfigs', pose))
+        configs = np.array(self.kinematics.valid_configs(pose))
+        if len(sim_configs) == 0 or len(configs) == 0:
+            return {'simik': len(sim_configs), 'analytic': len(configs)}
+
+        # Tip error of the simIK configs under our model, and distance to the closest analytic branch
+        target = np.asarray(pose[:3])
+        fk_err = np.linalg.norm(self.kinematics.fk(sim_configs)[:, :3, 3] - target, axis=1)
+        diff = (sim_configs[:, None, :] - configs[None, :, :] + np.pi) % (2 * np.pi) - np.pi
+        branch_dist = np.abs(diff).max(axis=2).min(axis=1)
+
+        return {
+            'simik': len(sim_configs),
+            'analytic': len(configs),
+            'max_fk_error': float(fk_err.max()),
+            'max_branch_distance': float(branch_dist.max())
+        }
+
+    def check_collisions(self, configs):
+        """
+            Check many configs in one remote call.
+            Returns a boolean validity mask and the colliding pair of handles for each config
+        """
+        flat = np.asarray(configs, dtype=np.float64).reshape(-1).tolist()
+        if not flat:
+            return np.zeros(0, dtype=bool), []
+
+        valid, pairs = utils.call_lua_function(self.sim, self.script, 'checkCollisions', flat)
+        return np.array(valid, dtype=bool), pairs
+
+    def _show_ghost(self, config):
+        """Pose a pooled ghost of the arm at config, returns its id (-1 without visualization)"""
+        if not self.vis_path:
+            return -1
+        return utils.call_lua_function(self.sim, self.script, 'showGhost', list(config))
+
+    def _release_ghosts(self, ids):
+        ids = [i for i in ids if i is not None and i > 0]
+        if ids:
+            utils.call_lua_function(self.sim, self.script, 'releaseGhosts', ids)
+
     def _set_target_config(self, config):
         """Set target joint positions"""
         for joint, pos in zip(self.params['joints'], config):
             self.sim.setJointTargetPosition(joint, pos)
 
-    def followPath(self, path):
+    def path_times(self, path):
+        """Uniform waypoint timestamps"""
+        return [i * self.waypoint_duration for i in range(len(path))]
+
+    def optimize_path(self, path):
+        """Shortcut a path with collision queries and time it within the FK motion limits, returns (path, times)"""
+        configs = shortcut(path.configs, self._valid_mask, self.shortcut_resolution)
+        configs, times = time_parameterize(configs, self.params['fkMaxVel'], self.params['fkMaxAccel'], self.trajectory_resolution)
+        return Path(configs), times.tolist()
+
+    def followPath(self, path, times=None):
         """Simulate the arm movement along the generated path in the simulation"""
-        configs = [path[i:i+self.num_joints] for i in range(0, len(path), self.num_joints)]
+        path = path if isinstance(path, Path) else Path(path, self.num_joints)
+        if times is None and self.time_optimal:
+            path, times = self.optimize_path(path)
+
+        if self.upload_paths:
+            # Single call, the simulator interpolates and steps until the motion is done
+            times = times if times is not None else self.path_times(path)
+            self.motion_time += times[-1]
+            return utils.call_lua_function(self.sim, self.script, 'executePath', path.to_flat(), times)
+
+        configs = path.configs.tolist()
+        durations = np.diff(times, append=times[-1]) if times is not None else [self.waypoint_duration] * len(configs)
 
-        for config in configs:
+        for config, duration in zip(configs, durations):
             self._set_target_config(config)
-            time.sleep(0.075)
-        time.sleep(1.0)
+            self.sleep(duration)
+        self.sleep(1.0)
+        self.motion_time += sum(durations)
+
+    def _cache_key(self, goal):
+        """Motion cache key for a query from the current config"""
+        ctx = utils.call_lua_function(self.sim, self.script, 'getMotionContext')
+        return MotionCache.make_key(ctx['config'], goal, planner_settings(ctx['planner']), ctx['fingerprint'])
+
+    def _path_is_valid(self, path, resolution=None):
+        """Re-check a path's waypoints against the current scene, densified to resolution if given"""
+        if resolution is not None:
+            path = densify(np.asarray(path, dtype=np.float64).reshape(-1, self.num_joints), resolution)
+        valid, _ = self.check_collisions(path)
+        return bool(valid.all())
+
+    def _plan_to_pose(self, pose, configs=None):
+        """Plan from the current config to pose, reusing cached motions. Returns (path, passiveShape) or False"""
+        key = None
+        if self.motion_cache is not None:
+            key = self._cache_key(pose)
+            cached = self.motion_cache.get(key, validate=self._path_is_valid)
+            if cached:
+                config, path = cached
+                print("Using cached path")
+                self.sim.setObjectPose(self.params['robotTarget'], -1, list(pose))
+                return path, self._show_ghost(config)
+
+        # Candidates may have been solved ahead, they are ranked from where the arm is now
+        configs = self.rank_configs(configs if configs else self.find_configs(pose))
+
+        if self.roadmap is not None:
+            result = self._plan_with_roadmap(pose, configs)
+        else:
+            # Get params from lua using OMPL
+            result = utils.call_lua_function(self.sim, self.script, 'getPath', pose, configs)
+        if not result:
+            return False
+
+        path, passiveShape, valid = result
+        self.last_config_ranking = with_validity(self.last_config_ranking, valid)
+        path = Path(path, self.num_joints)
+        if key:
+            self.motion_cache.put(key, path.end, path)
+
+        return path, passiveShape
+
+    def _valid_mask(self, configs):
+        valid, _ = self.check_collisions(configs)
+        return valid
+
+    def _plan_with_roadmap(self, pose, configs):
+        """Plan through the roadmap to the first valid ranked config, falling back to RRTConnect. Returns (path, passiveShape, valid) or False"""
+        result = utils.call_lua_function(self.sim, self.script, 'getGoalConfig', pose, configs)
+        if not result:
+            return False
+        config, passiveShape, valid = result
+
+        start_time = time.perf_counter()
+        start = utils.call_lua_function(self.sim, self.script, 'getCurrConfig')
+        path = self.roadmap.query(start, config, self._valid_mask)
+        # The roadmap checks edges at its own resolution, OMPL paths are validated at the planner's
+        if path and self._path_is_valid(path, self.params['pathPlanningResolution']):
+            print(f"Found a roadmap path in {(time.perf_counter() - start_time) * 1000:.1f}ms")
+            return path, passiveShape, valid
+
+        print("Roadmap could not connect the query, falling back to RRTConnect")
+        path = utils.call_lua_function(self.sim, self.script, 'findPath', config)
+        if not path:
+            self._release_ghosts([passiveShape])
+            return False
+
+        return path, passiveShape, valid
+
+    def roadmap_key(self, n_samples=2000, k=10, resolution=0.05):
+        """Key of a roadmap built with these settings in the current scene"""
+        ctx = utils.call_lua_function(self.sim, self.script, 'getMotionContext')
+        return Roadmap.make_key(ctx['fingerprint'], self.params['jointLimits'], n_samples, k, resolution)
+
+    def build_roadmap(self, n_samples=2000, k=10, resolution=0.05):
+        """Build a roadmap over the joint space with the current collision setup"""
+        limits = self.params['jointLimits']
+        key = self.roadmap_key(n_samples, k, resolution)
+        return Roadmap.build(self._valid_mask, limits, n_samples=n_samples, k=k, resolution=resolution, key=key)
 
     def get_target_params(self, location, config=None):
-        """Get data for location and create passiveShape of config"""
+        """Get data for location and show a ghost of config"""
 
         # Location data
         loc = self.target_params[location]
         config = config if config else loc['config']
         path = loc['path']
 
-        # Create passive shape
-        passiveShape = utils.call_lua_function(self.sim, self.script, 'createPassiveShape', config)
-
-        return path, passiveShape 
+        return path, self._show_ghost(config)
     
-    def moveWithPath(self, pose=None, location=None):
+    @traced('moveWithPath')
+    def moveWithPath(self, pose=None, location=None, configs=None):
         """Find a path to pose and follow it"""
 
         if location:
@@ -55,8 +290,7 @@ class RobotArm:
             print(f"Moving to pose: {pose}...")
         
         if not location:
-            # Get params from lua using OMPL
-            result = utils.call_lua_function(self.sim, self.script, 'getPath', pose)
+            result = self._plan_to_pose(pose, configs)
             if not result:
                 return False
             
@@ -68,17 +302,18 @@ class RobotArm:
 
         if self.vis_path:
             # Visualize path for 3 seconds before moving
-            shapes = utils.call_lua_function(self.sim, self.script, 'visualizePath', path, 20)
-            time.sleep(3)
-            self.sim.removeObjects(shapes)
+            shapes = utils.call_lua_function(self.sim, self.script, 'visualizePath', path.to_flat(), 20)
+            self.sleep(3)
+            self._release_ghosts(shapes)
 
         # Simulate path movement
         self.followPath(path)
-        self.sim.removeObjects([passiveShape])
-        time.sleep(0.15)
+        self._release_ghosts([passiveShape])
+        self.sleep(0.15)
 
         return path
     
+    @traced('moveHome')
     def moveHome(self, item_path=None, location=None):
         """Find path to home config from saved target location"""
 
@@ -88,33 +323,102 @@ class RobotArm:
             # Get data and flip path
             path, passiveShape = self.get_target_params(location, config=self.params['homeConfig'])
         else:
-            # If we are going back from picking up an item
+            # If we are going back from picking up an item, this ends where the item path started
             path = item_path
-            passiveShape = utils.call_lua_function(self.sim, self.script, 'createPassiveShape', self.params['homeConfig'])
+            passiveShape = self._show_ghost(path.start.tolist())
 
         if self.vis_path:
             # Visualize path
-            shapes = utils.call_lua_function(self.sim, self.script, 'visualizePath', path, 20)
-            time.sleep(3)
-            self.sim.removeObjects(shapes)
+            shapes = utils.call_lua_function(self.sim, self.script, 'visualizePath', path.to_flat(), 20)
+            self.sleep(3)
+            self._release_ghosts(shapes)
 
-        # Simulate path movement
-        path = sum([path[i:i + self.num_joints] for i in range(0, len(path), self.num_joints)][::-1],[])
-        self.followPath(path)
-        self.sim.removeObjects([passiveShape])
-        time.sleep(0.15)
+        # Simulate path movement, backwards
+        self.followPath(path.reversed())
+        self._release_ghosts([passiveShape])
+        self.sleep(0.15)
 
         return True
     
-    def pick_and_place(self, pick, place):
-        """Execute pick and place operation"""
+    def _descend_step(self, surface_z):
+        """Lower the target 1mm per IK move until the suction sensor detects an item, False if it never does"""
+        for _ in range(self.descent_max_steps):
+            curr_pose = self.sim.getObjectPose(self.params['robotTarget'], -1)
+            curr_pose[2] -= self.descent_step  # Step down incrementally
+            if curr_pose[2] < surface_z - self.descent_overshoot:
+                break
+            self.sim.setObjectPose(self.params['robotTarget'], -1, curr_pose)
+
+            # Move using IK
+            success = utils.call_lua_function(self.sim, self.script, 'moveToPose', curr_pose)
+            if not success:
+                return False
+
+            # Check the suction sensor
+            object = utils.call_lua_function(self.sim, self.script, 'detectSuctionSensor')
+            if object:
+                return object
+
+        print("Reached the descent limit without detecting an item")
+        return False
+
+    def _descend_guided(self, surface_z):
+        """Move once to just above the contact height, then finish with fine steps inside the simulator"""
+        curr_pose = self.sim.getObjectPose(self.params['robotTarget'], -1)
+
+        # Prefer the suction sensor reading, fall back to the surface height from the depth map
+        distance = utils.call_lua_function(self.sim, self.script, 'getSuctionSensorDistance')
+        contact_z = curr_pose[2] - distance if distance >= 0 else surface_z
+
+        approach_z = contact_z + self.descent_standoff
+        if approach_z < curr_pose[2]:
+            curr_pose[2] = approach_z
+            self.sim.setObjectPose(self.params['robotTarget'], -1, curr_pose)
+            success = utils.call_lua_function(self.sim, self.script, 'moveToPose', curr_pose)
+            if not success:
+                return False
+
+        # Fine approach, allow overshooting the estimate by the standoff
+        max_steps = int(round(3 * self.descent_standoff / self.descent_step))
+        return utils.call_lua_function(self.sim, self.script, 'descendUntilContact', self.descent_step, max_steps)
+
+    def prepare_pick(self, pick):
+        """Analytic IK candidates for a pick, computed locally so it can run ahead of execution, None without analytic IK"""
+        if not self.analytic_ik:
+            return None
+        pick = list(pick)
+        pick[2] += self.params['heightDiff']
+        return self.kinematics.valid_configs(self._create_pose(pick, self.params['downOriQuat']))
+
+    def estimate_pick_config(self, pick):
+        """Best ranked analytic IK config of a pick from home, used to estimate travel"""
+        pick = list(pick)
+        pick[2] += self.params['heightDiff']
+        configs = self.kinematics.valid_configs(self._create_pose(pick, self.params['downOriQuat']))
+        if not configs:
+            return self.params['homeConfig']
+
+        return self._rank(configs, self.params['homeConfig'])[0][0]
+
+    @traced('pick_and_place')
+    def pick_and_place(self, pick, place, configs=None, return_home=True):
+        """
+            Execute pick and place operation.
+            With return_home=False the arm stays above the bin and the next pick starts from there.
+        """
+
+        start_time = time.perf_counter()
+        start_calls = self.sim.calls
+        start_motion = self.motion_time
+        self.last_config_ranking = None
 
         # Create scene poses        
+        surface_z = pick[2]
         pick[2] += self.params['heightDiff']
         pickPose = self._create_pose(pick, self.params['downOriQuat'])
     
         # Move to pick
-        success = self.moveWithPath(pickPose)
+        success = self.moveWithPath(pickPose, configs=configs)
         if not success:
             return False
 
@@ -122,21 +426,14 @@ class RobotArm:
 
         # Move down until item is detected
         print("Moving down to target...")
-        while True:
-            curr_pose = self.sim.getObjectPose(self.params['robotTarget'], -1)
-            curr_pose[2] -= 0.001  # Step down incrementally
-            self.sim.setObjectPose(self.params['robotTarget'], -1, curr_pose)
-
-            # Move using IK
-            success = utils.call_lua_function(self.sim, self.script, 'moveToPose', curr_pose)
-            if not success:
-                return False
+        if self.descent == 'guided':
+            object = self._descend_guided(surface_z)
+        else:
+            object = self._descend_step(surface_z)
 
-            # Check the suction sensor
-            object = utils.call_lua_function(self.sim, self.script, 'detectSuctionSensor')
-            if object:
-                print("Item detected! Stopping descent.")
-                break
+        if not object:
+            return False
+        print("Item detected! Stopping descent.")
 
         # Pick item
         utils.call_lua_function(self.sim, self.script, 'toggleSuction', object, False)
@@ -146,53 +443,152 @@ class RobotArm:
         if not success:
             return False
 
-        # Move home
+        # Move back to where the pick started, home or the previous bin
         success = self.moveHome(item_path)
         if not success:
             return False
         
-        # Move to place
-        success = self.moveWithPath(location=place)
-        if not success:
-            return False
+        # Move to place, through home if we are parked above another bin
+        if self.location != place:
+            if self.location:
+                success = self.moveHome(location=self.location)
+                if not success:
+                    return False
+                self.location = None
+
+            success = self.moveWithPath(location=place)
+            if not success:
+                return False
+        self.location = place
         
         # Drop item
         utils.call_lua_function(self.sim, self.script, 'toggleSuction', object, True)
         
         # Move home
-        success = self.moveHome(location=place)
-        if not success:
-            return False
+        if return_home:
+            success = self.moveHome(location=place)
+            if not success:
+                return False
+            self.location = None
+
+        self.last_pick_stats = {
+            'rpcs': self.sim.calls - start_calls,
+            'seconds': time.perf_counter() - start_time,
+            'motion_seconds': self.motion_time - start_motion,
+            'config_ranking': self.last_config_ranking  # (index, cost, valid) of the pick candidates, None for cached paths
+        }
+        print(f"Pick and place took {self.last_pick_stats['rpcs']} remote calls and {self.last_pick_stats['seconds']:.2f}s, "
+              f"{self.last_pick_stats['motion_seconds']:.2f}s of path motion")
         
         return True
     
-    def calculate_home_target_trajectories(self, locations):
+    def calculate_home_target_trajectories(self, locations, execute=True, worker_sims=None):
         """
             Calculate paths and trajectories from home config to each available location for reuse
+            execute: demonstrate each new path on the arm, otherwise only plan (the arm stays at home)
+            worker_sims: clients of extra simulator instances with the same scene, planning queries are spread over them
         """
         
         print(f"Calculating paths from Home to {len(locations)} target locations\n")
 
         utils.call_lua_function(self.sim, self.script, 'initialParams', True)
 
-        shapes = None
-        
+        # Reuse cached paths, the rest are planned
+        pending = {}
         for locName, locPos in locations.items():
-            print(f'Finding path for {locName}')
             locPose = self._create_pose(locPos, self.params['downOriQuat'])
 
-            self.target_params[locName] = utils.call_lua_function(self.sim, self.script, 'findHomeTargetPath', locPose)
+            key = None
+            if self.motion_cache is not None:
+                key = self._cache_key(locPose)
+                cached = self.motion_cache.get(key, validate=self._path_is_valid)
+                if cached:
+                    print(f'Using cached path for {locName}')
+                    config, path = cached
+                    self.target_params[locName] = {'config': config, 'path': path}
+                    continue
+
+            pending[locName] = (locPose, key)
+
+        start_time = time.perf_counter()
+        if worker_sims:
+            plans = self._plan_on_workers(worker_sims, {name: pose for name, (pose, _) in pending.items()})
+        else:
+            plans = {}
+            for locName, (locPose, _) in pending.items():
+                print(f'Finding path for {locName}')
+                configs = self.rank_configs(self.find_configs(locPose))
+                plans[locName] = utils.call_lua_function(self.sim, self.script, 'findHomeTargetPath', locPose, configs)
+                plans[locName]['ranking'] = with_validity(self.last_config_ranking, plans[locName].get('valid'))
+        if pending:
+            print(f"Planned {len(pending)} paths in {time.perf_counter() - start_time:.2f}s")
+
+        for locName, (_, key) in pending.items():
+            target = self.target_params[locName] = plans[locName]
+            if not target.get('path') or not target.get('config'):
+                print(f'No path found for {locName}')
+                continue
+            target['path'] = Path(target['path'], self.num_joints)
+
+            if key:
+                self.motion_cache.put(key, target['config'], target['path'])
+
+            if not execute:
+                continue
             
             if self.vis_path:
-                shapes = utils.call_lua_function(self.sim, self.script, 'visualizePath', self.target_params[locName]['path'], 20)
-                time.sleep(10.0)
-                self.sim.removeObjects(shapes)
+                shapes = utils.call_lua_function(self.sim, self.script, 'visualizePath', target['path'].to_flat(), 20)
+                self.sleep(10.0)
+                self._release_ghosts(shapes)
 
-            self.followPath(self.target_params[locName]['path'])
-            time.sleep(2.0)
+            self.followPath(target['path'])
+            self.sleep(2.0)
             
             self.moveHome(location=locName)
-            time.sleep(2.0) 
+            self.sleep(2.0) 
 
         utils.call_lua_function(self.sim, self.script, 'initialParams', False)
 
+    def _plan_on_workers(self, worker_sims, poses):
+        """Split home to target queries over worker simulators, each plans its share sequentially"""
+        names = list(poses)
+        shares = [{name: poses[name] for name in names[i::len(worker_sims)]} for i in range(len(worker_sims))]
+
+        # Worker arms stay at home, candidates are ranked from there
+        def rank(configs):
+            return self._rank(configs, self.params['homeConfig'])
+
+        plans = {}
+        with ThreadPoolExecutor(max_workers=len(worker_sims)) as executor:
+            for result in executor.map(plan_home_target_paths, worker_sims, shares, [rank] * len(worker_sims)):
+                plans.update(result)
+        return plans
+
+
+def with_validity(ranking, valid):
+    """Add the simulator's collision check to an (index, cost) ranking, valid is in ranked order"""
+    if ranking is None or valid is None:
+        return ranking
+    return [(i, cost, bool(ok)) for (i, cost), ok in zip(ranking, valid)]
+
+
+def plan_home_target_paths(sim, poses, rank):
+    """
+        Plan home to target paths on a worker simulator without moving its arm, returns {name: {'config', 'path', 'ranking'}}
+        rank(configs) -> (ranked configs, ranking), local only since it runs on the worker's thread
+    """
+    plans = {}
+    if not poses:
+        return plans
+
+    script = sim.getObject('/ArmControlScript')
+    utils.call_lua_function(sim, script, 'initialParams', True)
+    for name, pose in poses.items():
+        print(f'Finding path for {name}')
+        configs, ranking = rank(utils.call_lua_function(sim, script, 'findConfigs', list(pose)))
+        plans[name] = utils.call_lua_function(sim, script, 'findHomeTargetPath', pose, configs)
+        plans[name]['ranking'] = with_validity(ranking, plans[name].get('valid'))
+    utils.call_lua_function(sim, script, 'initialParams', False)
+
+    return plans
+
@@ -21,59 +21,121 @@ function eulerToQuaternion(eulerAngles)
     return quaternion
 end
 
-function createPassiveShape(config)
-    local bufferedConfig = getCurrConfig()
-    setConfig(config)
+-- Visualization functions   ------------------------------------------------------------------------------------------
 
-    local list = sim.getObjectsInTree(params.robotBase, sim.sceneobject_shape)
-    local lc = table.clone(list)
-    list = {}
+-- Ghosts are non-collidable copies of the visible arm links, built on first use and only reposed afterwards.
+-- Nothing is built while visualization is off, and callers get -1 instead of a ghost id.
+ghosts = {pool = {}, free = {}, inUse = {}}
 
-    local cylinder = sim.getObject('/UR5/Cylinder') -- Remove the base from the passive shape
+function setVisualization(b)
+    params.visualize = b
+end
 
-    for j = 1, #lc do
-        if sim.getBoolProperty(lc[j], 'visible') and lc[j] ~= cylinder and lc[j] ~= params.collisionBox then
-            list[#list + 1] = lc[j]
+function getGhostLinks()
+    if not params.ghostLinks then
+        local cylinder = sim.getObject('/UR5/Cylinder') -- Leave the base out of the ghost
+        params.ghostLinks = {}
+        for _, h in ipairs(sim.getObjectsInTree(params.robotBase, sim.sceneobject_shape)) do
+            if sim.getBoolProperty(h, 'visible') and h ~= cylinder and h ~= params.collisionBox then
+                params.ghostLinks[#params.ghostLinks + 1] = h
+            end
         end
     end
+    return params.ghostLinks
+end
 
-    list = sim.copyPasteObjects(list)
-    local passiveVizShape = sim.groupShapes(list, true)
-    sim.setBoolProperty(passiveVizShape, 'respondable', false)
-    sim.setBoolProperty(passiveVizShape, 'dynamic', false)
-    sim.setBoolProperty(passiveVizShape, 'collidable', false)
-    sim.setBoolProperty(passiveVizShape, 'measurable', false)
-    sim.setBoolProperty(passiveVizShape, 'detectable', false)
-    sim.setColorProperty(sim.getIntArrayProperty(passiveVizShape, 'meshes')[1], 'color.diffuse', {1, 0, 0})
-    sim.setObjectAlias(passiveVizShape, 'passiveVisualizationShape')
-    sim.step()
-
-    setConfig(bufferedConfig)
-    return passiveVizShape
+function buildGhost()
+    local copies = sim.copyPasteObjects(getGhostLinks(), 0)
+    for _, h in ipairs(copies) do
+        sim.setObjectParent(h, -1, true)
+        sim.setBoolProperty(h, 'respondable', false)
+        sim.setBoolProperty(h, 'dynamic', false)
+        sim.setBoolProperty(h, 'collidable', false)
+        sim.setBoolProperty(h, 'measurable', false)
+        sim.setBoolProperty(h, 'detectable', false)
+        for _, mesh in ipairs(sim.getIntArrayProperty(h, 'meshes')) do
+            sim.setColorProperty(mesh, 'color.diffuse', {1, 0, 0})
+        end
+        sim.setObjectAlias(h, 'passiveVisualizationShape')
+    end
+    return copies
 end
 
-function visualizePath(pathPts, times, numSamples)
-    assert(numSamples > 0, "Number of samples must be greater than 0")
+function showGhost(config)
+    -- Pose a pooled ghost at config, returns its id
+    if not params.visualize then
+        return -1
+    end
 
-    -- Determine evenly spaced time intervals
-    local totalTime = times[#times]
-    local sampleTimes = {}
-    for i = 0, numSamples - 1 do
-        sampleTimes[#sampleTimes + 1] = i * totalTime / (numSamples - 1)
+    local id = table.remove(ghosts.free)
+    if not id then
+        ghosts.pool[#ghosts.pool + 1] = buildGhost()
+        id = #ghosts.pool
+    end
+    ghosts.inUse[id] = true
+
+    -- Link poses follow the joints immediately, no step needed
+    local bufferedConfig = getCurrConfig()
+    applyConfig(config)
+    local links = getGhostLinks()
+    for i, h in ipairs(ghosts.pool[id]) do
+        sim.setObjectPose(h, sim.getObjectPose(links[i], -1), -1)
+        sim.setObjectInt32Param(h, sim.objintparam_visibility_layer, 1)
     end
+    applyConfig(bufferedConfig)
 
-    local shapes = {}
+    return id
+end
 
-    -- Create passive shapes at sampled points
-    for _, t in ipairs(sampleTimes) do
-        local sampledConfig = sim.getPathInterpolatedConfig(pathPts, times, t)
-        shapes[#shapes + 1] = createPassiveShape(sampledConfig)
+function releaseGhosts(ids)
+    -- Hide ghosts and return them to the pool, ids that are not in use are skipped so they are never freed twice
+    for _, id in ipairs(ids) do
+        if ghosts.inUse[id] then
+            ghosts.inUse[id] = nil
+            for _, h in ipairs(ghosts.pool[id]) do
+                sim.setObjectInt32Param(h, sim.objintparam_visibility_layer, 0)
+            end
+            ghosts.free[#ghosts.free + 1] = id
+        end
     end
+end
+
+function removeGhosts()
+    for _, copies in ipairs(ghosts.pool) do
+        sim.removeObjects(copies)
+    end
+    ghosts = {pool = {}, free = {}, inUse = {}}
+end
+
+function visualizePath(path, maxSamples)
+    -- Ghosts along a flat path, about one per params.ghostSpacing of joint travel and at most maxSamples
+    if not params.visualize then
+        return {}
+    end
+
+    local numJoints = #params.joints
+    assert(#path % numJoints == 0, "Path length is not a multiple of the number of joints")
+    local numConfigs = #path // numJoints
 
-    print(string.format("Visualized the path with %d passive shapes", numSamples))
+    -- Joint-space length of the path
+    local length = 0
+    for i = numJoints + 1, #path, numJoints do
+        local d = 0
+        for j = 0, numJoints - 1 do
+            d = d + (path[i + j] - path[i + j - numJoints]) ^ 2
+        end
+        length = length + math.sqrt(d)
+    end
 
-    return shapes
+    local numSamples = math.min(maxSamples, numConfigs, math.max(2, math.ceil(length / params.ghostSpacing)))
+    local ids = {}
+    for k = 0, numSamples - 1 do
+        local i = math.floor(k * (numConfigs - 1) / math.max(1, numSamples - 1)) * numJoints
+        ids[#ids + 1] = showGhost(table.move(path, i + 1, i + numJoints, 1, {}))
+    end
 
+    print(string.format("Visualized the path with %d ghosts", #ids))
+    return ids
 end
 
 -- Arm kinematics functions   ------------------------------------------------------------------------------------------
@@ -93,10 +155,15 @@ function moveToPose(pose)
     return result
 end
 
-function setConfig(c)
+function applyConfig(c)
+    -- Set joint positions without stepping the scene
     for i = 1, #params.joints do
         sim.setJointPosition(params.joints[i], c[i])
     end
+end
+
+function setConfig(c)
+    applyConfig(c)
     sim.step()
 end
 
@@ -115,6 +182,36 @@ function getCurrConfig()
     return c
 end
 
+function executePath(path, times)
+    -- Drive the joints along a timed path inside the simulation loop, returns once the arm has settled
+    local dt = sim.getSimulationTimeStep()
+    local totalTime = times[#times]
+    local t = times[1]
+
+    while t < totalTime do
+        t = math.min(t + dt, totalTime)
+        setTargetConfig(sim.getPathInterpolatedConfig(path, times, t))
+    end
+
+    -- Let the joints reach the last waypoint
+    local goal = sim.getPathInterpolatedConfig(path, times, totalTime)
+    local settleTime = 0
+    while settleTime < params.pathSettleTime do
+        local curr = getCurrConfig()
+        local maxErr = 0
+        for i = 1, #params.joints do
+            maxErr = math.max(maxErr, math.abs(curr[i] - goal[i]))
+        end
+        if maxErr < params.pathSettleTolerance then
+            break
+        end
+        sim.step()
+        settleTime = settleTime + dt
+    end
+
+    return true
+end
+
 function findConfigs(pose)
     local ikEnv = simIK.createEnvironment()
     local ikGroup = simIK.createGroup(ikEnv)
@@ -139,19 +236,11 @@ function collides(configs)
     local retVal = false
     local bufferedConfig = getCurrConfig()
     for i = 1, #configs do
-        setConfig(configs[i])
+        applyConfig(configs[i])
 
-        -- Collision detection with small threshold
-        local res, collidingObjs = sim.checkCollision(params.robotCollection, sim.handle_all)
-        if res > 0 then
+        if checkConfigCollision() then
             retVal = true
             break
-        else
-            local res, collidingObjs = sim.checkCollision(params.robotCollection, params.robotCollection)
-            if res > 0 then
-                retVal = true
-                break
-            end
         end
     end
     
@@ -159,19 +248,65 @@ function collides(configs)
     return retVal
 end
 
+function checkConfigCollision()
+    -- Returns the colliding pair for the current joint positions, or nil
+    local res, collidingObjs = sim.checkCollision(params.robotCollection, sim.handle_all)
+    if res > 0 then
+        return collidingObjs
+    end
+    res, collidingObjs = sim.checkCollision(params.robotCollection, params.robotCollection)
+    if res > 0 then
+        return collidingObjs
+    end
+    return nil
+end
+
+function checkCollisions(flatConfigs)
+    -- Batched collision query over a flat array of configs
+    -- Returns a validity mask and the colliding pair for each config ({-1, -1} if valid)
+    local numJoints = #params.joints
+    assert(#flatConfigs % numJoints == 0, "Configs length is not a multiple of the number of joints")
+
+    local bufferedConfig = getCurrConfig()
+    local valid = {}
+    local collidingPairs = {}
+    local config = {}
+
+    for i = 1, #flatConfigs, numJoints do
+        for j = 1, numJoints do
+            config[j] = flatConfigs[i + j - 1]
+        end
+        applyConfig(config)
+
+        local collidingObjs = checkConfigCollision()
+        valid[#valid + 1] = collidingObjs == nil
+        collidingPairs[#collidingPairs + 1] = collidingObjs or {-1, -1}
+    end
+
+    -- Single step once the batch is done
+    setConfig(bufferedConfig)
+    return valid, collidingPairs
+end
+
 function selectOneValidConfig(configs)
+    -- First collision-free config, candidates come ranked best first from Python
+    -- Also returns the validity of every candidate, in the same order
     local retVal, passiveVizShape
+
+    local flatConfigs = {}
     for i = 1, #configs do
-        local target = configs[i]
-        if not collides({target}) then
-            if target then
-                retVal = target
-                passiveVizShape = createPassiveShape(target)
-                break
-            end
+        concatenateLists(flatConfigs, configs[i])
+    end
+    local valid = checkCollisions(flatConfigs)
+
+    for i = 1, #configs do
+        if valid[i] then
+            retVal = configs[i]
+            passiveVizShape = showGhost(retVal)
+            break
         end
     end
-    return retVal, passiveVizShape
+    return retVal, passiveVizShape, valid
 end
 
 -- OMPL functions   ------------------------------------------------------------------------------------------
@@ -199,30 +334,45 @@ function findPath(config)
     return result
 end
 
-function getPath(pose)
-    -- Move to pose
-    local configs = findConfigs(pose)
-    if #configs > 0 then
-        print(string.format('Found %i different configs corresponding to the desired pick pose. Now selecting an appropriate valid config...', #configs))
-        local pickConfig, passiveVizShape = selectOneValidConfig(configs)
-
-        if not pickConfig then
-            print('No valid configuration was found')
-            return false
-        end
-
-        print('Selected following pick config: ', (Vector(pickConfig) * 180.0 / math.pi):data())
-        
-        local path = findPath(pickConfig)
-        if path then
-            print('Found a path from the current config to the pick config!')
-            return path, passiveVizShape
-        else
-            print('Failed finding a path from the current config to the pick config. Try increasing the search times.')
-        end 
+function getGoalConfig(pose, configs)
+    -- Select the first valid config for pose from the candidates ranked by the caller, simIK's in its order otherwise
+    if configs and #configs > 0 then
+        sim.setObjectPose(params.robotTarget, pose)
     else
+        configs = findConfigs(pose)
+    end
+    if #configs == 0 then
         print('Failed finding a config corresponding to the desired pick pose.')
+        return false
+    end
+
+    print(string.format('Found %i different configs corresponding to the desired pick pose. Now selecting an appropriate valid config...', #configs))
+    local goalConfig, passiveVizShape, valid = selectOneValidConfig(configs)
+
+    if not goalConfig then
+        print('No valid configuration was found')
+        return false
+    end
+
+    print('Selected following pick config: ', (Vector(goalConfig) * 180.0 / math.pi):data())
+    return goalConfig, passiveVizShape, valid
+end
+
+function getPath(pose, configs)
+    -- Move to pose
+    local pickConfig, passiveVizShape, valid = getGoalConfig(pose, configs)
+    if not pickConfig then
+        return false
     end
+
+    local path = findPath(pickConfig)
+    if path then
+        print('Found a path from the current config to the pick config!')
+        return path, passiveVizShape, valid
+    else
+        print('Failed finding a path from the current config to the pick config. Try increasing the search times.')
+    end 
+    releaseGhosts({passiveVizShape or -1})
     return false
 end
 
@@ -237,6 +387,33 @@ function detectSuctionSensor()
     return false
 end
 
+function getSuctionSensorDistance()
+    -- Distance to the closest surface in the sensor volume, -1 if nothing is in range
+    local result, distance = sim.handleProximitySensor(params.suctionSensor)
+    if result > 0 then
+        return distance
+    end
+    return -1
+end
+
+function descendUntilContact(step, maxSteps)
+    -- Lower the target in small IK steps until the suction sensor triggers, all in one call
+    local pose = sim.getObjectPose(params.robotTarget, -1)
+    for i = 1, maxSteps do
+        local object = detectSuctionSensor()
+        if object then
+            return object
+        end
+
+        pose[3] = pose[3] - step
+        sim.setObjectPose(params.robotTarget, pose)
+        if not moveToPose(pose) then
+            return false
+        end
+    end
+    return detectSuctionSensor()
+end
+
 function toggleSuction(detectedObject, state)
     if not state then
         sim.setObjectParent(detectedObject, params.suction, true)
@@ -252,6 +429,15 @@ function toggleSuction(detectedObject, state)
     end
 end
 
+-- Camera functions   ------------------------------------------------------------------------------------------
+
+function captureRGBD(sensorHandle)
+    -- RGB and depth from the same simulation step in one call
+    local img, resolution = sim.getVisionSensorImg(sensorHandle)
+    local depth = sim.getVisionSensorDepth(sensorHandle)
+    return img, depth, resolution, sim.getSimulationTime()
+end
+
 -- System functions   ------------------------------------------------------------------------------------------
 
 function sysCall_init()
@@ -296,6 +482,17 @@ function sysCall_init()
     params.robotCollection = sim.createCollection()
     sim.addItemToCollection(params.robotCollection, sim.handle_tree, params.robotBase, 0)
 
+    -- Joint limits as {min, max}
+    params.jointLimits = {}
+    for i = 1, 6 do
+        local cyclic, interval = sim.getJointInterval(params.joints[i])
+        if cyclic then
+            params.jointLimits[i] = {-math.pi, math.pi}
+        else
+            params.jointLimits[i] = {interval[1], interval[1] + interval[2]}
+        end
+    end
+
     params.pathPlanningMaxTime = 10.0
     params.pathPlanningMaxSimplificationTime = 2.0
     params.pathPlanningResolution = 0.01
@@ -326,50 +523,31 @@ function sysCall_init()
 
     params.movementDuration = 5.0
 
-end
-
-function getParams()
-    return params    
-end
-
-
-function visualizePath(path, numSamples)
-    assert(numSamples > 0, "Number of samples must be greater than 0")
-
-    local numJoints = #params.joints -- Number of joints in the robot
-    assert(#path % numJoints == 0, "Path length is not a multiple of the number of joints")
-
-    -- Reshape the path into configurations
-    local configs = {}
-    for i = 1, #path, numJoints do
-        local config = {}
-        for j = 0, numJoints - 1 do
-            table.insert(config, path[i + j])
-        end
-        table.insert(configs, config)
-    end
+    -- Path execution
+    params.pathSettleTime = 1.0
+    params.pathSettleTolerance = 0.001
 
-    -- Determine the sampling step
-    local step = math.max(1, math.floor(#configs / numSamples))
-    local shapes = {}
+    -- Visualization, enabled by the client
+    params.visualize = false
+    params.ghostSpacing = 0.3
 
-    -- Create passive shapes for sampled configurations
-    for i = 1, #configs, step do
-        local config = configs[i]
-        local shape = createPassiveShape(config)
-        table.insert(shapes, shape)
-    end
+end
 
-    print(string.format("Visualized the path with %d passive shapes", #shapes))
-    return shapes
+function sysCall_cleanup()
+    removeGhosts()
 end
 
+function getParams()
+    return params    
+end
 
-function findHomeTargetPath(location)
+function findHomeTargetPath(location, configs)
 
     -- Find all configs
-    local configs = findConfigs(location)
-    local validConf, passive = selectOneValidConfig(configs)
+    if not configs or #configs == 0 then
+        configs = findConfigs(location)
+    end
+    local validConf, passive, valid = selectOneValidConfig(configs)
 
     if validConf == nil then
         print('no valid conf found for ', location)
@@ -383,12 +561,45 @@ function findHomeTargetPath(location)
     local p = {}
     p.path = path
     p.config = validConf
+    p.valid = valid
 
-    sim.removeObjects({passive})
+    releaseGhosts({passive or -1})
 
     return p
 end
 
+function getSceneFingerprint()
+    -- Handles and poses of the static collidable shapes around the arm, used to detect stale cached motions
+    local robotShapes = {}
+    for _, h in ipairs(sim.getObjectsInTree(params.robotBase, sim.sceneobject_shape)) do
+        robotShapes[h] = true
+    end
+
+    local fingerprint = {}
+    for _, h in ipairs(sim.getObjectsInTree(sim.handle_scene, sim.sceneobject_shape)) do
+        if not robotShapes[h] and sim.getBoolProperty(h, 'collidable') and not sim.getBoolProperty(h, 'dynamic') then
+            fingerprint[#fingerprint + 1] = h
+            concatenateLists(fingerprint, sim.getObjectPose(h, -1))
+        end
+    end
+    return fingerprint
+end
+
+function getMotionContext()
+    -- Everything a planned motion depends on besides its goal
+    local ctx = {}
+    ctx.config = getCurrConfig()
+    ctx.fingerprint = getSceneFingerprint()
+    ctx.planner = {
+        pathPlanningMaxTime = params.pathPlanningMaxTime,
+        pathPlanningMaxSimplificationTime = params.pathPlanningMaxSimplificationTime,
+        pathPlanningResolution = params.pathPlanningResolution,
+        pathNStates = params.pathNStates,
+        pathPlanningAlgo = params.pathPlanningAlgo
+    }
+    return ctx
+end
+
 function initialParams(b) 
     if b then
         params.pathPlanningMaxTime = 20.0
@@ -0,0 +1,286 @@
+"""
+    End-to-end throughput benchmark: prompt parsing -> detection -> pick and place, against the local simulator stand-in.
+    Reports per-stage and end-to-end latency percentiles, commands per minute, remote call counts and peak memory,
+    and flags regressions against a stored baseline.
+    Arm motions and demo pauses advance the stand-in's simulated time instead of sleeping, so latencies measure the
+    pipeline itself and the scheduled motion time is reported separately.
+    Run from src/: python -m benchmarks.e2e --parser fast --json e2e.json --baseline e2e_baseline.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import resource
+
+import numpy as np
+
+import utils
+import instrumentation
+
+from arm import RobotArm
+from vision.camera import Camera
+from motion_cache import MotionCache
+from nlp.fast_parser import CommandParser, load_lexicon
+from fake_sim import FakeSim, FakeScene, FakeDetector, SCRIPT, CAMERA
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LLM_PATH = os.path.join(PROJECT_DIR, 'nlp/flan-t5-finetuned')
+
+STAGES = ('parse', 'detect', 'pick_and_place', 'command')
+
+# Metrics compared against the baseline, True when higher is better
+BASELINE_METRICS = {
+    'commands_per_min': True,
+    'success_rate': True,
+    'rpc_per_command': False,
+    'peak_rss_mb': False,
+    **{f'{stage}.{p}': False for stage in STAGES for p in ('p50', 'p95')}
+}
+
+# Latency changes smaller than this are timer noise, whatever their relative size
+MIN_LATENCY_CHANGE_MS = 1.0
+
+
+def peak_rss_mb():
+    """Peak resident memory of this process"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2**20 if sys.platform == 'darwin' else peak / 1024
+
+
+def build_corpus(lexicon, items, locations, n, seed=0):
+    """
+        Commands in the finetuning grammar, mixing 1, 2 and 3 tasks like dataset_creation.py.
+        Items are distinct within a command so each one is still on the table when its turn comes.
+    """
+    rng = random.Random(seed)
+    corpus = []
+    for _ in range(n):
+        n_tasks = rng.choices((1, 2, 3), weights=(0.6, 0.3, 0.1))[0]
+        clauses = []
+        for item in rng.sample(sorted(items), n_tasks):
+            location = rng.choice(sorted(locations))
+            clauses.append(
+                f"{rng.choice(lexicon['verbs'])} the {rng.choice(lexicon['items'][item])} "
+                f"{rng.choice(lexicon['adverbs'])} the {rng.choice(lexicon['locations'][location])}"
+            )
+        corpus.append(f" {rng.choice(lexicon['connectors'])} ".join(clauses))
+    return corpus
+
+
+def percentiles(values):
+    values = np.asarray(values, dtype=np.float64) * 1000
+    if len(values) == 0:
+        return {'count': 0}
+    return {
+        'count': len(values),
+        'mean': float(values.mean()),
+        'p50': float(np.percentile(values, 50)),
+        'p95': float(np.percentile(values, 95)),
+        'p99': float(np.percentile(values, 99)),
+        'max': float(values.max())
+    }
+
+
+def make_parser(args, lexicon):
+    """Returns prompt -> pairs, either the LLM (optionally with its fast path) or the grammar parser alone"""
+    if args.parser == 'fast':
+        return CommandParser(lexicon).parse
+
+    from nlp.llm import LLM
+    fast_parser = CommandParser(lexicon) if args.fast_parser else None
+    llm = LLM(args.model, set(lexicon['items']), set(lexicon['locations']), True, fast_parser=fast_parser, mode=args.llm_mode)
+    return llm.process_prompt
+
+
+def run(args):
+    lexicon = load_lexicon()
+    scene = FakeScene(seed=args.seed)
+    corpus = build_corpus(lexicon, scene.items, scene.locations, args.commands, seed=args.seed)
+
+    instrumentation.tracer.enable()
+    fake = FakeSim(scene, latency=args.latency)
+    sim = instrumentation.wrap_sim(fake)
+
+    start = time.perf_counter()
+    parse = make_parser(args, lexicon)
+    detector = FakeDetector(fake)
+    camera = Camera(sim, CAMERA, SCRIPT, scene.table_height)
+    arm = RobotArm(sim, SCRIPT, analytic_ik=args.analytic_ik, descent=args.descent,
+                   upload_paths=args.upload_paths, motion_cache=MotionCache(), time_optimal=args.time_optimal,
+                   sleep=fake.wait)
+    arm.calculate_home_target_trajectories(scene.locations, execute=False)
+    setup_s = time.perf_counter() - start
+
+    instrumentation.tracer.reset()
+    timings = {stage: [] for stage in STAGES}
+    motion, cycle = [], []
+    succeeded = 0
+    motion_start = arm.motion_time
+    bench_start = time.perf_counter()
+
+    for prompt in corpus:
+        # Every command replays the same scene
+        fake.scene.reset()
+        command_start = time.perf_counter()
+
+        t = time.perf_counter()
+        pairs = parse(prompt)
+        timings['parse'].append(time.perf_counter() - t)
+
+        ok = isinstance(pairs, list) and len(pairs) > 0
+        for item, location in (pairs if ok else []):
+            t = time.perf_counter()
+            coords = utils.detect_objects(sim, detector, camera, item)
+            timings['detect'].append(time.perf_counter() - t)
+            if not coords:
+                ok = False
+                break
+
+            t = time.perf_counter()
+            ok = arm.pick_and_place(coords, location)
+            timings['pick_and_place'].append(time.perf_counter() - t)
+            if not ok:
+                break
+            motion.append(arm.last_pick_stats['motion_seconds'])
+
+            # The stand-in doesn't block while the arm moves, a pick takes its measured time plus the motion
+            cycle.append(arm.last_pick_stats['seconds'] + arm.last_pick_stats['motion_seconds'])
+
+        timings['command'].append(time.perf_counter() - command_start)
+        succeeded += bool(ok)
+
+    wall = time.perf_counter() - bench_start
+    rpc = {name: len(stats.latencies) for name, stats in instrumentation.tracer.calls.items()}
+    total_rpc = sum(rpc.values())
+
+    return {
+        'config': {k: v for k, v in vars(args).items() if k not in ('json', 'baseline', 'save_baseline', 'threshold_overrides')},
+        'setup_s': setup_s,
+        'wall_s': wall,
+        'commands': len(corpus),
+        'commands_per_min': len(corpus) / wall * 60,
+        'success_rate': succeeded / len(corpus),
+        'stages': {stage: percentiles(values) for stage, values in timings.items()},
+        'motion_s': arm.motion_time - motion_start,
+        'pick_motion': percentiles(motion),
+        'pick_cycle': percentiles(cycle),
+        'rpc_total': total_rpc,
+        'rpc_per_command': total_rpc / len(corpus),
+        'rpc': dict(sorted(rpc.items(), key=lambda kv: -kv[1])),
+        'latency': instrumentation.tracer.stats(),
+        'peak_rss_mb': peak_rss_mb()
+    }
+
+
+def metric(report, name):
+    if '.' in name:
+        stage, key = name.split('.')
+        return report['stages'].get(stage, {}).get(key)
+    return report.get(name)
+
+
+def compare(report, baseline, threshold, overrides=None):
+    """Relative change of each baseline metric, regressions are changes in the bad direction beyond the threshold"""
+    overrides = overrides or {}
+    rows = []
+    for name, higher_is_better in BASELINE_METRICS.items():
+        new, old = metric(report, name), metric(baseline, name)
+        if new is None or old is None or old == 0:
+            continue
+        change = (new - old) / abs(old)
+        worse = -change if higher_is_better else change
+        limit = overrides.get(name, threshold)
+        regressed = worse > limit and not ('.' in name and abs(new - old) < MIN_LATENCY_CHANGE_MS)
+        rows.append({'metric': name, 'baseline': old, 'current': new, 'change': change, 'limit': limit, 'regressed': regressed})
+    return rows
+
+
+def print_report(report):
+    print(f"\n{report['commands']} commands in {report['wall_s']:.1f}s (setup {report['setup_s']:.1f}s): "
+          f"{report['commands_per_min']:.1f} commands/min, success rate {report['success_rate']:.3f}")
+    print(f"Scheduled arm motion {report['motion_s']:.1f}s, not included in the wall time")
+    print(f"{report['rpc_per_command']:.1f} remote calls per command, peak RSS {report['peak_rss_mb']:.0f} MB")
+    if report['pick_motion']['count']:
+        print(f"Scheduled arm motion per pick: p50 {report['pick_motion']['p50'] / 1000:.2f}s, p95 {report['pick_motion']['p95'] / 1000:.2f}s")
+        print(f"Cycle time per pick, measured plus motion: p50 {report['pick_cycle']['p50'] / 1000:.2f}s, p95 {report['pick_cycle']['p95'] / 1000:.2f}s")
+    print()
+
+    print(f"{'stage':<16} {'count':>6} {'mean ms':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for stage, s in report['stages'].items():
+        if s['count']:
+            print(f"{stage:<16} {s['count']:>6} {s['mean']:>9.2f} {s['p50']:>9.2f} {s['p95']:>9.2f} {s['p99']:>9.2f} {s['max']:>9.2f}")
+
+    print(f"\n{'remote call':<40} {'count':>7}")
+    for name, count in list(report['rpc'].items())[:15]:
+        print(f"{name:<40} {count:>7}")
+
+
+def parse_overrides(values):
+    overrides = {}
+    for value in values or []:
+        name, limit = value.split('=')
+        if name not in BASELINE_METRICS:
+            raise ValueError(f'Unknown metric {name}, expected one of {list(BASELINE_METRICS)}')
+        overrides[name] = float(limit)
+    return overrides
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end pick and place benchmark on the simulator stand-in")
+    parser.add_argument("--commands", type=int, default=50, help="Number of prompts in the corpus")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the corpus and of the scene layout")
+    parser.add_argument("--latency", type=float, default=0.0005, help="Seconds added to every remote call")
+    parser.add_argument("--parser", choices=['llm', 'fast'], default='llm', help="Parse with the LLM or the grammar parser only")
+    parser.add_argument("--model", default=LLM_PATH, help="LLM model directory or HuggingFace name")
+    parser.add_argument("--llm_mode", default='default', help="LLM inference mode")
+    parser.add_argument("--fast_parser", action="store_true", help="Let the LLM use its fast path")
+    parser.add_argument("--analytic_ik", action="store_true")
+    parser.add_argument("--descent", choices=['step', 'guided'], default='step')
+    parser.add_argument("--upload_paths", action="store_true")
+    parser.add_argument("--time_optimal", action="store_true")
+    parser.add_argument("--json", help="Write the report to this file")
+    parser.add_argument("--baseline", help="Baseline report to compare against")
+    parser.add_argument("--save_baseline", action="store_true", help="Write the report to --baseline instead of comparing")
+    parser.add_argument("--threshold", type=float, default=0.1, help="Allowed relative regression of each metric")
+    parser.add_argument("--threshold_overrides", nargs='*', metavar='METRIC=LIMIT', help="Per-metric limits, e.g. pick_and_place.p95=0.2")
+    args = parser.parse_args()
+    if args.time_optimal and not args.upload_paths:
+        parser.error('--time_optimal requires --upload_paths')
+
+    overrides = parse_overrides(args.threshold_overrides)
+    report = run(args)
+    print_report(report)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if not args.baseline:
+        return 0
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f'\nSaved baseline to {args.baseline}')
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+
+    rows = compare(report, baseline, args.threshold, overrides)
+    print(f"\n{'metric':<24} {'baseline':>10} {'current':>10} {'change':>8} {'limit':>7}")
+    for r in rows:
+        flag = '  REGRESSION' if r['regressed'] else ''
+        print(f"{r['metric']:<24} {r['baseline']:>10.2f} {r['current']:>10.2f} {r['change']:>+8.1%} {r['limit']:>7.0%}{flag}")
+
+    regressions = [r['metric'] for r in rows if r['regressed']]
+    if regressions:
+        print(f"\n{len(regressions)} regression(s): {', '.join(regressions)}")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,113 @@
+"""
+    Compare LLM inference modes on latency, memory footprint and parse accuracy.
+    Each mode runs in a fresh process so its memory readings don't include the modes before it.
+    Run from src/: python -m benchmarks.llm_modes --dataset ../llm_finetuning/finetune_dataset.csv
+"""
+import io
+import os
+import gc
+import json
+import time
+import argparse
+import resource
+import multiprocessing
+
+from concurrent.futures import ProcessPoolExecutor
+
+import torch
+import pandas as pd
+
+from nlp.llm import LLM, INFERENCE_MODES, evaluate_model
+from nlp.fast_parser import load_lexicon
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LLM_PATH = os.path.join(PROJECT_DIR, 'nlp/flan-t5-finetuned')
+
+
+def rss_mb():
+    """Current resident memory of this process, peak memory without psutil"""
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss / 2**20
+    except ImportError:
+        return peak_rss_mb()
+
+
+def peak_rss_mb():
+    """Peak resident memory of this process"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def model_mb(model):
+    """Serialized weight size, None for models that aren't torch modules"""
+    if not isinstance(model, torch.nn.Module):
+        return None
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return buffer.tell() / 2**20
+
+
+def benchmark_mode(mode, model_path, data, batch_size):
+    lexicon = load_lexicon()
+    items, locations = lexicon['items'], lexicon['locations']
+
+    gc.collect()
+    rss_before = rss_mb()
+    start = time.perf_counter()
+    llm = LLM(model_path, set(items), set(locations), True, mode=mode)
+    load_time = time.perf_counter() - start
+    rss_after = rss_mb()
+
+    results = evaluate_model(llm, data, batch_size=batch_size)
+
+    report = {
+        'mode': mode,
+        'load_s': load_time,
+        'rss_delta_mb': rss_after - rss_before,
+        'peak_rss_mb': peak_rss_mb(),
+        'model_mb': model_mb(llm.model),
+        'throughput': results['throughput'],
+        'latency_p50': results['latency']['p50'],
+        'latency_p95': results['latency']['p95'],
+        'success_rate': results['success_rate'],
+        **results['metrics']
+    }
+
+    del llm
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark LLM inference modes")
+    parser.add_argument("--dataset", required=True, help="CSV generated by dataset_creation.py")
+    parser.add_argument("--model", default=LLM_PATH, help="Model directory or HuggingFace name")
+    parser.add_argument("--modes", nargs='+', default=list(INFERENCE_MODES), choices=INFERENCE_MODES)
+    parser.add_argument("--limit", type=int, default=200, help="Number of prompts to evaluate")
+    parser.add_argument("--batch_size", type=int, default=1)
+    parser.add_argument("--json", help="Write the results to this file")
+    args = parser.parse_args()
+
+    data = pd.read_csv(args.dataset).head(args.limit)
+
+    reports = []
+    for mode in args.modes:
+        print(f"Benchmarking {mode}...")
+        try:
+            with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+                reports.append(executor.submit(benchmark_mode, mode, args.model, data, args.batch_size).result())
+        except ImportError as e:
+            print(f"Skipping {mode}: {e}")
+
+    print(f"\n{'mode':<8} {'load s':>8} {'rss MB':>8} {'peak MB':>8} {'model MB':>9} {'prompt/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'success':>8} {'f1':>6}")
+    for r in reports:
+        model_size = f"{r['model_mb']:.0f}" if r['model_mb'] is not None else '-'
+        print(f"{r['mode']:<8} {r['load_s']:>8.1f} {r['rss_delta_mb']:>8.0f} {r['peak_rss_mb']:>8.0f} {model_size:>9} {r['throughput']:>9.2f} "
+              f"{r['latency_p50'] * 1000:>8.1f} {r['latency_p95'] * 1000:>8.1f} {r['success_rate']:>8.3f} {r['f1']:>6.3f}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(reports, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
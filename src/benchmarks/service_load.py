@@ -0,0 +1,205 @@
+"""
+    Load generator for the service mode: concurrent clients submit commands over HTTP and poll their jobs.
+    Reports sustained jobs/min, queueing latency (submission until the arm starts the job), parse and end-to-end
+    latency, and how many submissions were rejected by backpressure.
+    Without --url the service is started in-process against the simulator stand-in with the grammar parser.
+    Run from src/: python -m benchmarks.service_load --jobs 100 --clients 8
+"""
+import sys
+import json
+import time
+import argparse
+import threading
+import urllib.request
+import urllib.error
+
+import numpy as np
+
+import utils
+
+from arm import RobotArm
+from vision.camera import Camera
+from motion_cache import MotionCache
+from service import JobService, make_server, FINISHED
+from nlp.fast_parser import CommandParser, load_lexicon
+from fake_sim import FakeSim, FakeScene, FakeDetector, SCRIPT, CAMERA
+from benchmarks.e2e import build_corpus
+
+
+def request(method, url, body=None):
+    """Returns the status code and the decoded JSON body, error statuses included"""
+    data = json.dumps(body).encode() if body is not None else None
+    req = urllib.request.Request(url, data=data, method=method, headers={'Content-Type': 'application/json'})
+    try:
+        with urllib.request.urlopen(req) as res:
+            return res.status, json.loads(res.read())
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read() or b'null')
+
+
+def start_local_service(args):
+    """Service on the simulator stand-in, every job replays the same scene like the e2e benchmark"""
+    scene = FakeScene(seed=args.seed)
+    fake = FakeSim(scene, latency=args.latency)
+    detector = FakeDetector(fake)
+    camera = Camera(fake, CAMERA, SCRIPT, scene.table_height)
+    # Uploaded paths run in simulated time on the stand-in, streamed ones would sleep through every waypoint
+    arm = RobotArm(fake, SCRIPT, upload_paths=True, motion_cache=MotionCache())
+    arm.calculate_home_target_trajectories(scene.locations, execute=False)
+    parser = CommandParser(load_lexicon())
+
+    def parse(prompts):
+        return [parser.parse(prompt) or 'Error: prompt not understood' for prompt in prompts]
+
+    def execute(task):
+        if task['index'] == 0:
+            fake.scene.reset()
+        coords = utils.detect_objects(fake, detector, camera, task['item'])
+        return bool(coords) and arm.pick_and_place(coords, task['location'])
+
+    service = JobService(parse, execute, queue_size=args.queue_size)
+    server = make_server(service, '127.0.0.1', 0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f'http://127.0.0.1:{server.server_address[1]}', service, server, scene
+
+
+def client(url, prompts, args, submitted, lock):
+    """Submit prompts, at --rate when given, retrying rejected submissions after a short backoff"""
+    interval = args.clients / args.rate if args.rate else 0.0
+    next_at = time.perf_counter()
+    for prompt in prompts:
+        if interval:
+            time.sleep(max(0.0, next_at - time.perf_counter()))
+            next_at += interval
+
+        while True:
+            sent = time.perf_counter()
+            status, body = request('POST', f'{url}/jobs', {'prompt': prompt})
+            if status == 202:
+                with lock:
+                    submitted['jobs'][body['id']] = sent
+                break
+            if status != 503:
+                raise RuntimeError(f'Submission failed with {status}: {body}')
+            with lock:
+                submitted['rejected'] += 1
+            time.sleep(args.backoff)
+
+
+def wait_for_jobs(url, ids, poll):
+    """Poll until every job finished, returns their final descriptions"""
+    finished = {}
+    while len(finished) < len(ids):
+        for job_id in ids:
+            if job_id not in finished:
+                status, body = request('GET', f'{url}/jobs/{job_id}')
+                if status == 200 and body['status'] in FINISHED:
+                    finished[job_id] = body
+        time.sleep(poll)
+    return finished
+
+
+def seconds_percentiles(values):
+    values = np.asarray([v for v in values if v is not None], dtype=np.float64)
+    if len(values) == 0:
+        return {'count': 0}
+    return {
+        'count': len(values),
+        'mean': float(values.mean()),
+        'p50': float(np.percentile(values, 50)),
+        'p95': float(np.percentile(values, 95)),
+        'max': float(values.max())
+    }
+
+
+def run(args):
+    service = server = None
+    if args.url:
+        url, items, locations = args.url.rstrip('/'), None, None
+    else:
+        url, service, server, scene = start_local_service(args)
+        items, locations = scene.items, scene.locations
+
+    lexicon = load_lexicon()
+    corpus = build_corpus(lexicon, items or lexicon['items'], locations or lexicon['locations'], args.jobs, seed=args.seed)
+
+    submitted = {'jobs': {}, 'rejected': 0}
+    lock = threading.Lock()
+    threads = [
+        threading.Thread(target=client, args=(url, corpus[i::args.clients], args, submitted, lock))
+        for i in range(args.clients)
+    ]
+
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    submit_s = time.perf_counter() - start
+
+    jobs = wait_for_jobs(url, list(submitted['jobs']), args.poll)
+
+    # Wall time from the first submission to the last job finishing, from the server-side durations
+    first = min(submitted['jobs'].values())
+    last = max(submitted['jobs'][job_id] + job['total_s'] for job_id, job in jobs.items())
+    wall = last - first
+    done = sum(job['status'] == 'done' for job in jobs.values())
+    server_stats = request('GET', f'{url}/stats')[1]
+
+    if server:
+        server.shutdown()
+        service.close()
+
+    return {
+        'config': {k: v for k, v in vars(args).items() if k != 'json'},
+        'jobs': len(jobs),
+        'done': done,
+        'failed': len(jobs) - done,
+        'rejected_submissions': submitted['rejected'],
+        'submit_s': submit_s,
+        'wall_s': wall,
+        'jobs_per_min': len(jobs) / wall * 60,
+        'latency_s': {
+            name: seconds_percentiles(job[f'{name}_s'] for job in jobs.values())
+            for name in ('queued', 'parse', 'run', 'total')
+        },
+        'server': server_stats
+    }
+
+
+def print_report(report):
+    print(f"\n{report['jobs']} jobs ({report['done']} done, {report['failed']} failed) in {report['wall_s']:.1f}s: "
+          f"{report['jobs_per_min']:.1f} jobs/min sustained")
+    print(f"{report['rejected_submissions']} submissions rejected by backpressure, all submitted after {report['submit_s']:.1f}s\n")
+
+    print(f"{'latency':<10} {'count':>6} {'mean s':>8} {'p50 s':>8} {'p95 s':>8} {'max s':>8}")
+    for name, s in report['latency_s'].items():
+        if s['count']:
+            print(f"{name:<10} {s['count']:>6} {s['mean']:>8.3f} {s['p50']:>8.3f} {s['p95']:>8.3f} {s['max']:>8.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the HTTP service mode")
+    parser.add_argument("--url", default=None, help="Running service, e.g. http://127.0.0.1:8000. Started in-process on the simulator stand-in when omitted")
+    parser.add_argument("--jobs", type=int, default=60, help="Commands to submit")
+    parser.add_argument("--clients", type=int, default=4, help="Concurrent submitting clients")
+    parser.add_argument("--rate", type=float, default=None, help="Total submissions per second, as fast as accepted when omitted")
+    parser.add_argument("--backoff", type=float, default=0.05, help="Seconds before retrying a rejected submission")
+    parser.add_argument("--poll", type=float, default=0.05, help="Seconds between job status polls")
+    parser.add_argument("--queue_size", type=int, default=16, help="Queue size of the in-process service")
+    parser.add_argument("--latency", type=float, default=0.0005, help="Seconds added to every remote call of the in-process simulator")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="Write the report to this file")
+    args = parser.parse_args()
+
+    report = run(args)
+    print_report(report)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
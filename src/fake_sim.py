@@ -0,0 +1,500 @@
+"""
+    Local stand-in for the CoppeliaSim remote API.
+    Implements the subset of `sim` and the armlua.lua entry points this project uses, on top of a
+    synthetic, replayable scene, so the Python pipeline can be profiled and tested without a simulator.
+"""
+import copy
+import time
+import numpy as np
+
+from types import SimpleNamespace
+from scipy.spatial.transform import Rotation as R
+
+from kinematics import UR5Kinematics, _dh_transforms
+
+# Handles
+BASE, TIP, TARGET, SUCTION_SENSOR, CAMERA, SCRIPT = 1, 2, 3, 4, 20, 30
+JOINTS = [10, 11, 12, 13, 14, 15]
+FIRST_ITEM = 100
+FIRST_SHAPE = 1000
+
+# Robot on a table, bins as in main.LOCATIONS, items on the table in front of the robot
+TABLE_HEIGHT = 0.45
+ROBOT_BASE = [0.05, 0.0, TABLE_HEIGHT]
+
+DEFAULT_ITEMS = {
+    'sugar_box': {'position': [-0.15, -0.35], 'size': [0.09, 0.05], 'height': 0.175, 'color': [200, 200, 60]},
+    'large_clamp': {'position': [0.05, -0.45], 'size': [0.12, 0.08], 'height': 0.035, 'color': [40, 40, 40]},
+    'tuna_fish_can': {'position': [0.25, -0.35], 'size': [0.085, 0.085], 'height': 0.035, 'color': [120, 120, 200]},
+    'master_chef_can': {'position': [0.10, -0.25], 'size': [0.10, 0.10], 'height': 0.14, 'color': [60, 120, 200]}
+}
+
+DEFAULT_LOCATIONS = {
+    'redBin': [0.570, 0.375, 0.6],
+    'yellowBin': [0.050, 0.375, 0.6],
+    'blueBin': [-0.450, 0.375, 0.6]
+}
+
+
+class FakeScene:
+    """
+        Table top items as axis aligned boxes, randomizable with a seed and restorable for replays.
+        Item heights are above the table.
+    """
+    def __init__(self, items=None, locations=None, seed=None, jitter=0.03):
+        self.items = copy.deepcopy(items if items is not None else DEFAULT_ITEMS)
+        self.locations = copy.deepcopy(locations if locations is not None else DEFAULT_LOCATIONS)
+        self.table_height = TABLE_HEIGHT
+
+        if seed is not None:
+            rng = np.random.default_rng(seed)
+            for item in self.items.values():
+                item['position'] = (np.asarray(item['position']) + rng.uniform(-jitter, jitter, 2)).tolist()
+
+        for i, (name, item) in enumerate(sorted(self.items.items())):
+            item['handle'] = FIRST_ITEM + i
+            item['name'] = name
+            item['on_table'] = True
+
+        self._initial = copy.deepcopy(self.items)
+
+    def reset(self):
+        self.items = copy.deepcopy(self._initial)
+
+    def by_handle(self, handle):
+        return next((item for item in self.items.values() if item['handle'] == handle), None)
+
+    def top(self, item):
+        return self.table_height + item['height']
+
+    def table_items(self):
+        return [item for item in self.items.values() if item['on_table']]
+
+    def item_below(self, xy):
+        """Table item whose footprint contains xy"""
+        for item in self.table_items():
+            half = np.asarray(item['size']) / 2
+            if np.all(np.abs(np.asarray(xy) - item['position']) <= half):
+                return item
+        return None
+
+
+class FakeSim:
+    """
+        Fake `sim` module. Lua entry points are dispatched from callScriptFunction to lua_* methods.
+        latency: seconds slept on every remote call, to emulate the ZMQ round trip
+    """
+    # Constants read from the sim module
+    handle_all = -2
+    visionintparam_resolution_x = 1002
+    visionintparam_resolution_y = 1003
+    visionfloatparam_perspective_angle = 1004
+    visionfloatparam_near_clipping = 1000
+    visionfloatparam_far_clipping = 1001
+
+    def __init__(self, scene=None, latency=0.0, resolution=256, camera_height=1.6):
+        self.scene = scene if scene is not None else FakeScene()
+        self.latency = latency
+        self.calls = 0
+
+        base = np.eye(4)
+        base[:3, 3] = ROBOT_BASE
+        self.kinematics = UR5Kinematics(base=base)
+        self.home_config = np.zeros(6)
+        self.config = self.home_config.copy()
+        self.down_quat = R.from_euler('x', np.pi).as_quat().tolist()  # Tip z axis pointing down
+        self.target_pose = self.kinematics.fk_pose(self.config)[0].tolist()
+        self.attached = None
+        self.sim_time = 0.0
+        self.next_shape = FIRST_SHAPE
+        self.visualize = False
+
+        # Overhead camera looking straight down
+        self.resolution = resolution
+        self.camera_height = camera_height
+        self.camera_xy = np.array([0.05, -0.35])
+        self.view_angle = np.deg2rad(70)
+        self.near, self.far = 0.01, 3.0
+
+        self.planner = {}
+        self.lua_initialParams(False)
+
+    def reset(self):
+        """Restore the initial scene and arm state to replay a run"""
+        self.scene.reset()
+        self.config = self.home_config.copy()
+        self.target_pose = self.kinematics.fk_pose(self.config)[0].tolist()
+        self.attached = None
+        self.sim_time = 0.0
+        self.calls = 0
+        self.lua_initialParams(False)
+
+    def wait(self, seconds):
+        """Stand-in for the host side sleeps of RobotArm, advances simulated time without blocking"""
+        self.sim_time += seconds
+
+    # Remote API plumbing ----------------------------------------------------------------------------
+
+    def _rpc(self):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def callScriptFunction(self, name, script, *args):
+        self._rpc()
+        return getattr(self, 'lua_' + name)(*args)
+
+    def getObject(self, path):
+        self._rpc()
+        return {'/ArmControlScript': SCRIPT, '/camera/sensor': CAMERA, '/UR5': BASE}[path]
+
+    def startSimulation(self):
+        self._rpc()
+
+    def stopSimulation(self):
+        self._rpc()
+
+    def getSimulationTime(self):
+        self._rpc()
+        return self.sim_time
+
+    def removeObjects(self, handles):
+        self._rpc()
+
+    def getObjectMatrix(self, handle, relative_to):
+        self._rpc()
+        if handle == CAMERA:
+            T = np.eye(4)
+            T[:3, :3] = np.diag([1.0, -1.0, -1.0])
+            T[:3, 3] = [self.camera_xy[0], self.camera_xy[1], self.camera_height]
+        else:
+            T = self.kinematics.base
+        return T[:3, :].reshape(-1).tolist()
+
+    def getObjectPose(self, handle, relative_to=-1):
+        self._rpc()
+        if handle == TARGET:
+            return list(self.target_pose)
+        if handle == TIP:
+            return self._tip_pose().tolist()
+        item = self.scene.by_handle(handle)
+        return [*item['position'], self.scene.top(item), 0.0, 0.0, 0.0, 1.0]
+
+    def setObjectPose(self, handle, *args):
+        self._rpc()
+        pose = args[-1]  # Both (handle, relativeTo, pose) and (handle, pose)
+        if handle == TARGET:
+            self.target_pose = list(pose)
+
+    def setJointTargetPosition(self, handle, position):
+        self._rpc()
+        self.config[JOINTS.index(handle)] = position
+        self._update_attached()
+
+    def getObjectInt32Param(self, handle, param):
+        self._rpc()
+        return self.resolution
+
+    def getObjectFloatParam(self, handle, param):
+        self._rpc()
+        return {
+            self.visionfloatparam_perspective_angle: self.view_angle,
+            self.visionfloatparam_near_clipping: self.near,
+            self.visionfloatparam_far_clipping: self.far
+        }[param]
+
+    def getVisionSensorImg(self, handle):
+        self._rpc()
+        return self._render()[0], [self.resolution, self.resolution]
+
+    def getVisionSensorDepth(self, handle):
+        self._rpc()
+        return self._render()[1], [self.resolution, self.resolution]
+
+    # Scene model ------------------------------------------------------------------------------------
+
+    def _tip_pose(self, config=None):
+        config = self.config if config is None else config
+        return self.kinematics.fk_pose(config)[0]
+
+    def _update_attached(self):
+        if self.attached is not None:
+            tip = self._tip_pose()
+            self.attached['position'] = tip[:2].tolist()
+
+    def _focal(self):
+        return self.resolution / (2 * np.tan(self.view_angle / 2))
+
+    def _project(self, xy, height):
+        """Pixel coordinates of a world point in the unflipped sensor image"""
+        z = self.camera_height - height
+        f, c = self._focal(), self.resolution / 2
+        u = c - (xy[0] - self.camera_xy[0]) * f / z
+        v = c - (xy[1] - self.camera_xy[1]) * f / z
+        return u, v
+
+    def _render(self):
+        """Synthetic RGB and normalized depth buffers of the table"""
+        n, f, c = self.resolution, self._focal(), self.resolution / 2
+        v, u = np.mgrid[0:n, 0:n].astype(np.float64)
+
+        heights = np.full((n, n), self.scene.table_height)
+        rgb = np.full((n, n, 3), 150, dtype=np.uint8)
+
+        # Lowest first so taller items occlude
+        for item in sorted(self.scene.table_items(), key=lambda it: it['height']):
+            z = self.camera_height - self.scene.top(item)
+            x = self.camera_xy[0] + (c - u) * z / f
+            y = self.camera_xy[1] - (v - c) * z / f
+            half = np.asarray(item['size']) / 2
+            mask = (np.abs(x - item['position'][0]) <= half[0]) & (np.abs(y - item['position'][1]) <= half[1])
+            heights[mask] = self.scene.top(item)
+            rgb[mask] = item['color']
+
+        depth = ((self.camera_height - heights) - self.near) / (self.far - self.near)
+        return rgb.tobytes(), depth.astype(np.float32).tobytes()
+
+    def _collides(self, configs):
+        """A config collides when any of its links dips below the table"""
+        configs = np.atleast_2d(configs)
+        tips = self.kinematics.fk(configs)[:, 2, 3]
+        elbows = self.kinematics.base @ self._elbow_fk(configs)
+        return (tips < self.scene.table_height) | (elbows[:, 2, 3] < self.scene.table_height)
+
+    def _elbow_fk(self, configs):
+        k = self.kinematics
+        theta = configs + k.joint_offsets
+        T = _dh_transforms(theta[:, 0], k.d[0], k.a[0], k.alpha[0])
+        for i in (1, 2):
+            T = T @ _dh_transforms(theta[:, i], k.d[i], k.a[i], k.alpha[i])
+        return T
+
+    def _nearest_config(self, pose):
+        """Collision-free IK solution nearest the current config, like following the target with IK"""
+        configs = np.asarray(self.kinematics.valid_configs(pose)).reshape(-1, 6)
+        configs = configs[~self._collides(configs)] if len(configs) else configs
+        if len(configs) == 0:
+            return None
+        return configs[np.argmin(np.abs(configs - self.config).sum(axis=1))]
+
+    def _select_config(self, pose, configs=None):
+        """First collision-free IK solution in the given order and the validity of each, like selectOneValidConfig"""
+        configs = np.asarray(configs if configs else self.kinematics.valid_configs(pose)).reshape(-1, 6)
+        if len(configs) == 0:
+            return None, []
+        valid = ~self._collides(configs)
+        best = np.flatnonzero(valid)
+        return (configs[best[0]] if len(best) else None), valid.tolist()
+
+    def _plan(self, start, goal):
+        states = np.linspace(start, goal, self.planner['pathNStates'])
+        return states.reshape(-1).tolist()
+
+    def _new_shape(self):
+        self.next_shape += 1
+        return self.next_shape
+
+    # armlua.lua entry points ------------------------------------------------------------------------
+
+    def lua_getParams(self):
+        return {
+            'joints': JOINTS,
+            'robotTip': TIP,
+            'robotTarget': TARGET,
+            'robotBase': BASE,
+            'suctionSensor': SUCTION_SENSOR,
+            'homeConfig': self.home_config.tolist(),
+            'homePose': self.kinematics.fk_pose(self.home_config)[0].tolist(),
+            'downOriQuat': self.down_quat,
+            'heightDiff': 0.05,
+            'jointLimits': [[-np.pi, np.pi]] * 6,
+            'fkMaxVel': [120 * np.pi / 180] * 6,
+            'fkMaxAccel': [40 * np.pi / 180] * 6,
+            'fkMaxJerk': [60 * np.pi / 180] * 6,
+            **self.planner
+        }
+
+    def lua_initialParams(self, b):
+        self.planner = {
+            'pathPlanningMaxTime': 20.0 if b else 10.0,
+            'pathPlanningMaxSimplificationTime': 3.0 if b else 2.0,
+            'pathPlanningResolution': 0.01,
+            'pathNStates': 80 if b else 20,
+            'pathPlanningAlgo': 0
+        }
+
+    def lua_toggleCollisionBox(self, b):
+        pass
+
+    def lua_getCurrConfig(self):
+        return self.config.tolist()
+
+    def lua_getMotionContext(self):
+        return {'config': self.config.tolist(), 'fingerprint': [0, self.scene.table_height], 'planner': dict(self.planner)}
+
+    def lua_findConfigs(self, pose):
+        self.target_pose = list(pose)
+        return self.kinematics.valid_configs(pose)
+
+    def lua_checkCollisions(self, flat_configs):
+        collides = self._collides(np.asarray(flat_configs).reshape(-1, 6))
+        return (~collides).tolist(), [[BASE, -1] if c else [-1, -1] for c in collides]
+
+    def lua_getGoalConfig(self, pose, configs=None):
+        self.target_pose = list(pose)
+        config, valid = self._select_config(pose, configs)
+        if config is None:
+            return False
+        return config.tolist(), self.lua_showGhost(config), valid
+
+    def lua_findPath(self, config):
+        return self._plan(self.config, config)
+
+    def lua_getPath(self, pose, configs=None):
+        result = self.lua_getGoalConfig(pose, configs)
+        if not result:
+            return False
+        config, shape, valid = result
+        return self._plan(self.config, config), shape, valid
+
+    def lua_findHomeTargetPath(self, location, configs=None):
+        config, valid = self._select_config(location, configs)
+        if config is None:
+            return {'path': None, 'config': None, 'valid': valid}
+        return {'path': self._plan(self.config, config), 'config': config.tolist(), 'valid': valid}
+
+    def lua_setVisualization(self, b):
+        self.visualize = b
+
+    def lua_showGhost(self, config):
+        return self._new_shape() if self.visualize else -1
+
+    def lua_releaseGhosts(self, ids):
+        pass
+
+    def lua_visualizePath(self, path, max_samples):
+        if not self.visualize:
+            return []
+        configs = np.asarray(path).reshape(-1, 6)
+        length = np.linalg.norm(np.diff(configs, axis=0), axis=1).sum()
+        n = min(max_samples, len(configs), max(2, int(np.ceil(length / 0.3))))
+        return [self._new_shape() for _ in range(n)]
+
+    def lua_executePath(self, path, times):
+        self.config = np.asarray(path[-6:], dtype=np.float64)
+        self._update_attached()
+        self.sim_time += times[-1]
+        return True
+
+    def lua_moveToPose(self, pose):
+        self.target_pose = list(pose)
+        config = self._nearest_config(pose)
+        if config is None:
+            return False
+        self.config = config
+        self._update_attached()
+        self.sim_time += 0.05
+        return True
+
+    def lua_detectSuctionSensor(self):
+        tip = self._tip_pose()
+        item = self.scene.item_below(tip[:2])
+        if item is not None and tip[2] - self.scene.top(item) <= 0.005:
+            return item['handle']
+        return False
+
+    def lua_getSuctionSensorDistance(self):
+        tip = self._tip_pose()
+        item = self.scene.item_below(tip[:2])
+        if item is not None and tip[2] - self.scene.top(item) <= 0.1:
+            return float(tip[2] - self.scene.top(item))
+        return -1
+
+    def lua_descendUntilContact(self, step, max_steps):
+        pose = list(self.target_pose)
+        for _ in range(int(max_steps)):
+            item = self.lua_detectSuctionSensor()
+            if item:
+                return item
+            pose[2] -= step
+            if not self.lua_moveToPose(pose):
+                return False
+        return self.lua_detectSuctionSensor()
+
+    def lua_toggleSuction(self, handle, state):
+        item = self.scene.by_handle(handle)
+        if not state:
+            item['on_table'] = False
+            self.attached = item
+        else:
+            self.attached = None
+
+    def lua_captureRGBD(self, sensor_handle):
+        img, depth = self._render()
+        return img, depth, [self.resolution, self.resolution], self.sim_time
+
+
+class FakeRemoteAPIClient:
+    """Drop-in for RemoteAPIClient returning a shared FakeSim"""
+    def __init__(self, sim=None, **kwargs):
+        self.sim = sim if sim is not None else FakeSim()
+
+    def require(self, name):
+        return self.sim
+
+
+class _Column(np.ndarray):
+    """Array converting to int when it holds one element, like a torch tensor"""
+    def __int__(self):
+        return int(self.item())
+
+
+class _Boxes:
+    """Minimal ultralytics Boxes: cls and xyxy arrays, indexable and sized"""
+    def __init__(self, cls, xyxy):
+        self.cls = np.asarray(cls, dtype=np.float32).view(_Column)
+        self.xyxy = np.asarray(xyxy, dtype=np.float32).reshape(-1, 4)
+
+    def __len__(self):
+        return len(self.cls)
+
+    def __getitem__(self, i):
+        return _Boxes(self.cls[i:i + 1], self.xyxy[i:i + 1])
+
+
+class _Result:
+    def __init__(self, boxes):
+        self.boxes = boxes
+        self.speed = {'preprocess': 0.0, 'inference': 0.0, 'postprocess': 0.0}
+
+    def __len__(self):
+        return len(self.boxes)
+
+
+class FakeDetector:
+    """Detector returning the ground truth boxes of the fake scene's table items"""
+    def __init__(self, sim):
+        self.sim = sim
+        names = sorted(sim.scene.items)
+        self.model = SimpleNamespace(names=dict(enumerate(names)))
+        self.last_timing = {}
+
+    def detect_objects(self, rgb_image, target_objects=None, annotate=True):
+        name_to_index = {v: k for k, v in self.model.names.items()}
+        n = self.sim.resolution
+
+        cls, xyxy = [], []
+        for item in self.sim.scene.table_items():
+            if target_objects and item['name'] not in target_objects:
+                continue
+            half = np.asarray(item['size']) / 2
+            corners = [self.sim._project(np.asarray(item['position']) + s * half, self.sim.scene.top(item)) for s in ([-1, -1], [1, 1])]
+            us, vs = zip(*corners)
+            # Boxes are in the flipped image, like yolo's
+            x1, x2 = min(us), max(us)
+            y1, y2 = n - 1 - max(vs), n - 1 - min(vs)
+            cls.append(name_to_index[item['name']])
+            xyxy.append([x1, y1, x2, y2])
+
+        annotated = np.frombuffer(rgb_image, dtype=np.uint8) if annotate else None
+        return annotated, [_Result(_Boxes(cls, xyxy))]
@@ -0,0 +1,239 @@
+import json
+import time
+import threading
+import functools
+import contextlib
+
+import numpy as np
+
+from collections import defaultdict, deque
+
+# Latency histogram bucket upper bounds in ms, slower calls go to an overflow bucket
+HISTOGRAM_BOUNDS_MS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+HISTOGRAM_LABELS = tuple(f'<={b:g}' for b in HISTOGRAM_BOUNDS_MS) + (f'>{HISTOGRAM_BOUNDS_MS[-1]:g}',)
+
+# Trace events kept for export, older ones are dropped first
+MAX_EVENTS = 200_000
+
+
+def payload_size(obj):
+    """Approximate number of bytes a value takes on the wire"""
+    if obj is None or isinstance(obj, bool):
+        return 1
+    if isinstance(obj, (bytes, bytearray, memoryview)):
+        return len(obj)
+    if isinstance(obj, str):
+        return len(obj.encode())
+    if isinstance(obj, (int, float)):
+        return 8
+    if isinstance(obj, np.ndarray):
+        return obj.nbytes
+    if isinstance(obj, dict):
+        return sum(payload_size(k) + payload_size(v) for k, v in obj.items())
+    if isinstance(obj, (list, tuple)):
+        return sum(payload_size(v) for v in obj)
+    return 8
+
+
+class _CallStats:
+    def __init__(self):
+        self.latencies = []
+        self.bytes_out = 0
+        self.bytes_in = 0
+
+    def histogram(self):
+        """Call counts per latency bucket, keyed by bucket label"""
+        buckets = np.searchsorted(HISTOGRAM_BOUNDS_MS, np.array(self.latencies) * 1000, side='left')
+        counts = np.bincount(buckets, minlength=len(HISTOGRAM_LABELS))
+        return dict(zip(HISTOGRAM_LABELS, counts.tolist()))
+
+    def stats(self):
+        lat = np.array(self.latencies) * 1000
+        return {
+            'count': len(lat),
+            'total_s': float(lat.sum() / 1000),
+            'mean_ms': float(lat.mean()),
+            'p50_ms': float(np.percentile(lat, 50)),
+            'p95_ms': float(np.percentile(lat, 95)),
+            'max_ms': float(lat.max()),
+            'bytes_out': self.bytes_out,
+            'bytes_in': self.bytes_in,
+            'histogram_ms': self.histogram()
+        }
+
+
+class CallCounter:
+    """Proxy around the sim client that counts remote calls, safe to share between threads"""
+    def __init__(self, sim):
+        self._sim = sim
+        self.calls = 0
+        self._calls_lock = threading.Lock()
+
+    def _call(self, name, fn, args, kwargs):
+        return fn(*args, **kwargs)
+
+    def __getattr__(self, name):
+        attr = getattr(self._sim, name)
+        if not callable(attr):
+            return attr
+
+        def counted(*args, **kwargs):
+            with self._calls_lock:
+                self.calls += 1
+            return self._call(name, attr, args, kwargs)
+        return counted
+
+
+class Tracer:
+    """
+        Records remote-call latencies and payload sizes, plus nested spans for high level operations.
+        Per-call and per-span statistics cover the whole session, only the last max_events trace events are kept.
+        Everything is a no-op until enable() is called.
+    """
+    def __init__(self, max_events=MAX_EVENTS):
+        self.enabled = False
+        self.calls = defaultdict(_CallStats)
+        self.spans = defaultdict(_CallStats)
+        self.events = deque(maxlen=max_events)
+        self.dropped_events = 0
+        self._lock = threading.Lock()
+        self._origin = time.perf_counter()
+
+    def enable(self):
+        self.enabled = True
+        self._origin = time.perf_counter()
+
+    def _event(self, name, category, start, duration, args=None):
+        event = {
+            'name': name,
+            'cat': category,
+            'ph': 'X',
+            'ts': (start - self._origin) * 1e6,
+            'dur': duration * 1e6,
+            'pid': 0,
+            'tid': threading.get_ident()
+        }
+        if args:
+            event['args'] = args
+        if len(self.events) == self.events.maxlen:
+            self.dropped_events += 1
+        self.events.append(event)
+
+    @contextlib.contextmanager
+    def _span(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - start
+            with self._lock:
+                self.spans[name].latencies.append(duration)
+                self._event(name, 'span', start, duration)
+
+    def span(self, name):
+        """Context manager timing a high level operation"""
+        return self._span(name) if self.enabled else contextlib.nullcontext()
+
+    def record_call(self, name, start, duration, args, result):
+        bytes_out, bytes_in = payload_size(args), payload_size(result)
+        with self._lock:
+            stats = self.calls[name]
+            stats.latencies.append(duration)
+            stats.bytes_out += bytes_out
+            stats.bytes_in += bytes_in
+            self._event(name, 'rpc', start, duration, {'bytes_out': bytes_out, 'bytes_in': bytes_in})
+
+    def stats(self):
+        """Per-call and per-span statistics with latency histograms, JSON serializable"""
+        with self._lock:
+            return {
+                'calls': {name: stats.stats() for name, stats in self.calls.items()},
+                'spans': {name: stats.stats() for name, stats in self.spans.items()},
+                'dropped_events': self.dropped_events
+            }
+
+    def summary(self):
+        """Per-function table sorted by total time, followed by the latency histograms"""
+        stats = self.stats()
+        calls = sorted(stats['calls'].items(), key=lambda kv: -kv[1]['total_s'])
+        spans = sorted(stats['spans'].items(), key=lambda kv: -kv[1]['total_s'])
+
+        lines = [f"{'call':<40} {'count':>7} {'total s':>9} {'mean ms':>9} {'p50 ms':>8} {'p95 ms':>8} {'max ms':>8} {'KB out':>9} {'KB in':>9}"]
+        for name, s in calls:
+            lines.append(
+                f"{name:<40} {s['count']:>7} {s['total_s']:>9.3f} {s['mean_ms']:>9.2f} {s['p50_ms']:>8.2f} "
+                f"{s['p95_ms']:>8.2f} {s['max_ms']:>8.2f} {s['bytes_out'] / 1024:>9.1f} {s['bytes_in'] / 1024:>9.1f}"
+            )
+
+        # High level operations
+        if spans:
+            lines.append('')
+            lines.append(f"{'span':<40} {'count':>7} {'total s':>9} {'mean ms':>9} {'p50 ms':>8} {'p95 ms':>8} {'max ms':>8}")
+            for name, s in spans:
+                lines.append(
+                    f"{name:<40} {s['count']:>7} {s['total_s']:>9.3f} {s['mean_ms']:>9.2f} {s['p50_ms']:>8.2f} "
+                    f"{s['p95_ms']:>8.2f} {s['max_ms']:>8.2f}"
+                )
+
+        # Latency histograms, one column per bucket
+        rows = [*calls, *spans]
+        if rows:
+            lines.append('')
+            lines.append(f"{'latency histogram (ms)':<40} " + ' '.join(f'{label:>7}' for label in HISTOGRAM_LABELS))
+            for name, s in rows:
+                lines.append(f"{name:<40} " + ' '.join(f'{count:>7}' for count in s['histogram_ms'].values()))
+
+        if stats['dropped_events']:
+            lines.append(f"\n{stats['dropped_events']} oldest trace events dropped, statistics cover every call")
+
+        return '\n'.join(lines)
+
+    def export_chrome_trace(self, file_path):
+        """Write spans and calls in the Chrome trace event format (chrome://tracing, Perfetto), with the statistics as metadata"""
+        stats = self.stats()
+        with self._lock:
+            events = list(self.events)
+        with open(file_path, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms', 'otherData': stats}, f)
+
+    def reset(self):
+        with self._lock:
+            self.calls.clear()
+            self.spans.clear()
+            self.events.clear()
+            self.dropped_events = 0
+
+
+class TracedSim(CallCounter):
+    """Call counting proxy that also records every remote call, Lua calls are named by function"""
+    def __init__(self, sim, tracer):
+        super().__init__(sim)
+        self._tracer = tracer
+
+    def _call(self, name, fn, args, kwargs):
+        call_name = f'lua.{args[0]}' if name == 'callScriptFunction' and args else f'sim.{name}'
+        start = time.perf_counter()
+        result = fn(*args, **kwargs)
+        self._tracer.record_call(call_name, start, time.perf_counter() - start, args, result)
+        return result
+
+
+tracer = Tracer()
+
+
+def wrap_sim(sim):
+    """Instrument a sim client, returns it untouched while tracing is off"""
+    return TracedSim(sim, tracer) if tracer.enabled else sim
+
+
+def traced(name):
+    """Decorator recording a span around each call while tracing is on"""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not tracer.enabled:
+                return fn(*args, **kwargs)
+            with tracer.span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,42 @@
+import numpy as np
+
+
+class Path:
+    """
+        Joint-space path backed by an (N, dof) float64 array.
+        Reversing and slicing return views, the flat list the Lua side expects is only built at the remote call.
+    """
+    def __init__(self, configs, dof=6):
+        configs = np.asarray(configs, dtype=np.float64)
+        self.configs = configs.reshape(-1, dof) if configs.ndim == 1 else configs
+
+    def to_flat(self):
+        return self.configs.reshape(-1).tolist()
+
+    def reversed(self):
+        return Path(self.configs[::-1])
+
+    @property
+    def start(self):
+        return self.configs[0]
+
+    @property
+    def end(self):
+        return self.configs[-1]
+
+    def __len__(self):
+        return len(self.configs)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return Path(self.configs[index])
+        return self.configs[index]
+
+    def __iter__(self):
+        return iter(self.configs)
+
+    def __array__(self, dtype=None, copy=None):
+        return self.configs if dtype is None else self.configs.astype(dtype)
+
+    def __repr__(self):
+        return f'Path({len(self)} waypoints)'
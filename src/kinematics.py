@@ -0,0 +1,229 @@
+import numpy as np
+from scipy.spatial.transform import Rotation as R
+
+# Standard UR5 DH parameters (meters / radians)
+UR5_DH = {
+    'd': np.array([0.089159, 0.0, 0.0, 0.10915, 0.09465, 0.0823]),
+    'a': np.array([0.0, -0.425, -0.39225, 0.0, 0.0, 0.0]),
+    'alpha': np.array([np.pi / 2, 0.0, 0.0, np.pi / 2, -np.pi / 2, 0.0])
+}
+
+# CoppeliaSim's UR5 stands straight up at the zero configuration, the DH model lies flat
+SIM_JOINT_OFFSETS = np.array([0.0, -np.pi / 2, 0.0, -np.pi / 2, 0.0, 0.0])
+
+# IK candidate ranking, the simulator checks candidates in this order
+# joints: per-joint weight of angular distances, proximal joints move more mass
+# margin: fraction of a joint's range near a limit that is penalized
+CONFIG_RANK_WEIGHTS = {
+    'joints': [1.0, 1.0, 0.8, 0.5, 0.5, 0.3],
+    'current': 1.0,
+    'limits': 0.5,
+    'home': 0.2,
+    'margin': 0.1
+}
+
+
+def rank_configs(configs, current, home, limits, weights=CONFIG_RANK_WEIGHTS):
+    """
+        Score candidate configs in one vectorized pass: weighted joint distance from the current config,
+        closeness to the joint limits and weighted distance from home.
+        Returns candidate indices from best to worst and the cost of each candidate.
+    """
+    configs = np.asarray(configs, dtype=np.float64).reshape(-1, 6)
+    joint_w = np.asarray(weights['joints'])
+    limits = np.asarray(limits, dtype=np.float64)
+    lo, hi = limits[:, 0], limits[:, 1]
+
+    dist = np.abs(configs - np.asarray(current)) @ joint_w
+    home_dist = np.abs(configs - np.asarray(home)) @ joint_w
+    margin = np.minimum(configs - lo, hi - configs) / (hi - lo)
+    limit_cost = (np.clip(weights['margin'] - margin, 0, None) / weights['margin']).sum(axis=1)
+
+    costs = weights['current'] * dist + weights['limits'] * limit_cost + weights['home'] * home_dist
+    return np.argsort(costs, kind='stable'), costs
+
+
+def pose_to_matrix(poses):
+    """Convert (N, 7) [x, y, z, qx, qy, qz, qw] poses to (N, 4, 4) homogeneous matrices"""
+    poses = np.atleast_2d(np.asarray(poses, dtype=np.float64))
+    T = np.tile(np.eye(4), (len(poses), 1, 1))
+    T[:, :3, :3] = R.from_quat(poses[:, 3:]).as_matrix()
+    T[:, :3, 3] = poses[:, :3]
+    return T
+
+
+def matrix_to_pose(T):
+    """Convert (N, 4, 4) homogeneous matrices to (N, 7) poses"""
+    T = np.asarray(T).reshape(-1, 4, 4)
+    return np.concatenate([T[:, :3, 3], R.from_matrix(T[:, :3, :3]).as_quat()], axis=1)
+
+
+def sim_matrix_to_homogeneous(m):
+    """Convert a CoppeliaSim 12-element matrix (3x4, row major) to a 4x4 matrix"""
+    T = np.eye(4)
+    T[:3, :] = np.asarray(m, dtype=np.float64).reshape(3, 4)
+    return T
+
+
+def _dh_transforms(theta, d, a, alpha):
+    """Batched DH link transforms, theta has shape (N,)"""
+    ct, st = np.cos(theta), np.sin(theta)
+    ca, sa = np.cos(alpha), np.sin(alpha)
+
+    T = np.zeros(theta.shape + (4, 4))
+    T[..., 0, 0] = ct
+    T[..., 0, 1] = -st * ca
+    T[..., 0, 2] = st * sa
+    T[..., 0, 3] = a * ct
+    T[..., 1, 0] = st
+    T[..., 1, 1] = ct * ca
+    T[..., 1, 2] = -ct * sa
+    T[..., 1, 3] = a * st
+    T[..., 2, 1] = sa
+    T[..., 2, 2] = ca
+    T[..., 2, 3] = d
+    T[..., 3, 3] = 1.0
+    return T
+
+
+def _inv(T):
+    """Invert batched rigid transforms"""
+    Ti = np.zeros_like(T)
+    Rt = np.swapaxes(T[..., :3, :3], -1, -2)
+    Ti[..., :3, :3] = Rt
+    Ti[..., :3, 3] = -np.einsum('...ij,...j->...i', Rt, T[..., :3, 3])
+    Ti[..., 3, 3] = 1.0
+    return Ti
+
+
+class UR5Kinematics:
+    """
+        Vectorized forward and closed-form inverse kinematics of the UR5.
+        Configs are in the simulator's joint convention, poses are world-frame tip poses.
+    """
+    def __init__(self, dh=UR5_DH, joint_offsets=SIM_JOINT_OFFSETS, base=None, tool=None, home_config=None):
+        self.d = np.asarray(dh['d'], dtype=np.float64)
+        self.a = np.asarray(dh['a'], dtype=np.float64)
+        self.alpha = np.asarray(dh['alpha'], dtype=np.float64)
+        self.joint_offsets = np.asarray(joint_offsets, dtype=np.float64)
+        self.base = np.eye(4) if base is None else np.asarray(base, dtype=np.float64)
+        self.tool = np.eye(4) if tool is None else np.asarray(tool, dtype=np.float64)
+        self.home_config = None if home_config is None else np.asarray(home_config, dtype=np.float64)
+
+        self._base_inv = _inv(self.base)
+        self._tool_inv = _inv(self.tool)
+
+    @classmethod
+    def from_sim(cls, sim, params):
+        """Build the model from the simulator's arm layout as returned by getParams"""
+        base = sim_matrix_to_homogeneous(sim.getObjectMatrix(params['robotBase'], -1))
+        kin = cls(base=base, home_config=params['homeConfig'])
+
+        # Calibrate the flange to suction tip transform at the home config
+        home_tip = pose_to_matrix(params['homePose'])[0]
+        flange = kin.base @ kin._flange_fk(np.atleast_2d(params['homeConfig']))[0]
+        kin.tool = _inv(flange) @ home_tip
+        kin._tool_inv = _inv(kin.tool)
+
+        return kin
+
+    def _flange_fk(self, configs):
+        """Flange transforms in the DH base frame for (N, 6) sim configs"""
+        theta = np.asarray(configs, dtype=np.float64) + self.joint_offsets
+        links = _dh_transforms(theta, self.d, self.a, self.alpha)
+
+        T = links[:, 0]
+        for i in range(1, 6):
+            T = T @ links[:, i]
+        return T
+
+    def fk(self, configs):
+        """World tip transforms (N, 4, 4) for (N, 6) configs"""
+        configs = np.atleast_2d(configs)
+        return self.base @ self._flange_fk(configs) @ self.tool
+
+    def fk_pose(self, configs):
+        """World tip poses (N, 7) for (N, 6) configs"""
+        return matrix_to_pose(self.fk(configs))
+
+    def ik(self, poses):
+        """
+            Closed-form IK for (N, 7) world tip poses.
+            Returns (N, 8, 6) configs in the sim convention, unreachable branches are NaN.
+        """
+        T = pose_to_matrix(poses)
+        T06 = self._base_inv @ T @ self._tool_inv
+        n = len(T06)
+        d1, _, _, d4, d5, d6 = self.d
+        a2, a3 = self.a[1], self.a[2]
+
+        sols = np.full((n, 8, 6), np.nan)
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            # Shoulder pan: two branches
+            p05 = T06[:, :3, 3] - d6 * T06[:, :3, 2]
+            r = np.hypot(p05[:, 0], p05[:, 1])
+            psi = np.arctan2(p05[:, 1], p05[:, 0])
+            phi = np.arccos(d4 / r)
+
+            for i1, s1 in enumerate((1.0, -1.0)):
+                th1 = psi + s1 * phi + np.pi / 2
+                T01 = _dh_transforms(th1, d1, 0.0, self.alpha[0])
+                T16 = _inv(T01) @ T06
+
+                # Wrist 2: two branches
+                c5 = (T16[:, 2, 3] - d4) / d6
+                for i5, s5 in enumerate((1.0, -1.0)):
+                    th5 = s5 * np.arccos(np.clip(c5, -1.0, 1.0))
+                    th5 = np.where(np.abs(c5) > 1.0 + 1e-9, np.nan, th5)
+                    sin5 = np.sin(th5)
+
+                    # Wrist 3, free when the wrist is singular, keep it at zero there
+                    T61 = _inv(T16)
+                    th6 = np.arctan2(-T61[:, 1, 2] / sin5, T61[:, 0, 2] / sin5)
+                    th6 = np.where(np.abs(sin5) < 1e-9, 0.0, th6)
+
+                    T45 = _dh_transforms(th5, self.d[4], 0.0, self.alpha[4])
+                    T56 = _dh_transforms(th6, self.d[5], 0.0, self.alpha[5])
+                    T14 = T16 @ _inv(T45 @ T56)
+                    p13 = T14[:, :3, 3] - d4 * T14[:, :3, 1]
+                    norm13 = np.linalg.norm(p13, axis=1)
+
+                    c3 = (norm13 ** 2 - a2 ** 2 - a3 ** 2) / (2 * a2 * a3)
+
+                    # Elbow: two branches
+                    for i3, s3 in enumerate((1.0, -1.0)):
+                        th3 = s3 * np.arccos(np.clip(c3, -1.0, 1.0))
+                        th3 = np.where(np.abs(c3) > 1.0 + 1e-9, np.nan, th3)
+                        th2 = -np.arctan2(p13[:, 1], -p13[:, 0]) + np.arcsin(a3 * np.sin(th3) / norm13)
+
+                        T12 = _dh_transforms(th2, 0.0, a2, 0.0)
+                        T23 = _dh_transforms(th3, 0.0, a3, 0.0)
+                        T34 = _inv(T12 @ T23) @ T14
+                        th4 = np.arctan2(T34[:, 1, 0], T34[:, 0, 0])
+
+                        k = i1 * 4 + i5 * 2 + i3
+                        sols[:, k] = np.stack([th1, th2, th3, th4, th5, th6], axis=1)
+
+        # Back to sim convention, wrapped to [-pi, pi)
+        sols = sols - self.joint_offsets
+        sols = (sols + np.pi) % (2 * np.pi) - np.pi
+
+        return sols
+
+    def valid_configs(self, pose, tol=1e-4, ori_tol=1e-3):
+        """All IK solutions of a single pose that reproduce its position within tol and orientation within ori_tol radians"""
+        sols = self.ik(pose)[0]
+        sols = sols[~np.isnan(sols).any(axis=1)]
+        if len(sols) == 0:
+            return []
+
+        target = np.asarray(pose, dtype=np.float64)
+        poses = self.fk_pose(sols)
+        err = np.abs(poses[:, :3] - target[:3]).max(axis=1)
+
+        # Rotation angle between the quaternions, q and -q are the same orientation
+        dot = np.abs(poses[:, 3:] @ (target[3:] / np.linalg.norm(target[3:])))
+        ori_err = 2 * np.arccos(np.clip(dot, 0.0, 1.0))
+
+        return sols[(err < tol) & (ori_err < ori_tol)].tolist()
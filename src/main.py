@@ -1,20 +1,29 @@
 import os
 import time
+import threading
 import cv2
 import argparse
-import json
 import utils
+import instrumentation
 
 from coppeliasim_zmqremoteapi_client import RemoteAPIClient
 from vision.yolo import YOLOv8Detector
 from arm import RobotArm
 from vision.camera import Camera
-from nlp.llm import LLM
+from nlp.llm import LLM, INFERENCE_MODES
+from nlp.fast_parser import CommandParser, load_lexicon
+from motion_cache import MotionCache
+from roadmap import Roadmap
+from pipeline import TaskPipeline
+from task_planner import order_tasks, independent_cost
+from fake_sim import FakeRemoteAPIClient, FakeDetector
+from service import JobService, make_server
 
 PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
 YOLO_PATH = './vision/yolov8_combined.pt' # https://github.com/iki-wgt/yolov7_yolov8_benchmark_on_ycb_dataset
 LLM_PATH = './nlp/flan-t5-finetuned'
-CACHE_PATH_FILE = os.path.join(PROJECT_DIR,'./saved_paths.json')
+CACHE_PATH_FILE = os.path.join(PROJECT_DIR,'./motion_cache.npz')
+ROADMAP_FILE = os.path.join(PROJECT_DIR,'./roadmap.npz')
 
 # All available objects for detection
 # You can load the wanted objects randomly using the add_random_object function from utils
@@ -50,19 +59,52 @@ ITEMS_IN_SCENE = {
     'master_chef_can'
 }
 
-IS_TALL = {
-    'sugar_box' : True,
-    'large_clamp' : False,
-    'tuna_fish_can' : False,
-    'master_chef_can' : True
-}
-
 LOCATIONS = {
     'redBin' : [0.570, 0.375, 0.6],
     'yellowBin' : [0.050, 0.375, 0.6],
     'blueBin' : [-0.450, 0.375, 0.6]
 }
 
+def run_task_batch(sim, yolo, camera, arm, pairs, visualize=False):
+    """Detect all items of a compound command from one capture and run them in travel-minimizing order"""
+
+    start = time.perf_counter()
+    coords = utils.detect_objects_batch(sim, yolo, camera, [item for item, _ in pairs], visualize)
+    detect_time = time.perf_counter() - start
+
+    # Bins whose home path failed to plan can't be ordered or reached
+    bins = {loc: params['config'] for loc, params in arm.target_params.items() if params.get('config') and params.get('path')}
+    for item, location in pairs:
+        if item in coords and location not in bins:
+            print(f'No path to {location}, skipping {item}')
+
+    tasks = [
+        {'item': item, 'location': location, 'coords': coords[item], 'pick_config': arm.estimate_pick_config(coords[item])}
+        for item, location in pairs if item in coords and location in bins
+    ]
+    if not tasks:
+        return True
+
+    # Order by joint-space travel using the cached bin configs
+    home = arm.params['homeConfig']
+    ordered, cost = order_tasks(tasks, home, bins)
+
+    print(f'Detected {len(coords)}/{len(pairs)} items in {detect_time:.2f}s from one capture and one yolo pass, '
+          f'instead of {len(pairs)} of each in the per-item flow')
+    print(f'Planned joint travel: {cost:.2f} rad, {independent_cost(tasks, home, bins):.2f} rad when returning home after every task')
+
+    for i, task in enumerate(ordered):
+        print(f"Creating task for item: {task['item']} and location: {task['location']}")
+
+        # Stay above the bin between tasks, the last one returns home
+        success = arm.pick_and_place(task['coords'], task['location'], return_home=(i == len(ordered) - 1))
+        if not success:
+            print('Something went wrong!')
+            return False
+
+    print(f'Batch finished in {time.perf_counter() - start:.2f}s')
+    return True
+
 def main():
 
     # Argument Parser
@@ -70,51 +112,133 @@ def main():
     parser.add_argument("--use_cached_paths", action="store_true", help="Use cached paths if available")
     parser.add_argument("--vis_path", action="store_true", help="Visualize the paths in the simulation")
     parser.add_argument("--vis_yolo", action="store_true", help="Visualize the YOLO detections")
+    parser.add_argument("--analytic_ik", action="store_true", help="Use the analytic UR5 IK instead of simIK for candidate configs")
+    parser.add_argument("--descent", choices=['step', 'guided'], default='step', help="How the arm descends onto an item")
+    parser.add_argument("--upload_paths", action="store_true", help="Execute whole paths inside the simulator in one call")
+    parser.add_argument("--roadmap", action="store_true", help="Plan with the saved roadmap, building it first if missing")
+    parser.add_argument("--pipeline", action="store_true", help="Parse and detect upcoming tasks while the arm is moving")
+    parser.add_argument("--batch_tasks", action="store_true", help="Detect all items of a command at once and order the tasks by travel")
+    parser.add_argument("--fast_parser", action="store_true", help="Parse in-grammar commands without the LLM")
+    parser.add_argument("--yolo_imgsz", type=int, default=640, help="YOLO inference input size")
+    parser.add_argument("--yolo_export", choices=['onnx', 'int8'], default=None, help="Run YOLO from an exported ONNX or OpenVINO int8 model")
+    parser.add_argument("--trace", default=None, help="Record remote calls and spans, write a Chrome trace to this file")
+    parser.add_argument("--llm_mode", choices=INFERENCE_MODES, default='default', help="LLM inference mode, int8 and onnx are CPU-only")
+    parser.add_argument("--fake_sim", action="store_true", help="Run against the local simulator stand-in with ground truth detections")
+    parser.add_argument("--time_optimal", action="store_true", help="Shortcut paths and time them within the joint velocity and acceleration limits")
+    parser.add_argument("--plan_only", action="store_true", help="Only plan the bin paths at startup, without demonstrating them on the arm")
+    parser.add_argument("--planning_ports", type=int, nargs='*', default=[], help="Ports of extra simulator instances with the same scene to plan the bin paths on")
+    parser.add_argument("--serve", type=int, default=None, metavar='PORT', help="Accept commands over HTTP on this port instead of the terminal")
+    parser.add_argument("--serve_host", default='127.0.0.1', help="Address the HTTP service listens on")
+    parser.add_argument("--queue_size", type=int, default=16, help="Jobs waiting for parsing, and parsed jobs waiting for the arm, before the service rejects submissions")
     args = parser.parse_args()
+    if args.time_optimal and not args.upload_paths:
+        parser.error('--time_optimal requires --upload_paths')
+
 
+    # Instrumentation is free while disabled
+    if args.trace:
+        instrumentation.tracer.enable()
 
-    # Initialize the Remote API Client
-    client = RemoteAPIClient()
-    sim = client.require('sim')
+    # Initialize the Remote API Client, the fake one shares a single scene between clients
+    client = FakeRemoteAPIClient() if args.fake_sim else RemoteAPIClient()
+    new_client = (lambda: FakeRemoteAPIClient(client.sim)) if args.fake_sim else RemoteAPIClient
+    sim = instrumentation.wrap_sim(client.require('sim'))
 
     # Get script
     script = sim.getObject('/ArmControlScript')
     
     # Load yolo model
-    yolo = YOLOv8Detector(os.path.join(PROJECT_DIR, YOLO_PATH))
+    if args.fake_sim:
+        yolo = FakeDetector(client.sim)
+    else:
+        yolo = YOLOv8Detector(os.path.join(PROJECT_DIR, YOLO_PATH), imgsz=args.yolo_imgsz, export=args.yolo_export)
 
     # Load llm
-    llm = LLM(os.path.join(PROJECT_DIR, LLM_PATH), ITEMS_IN_SCENE, LOCATIONS, True)
+    fast_parser = CommandParser(load_lexicon()) if args.fast_parser else None
+    llm = LLM(os.path.join(PROJECT_DIR, LLM_PATH), ITEMS_IN_SCENE, LOCATIONS, True, fast_parser=fast_parser, mode=args.llm_mode)
 
     # Get vision sensor
     vision_sensor = sim.getObject('/camera/sensor')
-    camera = Camera(sim, vision_sensor)
+    table_height = utils.get_table_height(sim)
+    camera = Camera(sim, vision_sensor, script, table_height)
 
     # Start Simulation
     sim.startSimulation()
     time.sleep(2) # Wait 2 seconds until everything loads in the simulation
 
+    # Motion cache, keyed by start config, goal, planner settings and scene
+    motion_cache = MotionCache(CACHE_PATH_FILE) if args.use_cached_paths else None
+    pipeline = None
+
     # Main loop
     try:
         # Load arm controls
-        arm = RobotArm(sim, script, args.vis_path)
+        arm = RobotArm(sim, script, args.vis_path, analytic_ik=args.analytic_ik, descent=args.descent,
+                       upload_paths=args.upload_paths, motion_cache=motion_cache, time_optimal=args.time_optimal)
         
-        # Check if using cached_paths
-        if args.use_cached_paths and os.path.exists(CACHE_PATH_FILE):
-            with open(CACHE_PATH_FILE, 'r') as f:
-                arm.target_params = json.load(f)
-            print("Using saved paths")
-
-            utils.call_lua_function(sim, script, 'toggleCollisionBox', False)
-        else:
-            # Calculate locations' paths
-            arm.calculate_home_target_trajectories(LOCATIONS)
-
-            # Save paths if caching enabled
-            if args.use_cached_paths:
-                with open(CACHE_PATH_FILE, 'w') as f:
-                    json.dump(arm.target_params, f)
-                print("Saved calculated paths")
+        # Calculate locations' paths, cached ones are only re-validated
+        worker_sims = [
+            instrumentation.wrap_sim(FakeRemoteAPIClient().require('sim') if args.fake_sim else RemoteAPIClient(port=port).require('sim'))
+            for port in args.planning_ports
+        ]
+        for worker_sim in worker_sims:
+            worker_sim.startSimulation()
+        arm.calculate_home_target_trajectories(LOCATIONS, execute=not args.plan_only, worker_sims=worker_sims)
+        for worker_sim in worker_sims:
+            worker_sim.stopSimulation()
+
+        if motion_cache:
+            motion_cache.save()
+            print(f"Motion cache: {motion_cache.stats()}")
+
+        # Roadmap is built once over the static workcell and reused across runs
+        if args.roadmap:
+            roadmap = Roadmap.load(ROADMAP_FILE) if os.path.exists(ROADMAP_FILE) else None
+            if roadmap is not None and roadmap.key == arm.roadmap_key():
+                arm.roadmap = roadmap
+                print("Loaded roadmap")
+            else:
+                print("Building roadmap, this only happens when the scene or joint limits change...")
+                arm.roadmap = arm.build_roadmap()
+                arm.roadmap.save(ROADMAP_FILE)
+
+        if args.pipeline:
+            # Perception runs on its own thread, the remote API client isn't thread safe so it gets its own
+            perception_sim = instrumentation.wrap_sim(new_client().require('sim'))
+            perception_camera = Camera(perception_sim, perception_sim.getObject('/camera/sensor'), perception_sim.getObject('/ArmControlScript'), table_height)
+            perception_lock = threading.Lock()
+
+            def perceive(item):
+                with perception_lock:
+                    return utils.detect_objects(perception_sim, yolo, perception_camera, item)
+
+            def plan(task):
+                task['configs'] = arm.prepare_pick(task['coords'])
+                return task
+
+            def execute(task):
+                return arm.pick_and_place(task['coords'], task['location'], task['configs'])
+
+            pipeline = TaskPipeline(llm.process_prompt, perceive, execute, plan_fn=plan)
+
+        if args.serve is not None:
+            # Detection and motion run on the service's execute thread, the only one using this client
+            def execute(task):
+                coords = utils.detect_objects(sim, yolo, camera, task['item'])
+                return bool(coords) and arm.pick_and_place(coords, task['location'])
+
+            service = JobService(llm.process_prompts, execute, queue_size=args.queue_size)
+            server = make_server(service, args.serve_host, args.serve)
+            print(f'Serving on http://{args.serve_host}:{args.serve}: POST /jobs {{"prompt": ...}}, GET /jobs/<id>, GET /stats. Ctrl+C to stop.')
+            try:
+                server.serve_forever()
+            except KeyboardInterrupt:
+                pass
+            finally:
+                server.server_close()
+                service.close(cancel=True)
+                print(f"Service: {service.stats()}")
+            return
 
         print("\n\n")
 
@@ -131,24 +255,37 @@ def main():
             req = input('Enter you request: ')
 
             if req == 'detect':
-                utils.detect_objects(sim, yolo, camera, visualize=True)
+                if pipeline:
+                    with perception_lock:
+                        utils.detect_objects(perception_sim, yolo, perception_camera, visualize=True)
+                else:
+                    utils.detect_objects(sim, yolo, camera, visualize=True)
+                print(f"Detection timing (ms): {yolo.last_timing}")
 
             
             elif req == 'exit':
                 break
 
+            elif pipeline:
+                # Returns right away, the arm works through the queue in the background
+                pipeline.submit(req)
+
             else:
                 res = llm.process_prompt(req)
 
                 if not isinstance(res, list): 
                     print(res)
                     continue
+
+                if args.batch_tasks:
+                    run_task_batch(sim, yolo, camera, arm, res, visualize=args.vis_yolo)
+                    continue
                 
                 # Create a pick and place task for each one of the pairs
                 for item, location in res:
                     print(f'Creating task for item: {item} and location: {location}')
     
-                    item_coords = utils.detect_objects(sim, yolo, camera, item, isTall=IS_TALL[item], visualize=args.vis_yolo)
+                    item_coords = utils.detect_objects(sim, yolo, camera, item, visualize=args.vis_yolo)
 
                     if not item_coords:
                         continue
@@ -162,6 +299,20 @@ def main():
                 time.sleep(0.1)
         
     finally:
+        if fast_parser:
+            print(f"Fast parser: {llm.fast_path_stats()}")
+
+        if pipeline:
+            pipeline.close()
+            print(f"Pipeline timings: {pipeline.stats()}")
+
+        if motion_cache:
+            motion_cache.save()
+
+        if args.trace:
+            print(instrumentation.tracer.summary())
+            instrumentation.tracer.export_chrome_trace(args.trace)
+
         print("Stopping the simulation...")
         sim.stopSimulation()
         cv2.destroyAllWindows()
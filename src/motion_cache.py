@@ -0,0 +1,130 @@
+import os
+import hashlib
+import numpy as np
+
+from collections import OrderedDict
+
+from joint_path import Path
+
+# Settings from getParams that change the planner's output
+PLANNER_SETTINGS = (
+    'pathPlanningMaxTime',
+    'pathPlanningMaxSimplificationTime',
+    'pathPlanningResolution',
+    'pathNStates',
+    'pathPlanningAlgo'
+)
+
+
+def planner_settings(params):
+    """Extract the planner settings from the arm params"""
+    return [params.get(k) for k in PLANNER_SETTINGS]
+
+
+class MotionCache:
+    """
+        Persistent LRU cache of planned motions.
+        Entries are keyed by a hash of the start config, goal, planner settings and scene fingerprint,
+        and stored in a single .npz file. Paths are (N, 6) arrays, handed out as Path views.
+    """
+    def __init__(self, file_path=None, max_bytes=64 * 1024 * 1024):
+        self.file_path = file_path
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.invalidated = 0
+        self.evictions = 0
+
+        if file_path and os.path.exists(file_path):
+            self.load()
+
+    @staticmethod
+    def make_key(start_config, goal, settings, fingerprint):
+        """Hash the motion query, floats are rounded so sensor noise doesn't split entries"""
+        h = hashlib.sha1()
+        h.update(np.round(np.asarray(start_config, dtype=np.float64), 4).tobytes())
+        h.update(np.round(np.asarray(goal, dtype=np.float64), 3).tobytes())
+        h.update(repr(settings).encode())
+
+        numbers = [v for v in fingerprint if isinstance(v, (int, float))]
+        h.update(np.round(np.asarray(numbers, dtype=np.float64), 4).tobytes())
+        return h.hexdigest()
+
+    def get(self, key, validate=None):
+        """Return (config, Path) for key or None, validate(path) can reject stale entries"""
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        config, path = entry
+        if validate is not None and not validate(path):
+            self._remove(key)
+            self.invalidated += 1
+            self.misses += 1
+            return None
+
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return config.tolist(), Path(path)
+
+    def put(self, key, config, path):
+        """Store a motion and evict the least recently used ones over the size bound"""
+        if key in self.entries:
+            self._remove(key)
+
+        config = np.asarray(config, dtype=np.float64)
+        path = np.asarray(path, dtype=np.float64).reshape(-1, 6)
+        self.entries[key] = (config, path)
+        self.size += config.nbytes + path.nbytes
+
+        while self.size > self.max_bytes and len(self.entries) > 1:
+            self._remove(next(iter(self.entries)))
+            self.evictions += 1
+
+    def _remove(self, key):
+        config, path = self.entries.pop(key)
+        self.size -= config.nbytes + path.nbytes
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'entries': len(self.entries),
+            'bytes': self.size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'invalidated': self.invalidated,
+            'evictions': self.evictions,
+            'hit_rate': self.hits / total if total else 0.0
+        }
+
+    def save(self, file_path=None):
+        """Write the cache in LRU order, paths are concatenated with a table of row offsets"""
+        file_path = file_path or self.file_path
+        keys = list(self.entries)
+        configs = [self.entries[k][0] for k in keys]
+        paths = [self.entries[k][1] for k in keys]
+        offsets = np.cumsum([0] + [len(p) for p in paths])
+
+        tmp_path = file_path + '.tmp.npz'
+        np.savez(
+            tmp_path,
+            keys=np.array(keys, dtype='U40'),
+            configs=np.array(configs, dtype=np.float64).reshape(-1, 6),
+            offsets=offsets,
+            paths=np.concatenate(paths) if paths else np.zeros((0, 6))
+        )
+        os.replace(tmp_path, file_path)
+
+    def load(self, file_path=None):
+        file_path = file_path or self.file_path
+        with np.load(file_path) as data:
+            keys, configs, offsets, paths = data['keys'], data['configs'], data['offsets'], data['paths']
+
+        self.entries.clear()
+        self.size = 0
+        for i, key in enumerate(keys):
+            self.put(str(key), configs[i], paths[offsets[i]:offsets[i + 1]])  # Views into one array
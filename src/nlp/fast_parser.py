@@ -0,0 +1,129 @@
+import os
+import re
+import ast
+import csv
+import sys
+import time
+import importlib.util
+
+# The grammar the model was finetuned on lives with the dataset generator
+DATASET_CREATION_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../llm_finetuning/dataset_creation.py')
+
+_TOKEN = re.compile(r"[a-z0-9_']+")
+
+
+def load_lexicon(path=DATASET_CREATION_PATH):
+    """Load the synonym tables and grammar words from dataset_creation.py"""
+    spec = importlib.util.spec_from_file_location('dataset_creation', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+
+    return {
+        'items': module.ITEMS_IN_SCENE,
+        'locations': module.LOCATIONS,
+        'verbs': module.verbs,
+        'adverbs': module.adverbs,
+        'connectors': module.connectors
+    }
+
+
+def tokenize(text):
+    return _TOKEN.findall(text.lower())
+
+
+class _Trie:
+    """Word-level trie mapping phrases to a value, matched longest first"""
+    def __init__(self, phrases):
+        self.root = {}
+        for phrase, value in phrases.items():
+            node = self.root
+            for word in tokenize(phrase):
+                node = node.setdefault(word, {})
+            node[None] = value
+
+    def match(self, tokens, i):
+        """Longest phrase starting at tokens[i], returns (value, next index) or (None, i)"""
+        node, best, end = self.root, None, i
+        for j in range(i, len(tokens)):
+            node = node.get(tokens[j])
+            if node is None:
+                break
+            if None in node:
+                best, end = node[None], j + 1
+        return best, end
+
+
+class CommandParser:
+    """
+        Deterministic parser for in-grammar commands:
+            <verb> the <item> <adverb> the <location> [<connector> <verb> the <item> <adverb> the <location>]...
+        Returns the (item, location) pairs, or None when the command falls outside the grammar.
+    """
+    def __init__(self, lexicon):
+        self.items = _Trie({syn: item for item, syns in lexicon['items'].items() for syn in syns})
+        self.locations = _Trie({syn: loc for loc, syns in lexicon['locations'].items() for syn in syns})
+        self.verbs = _Trie({v: v for v in lexicon['verbs']})
+        self.adverbs = _Trie({a: a for a in lexicon['adverbs']})
+        self.connectors = _Trie({c: c for c in lexicon['connectors']})
+        self.article = _Trie({'the': 'the'})
+
+        # One clause, the value of each slot that isn't None is kept
+        self.clause = [
+            (self.verbs, False), (self.article, False), (self.items, True),
+            (self.adverbs, False), (self.article, False), (self.locations, True)
+        ]
+
+    def parse(self, text):
+        tokens = tokenize(text)
+        pairs = []
+        i = 0
+
+        while True:
+            values = []
+            for trie, keep in self.clause:
+                value, i = trie.match(tokens, i)
+                if value is None:
+                    return None
+                if keep:
+                    values.append(value)
+            pairs.append(tuple(values))
+
+            if i == len(tokens):
+                return pairs
+
+            connector, i = self.connectors.match(tokens, i)
+            if connector is None:
+                return None
+
+
+def check_equivalence(parser, csv_path):
+    """Run the parser over a generated dataset CSV and compare against its labels"""
+    total, unparsed, mismatches = 0, 0, []
+    start = time.perf_counter()
+
+    with open(csv_path, newline='') as f:
+        for row in csv.DictReader(f):
+            total += 1
+            pred = parser.parse(row['input'])
+            if pred is None:
+                unparsed += 1
+            elif pred != ast.literal_eval(row['output']):
+                mismatches.append((row['input'], pred, row['output']))
+
+    elapsed = time.perf_counter() - start
+    return {
+        'total': total,
+        'unparsed': unparsed,
+        'mismatches': mismatches,
+        'us_per_command': elapsed / total * 1e6 if total else 0.0
+    }
+
+
+if __name__ == '__main__':
+    # python -m nlp.fast_parser ../llm_finetuning/finetune_dataset.csv
+    report = check_equivalence(CommandParser(load_lexicon()), sys.argv[1])
+    print(f"{report['total']} commands, {report['unparsed']} unparsed, {len(report['mismatches'])} mismatches, "
+          f"{report['us_per_command']:.1f}us per command")
+    for cmd, pred, expected in report['mismatches'][:20]:
+        print(f'  {cmd!r}: got {pred}, expected {expected}')
+    sys.exit(1 if report['mismatches'] or report['unparsed'] else 0)
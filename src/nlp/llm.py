@@ -1,31 +1,115 @@
+import os
 import torch
 import re
 import ast
+import time
+import hashlib
 
+import numpy as np
 import pandas as pd
 
 from sklearn.metrics import precision_score, recall_score, f1_score, accuracy_score
-from transformers import AutoTokenizer, AutoModelForSeq2SeqLM
+from instrumentation import traced
+from transformers import AutoTokenizer, AutoModelForSeq2SeqLM, StoppingCriteria, StoppingCriteriaList
 
 SYSTEM_TEXT = "Extract a list of ('item', 'target location') pairs from the following input:"
 
+# 'default' samples with the full precision model, the others decode greedily on CPU
+INFERENCE_MODES = ('default', 'int8', 'onnx')
+
+# Exports of HuggingFace hub models, local models are exported next to their directory
+ONNX_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'text2arm', 'onnx')
+
+# Files of a model directory that change its exported graph
+WEIGHT_SUFFIXES = ('.safetensors', '.bin')
+
+def onnx_export_dir(model_name):
+    """Where the ONNX export of a model directory or hub name is kept"""
+    if os.path.isdir(model_name):
+        return f"{os.path.abspath(model_name).rstrip(os.sep)}-onnx"
+    return os.path.join(ONNX_CACHE_DIR, model_name.replace('/', '--'))
+
+def source_fingerprint(model_name):
+    """Hash of a model directory's config and the size and mtime of its weight files, hub models by name"""
+    h = hashlib.sha1()
+    if not os.path.isdir(model_name):
+        h.update(model_name.encode())
+    else:
+        with open(os.path.join(model_name, 'config.json'), 'rb') as f:
+            h.update(f.read())
+        for name in sorted(os.listdir(model_name)):
+            if name.endswith(WEIGHT_SUFFIXES):
+                stat = os.stat(os.path.join(model_name, name))
+                h.update(f'{name}:{stat.st_size}:{stat.st_mtime_ns}'.encode())
+    return h.hexdigest()
+
+class StopOnTokens(StoppingCriteria):
+    """Stop generating once every sequence in the batch has emitted one of the given tokens"""
+    def __init__(self, token_ids):
+        self.token_ids = token_ids
+
+    def __call__(self, input_ids, scores, **kwargs):
+        token_ids = self.token_ids.to(input_ids.device)
+        return bool(torch.isin(input_ids, token_ids).any(dim=1).all())
+
 class LLM:
-    def __init__(self, model_name="google/flan-t5-base", items=None, locations=None, is_local=False):
+    def __init__(self, model_name="google/flan-t5-base", items=None, locations=None, is_local=False, fast_parser=None, mode='default'):
         """Initialize the LLM class from either the HuggingFace model or our finetuned one."""
 
+        if mode not in INFERENCE_MODES:
+            raise ValueError(f"Unknown inference mode {mode}, expected one of {INFERENCE_MODES}")
+
         self.model_name = model_name
-        self.device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+        self.mode = mode
+        self.device = torch.device('cuda' if torch.cuda.is_available() and mode == 'default' else 'cpu')
 
         # Load model and tokenizer
         self.model, self.tokenizer = self._setup_model(model_name)
 
+        # Responses are a single list, nothing useful comes after the closing bracket
+        close_ids = [i for token, i in self.tokenizer.get_vocab().items() if ']' in token]
+        self.stopping_criteria = StoppingCriteriaList([StopOnTokens(torch.tensor(close_ids))])
+
+        if self.mode != 'default':
+            self._generate_responses(["Move the tuna can to the red bin"])  # Warm-up
+
         # Get list of available items and locations in the scene
         self.items = items
         self.locations = locations
 
+        # Optional deterministic parser tried before the model
+        self.fast_parser = fast_parser
+        self.fast_hits = 0
+        self.fast_misses = 0
+
     def _setup_model(self, model_name):
         tokenizer = AutoTokenizer.from_pretrained(model_name)
-        model = AutoModelForSeq2SeqLM.from_pretrained(model_name).to(self.device)
+
+        if self.mode == 'onnx':
+            # Optional dependency, only needed for the exported graph
+            from optimum.onnxruntime import ORTModelForSeq2SeqLM
+
+            # Export the graph once, later loads read it from disk until the source weights change
+            onnx_dir = onnx_export_dir(model_name)
+            fingerprint = source_fingerprint(model_name)
+            fingerprint_path = os.path.join(onnx_dir, 'source_fingerprint')
+            exported = None
+            if os.path.isfile(fingerprint_path):
+                with open(fingerprint_path) as f:
+                    exported = f.read()
+            if exported == fingerprint:
+                model = ORTModelForSeq2SeqLM.from_pretrained(onnx_dir)
+            else:
+                model = ORTModelForSeq2SeqLM.from_pretrained(model_name, export=True)
+                model.save_pretrained(onnx_dir)
+                with open(fingerprint_path, 'w') as f:
+                    f.write(fingerprint)
+        else:
+            model = AutoModelForSeq2SeqLM.from_pretrained(model_name).to(self.device)
+            model.eval()
+
+        if self.mode == 'int8':
+            model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
 
         if tokenizer.pad_token is None:
             tokenizer.pad_token = tokenizer.eos_token
@@ -35,24 +119,32 @@ class LLM:
     @torch.no_grad()
     def _generate_response(self, prompt, temperature=0.01):
         """Generate raw response from the model"""
-        prompt = f"{SYSTEM_TEXT} {prompt}"
-        inputs = self.tokenizer(prompt, return_tensors="pt", truncation=True).to(self.device)
+        return self._generate_responses([prompt], temperature)[0]
+
+    @torch.no_grad()
+    def _generate_responses(self, prompts, temperature=0.01):
+        """Generate raw responses for a batch of prompts, padded to the longest one"""
+        prompts = [f"{SYSTEM_TEXT} {prompt}" for prompt in prompts]
+        inputs = self.tokenizer(prompts, return_tensors="pt", padding=True, truncation=True).to(self.device)
+
+        if self.mode == 'default':
+            decoding = {'temperature': temperature, 'do_sample': True}
+        else:
+            # Greedy, deterministic and stops at the closing bracket
+            decoding = {'do_sample': False, 'num_beams': 1, 'stopping_criteria': self.stopping_criteria}
+
         outputs = self.model.generate(
             **inputs,
             max_length=128,
-            temperature=temperature,
-            do_sample=True,
             pad_token_id=self.tokenizer.pad_token_id,
-            eos_token_id=self.tokenizer.eos_token_id
+            eos_token_id=self.tokenizer.eos_token_id,
+            **decoding
         )
 
-        response =  self.tokenizer.decode(outputs[0], skip_special_tokens=True)
-        return response
+        return self.tokenizer.batch_decode(outputs, skip_special_tokens=True)
 
-    def process_prompt(self, input_text):
-        """Generate, validate, and parse response into structured output or return an error."""
-        response = self._generate_response(input_text)
-        
+    def _parse_response(self, response):
+        """Validate and parse a raw response into structured output or return an error."""
         try:
             # Try to directly evaluate the string as a list of tuples
             parsed_output = ast.literal_eval(response)
@@ -80,16 +172,71 @@ class LLM:
             return f"Errors found: {', '.join(errors)}"
             
         return parsed_output
+
+    def _fast_parse(self, input_text):
+        """Parse in-grammar commands without the model, None when the model is needed"""
+        if self.fast_parser is None:
+            return None
+
+        pairs = self.fast_parser.parse(input_text)
+        if pairs is None or any(item not in self.items or location not in self.locations for item, location in pairs):
+            self.fast_misses += 1
+            return None
+
+        self.fast_hits += 1
+        return pairs
+
+    def fast_path_stats(self):
+        total = self.fast_hits + self.fast_misses
+        return {
+            'hits': self.fast_hits,
+            'misses': self.fast_misses,
+            'hit_rate': self.fast_hits / total if total else 0.0
+        }
+
+    @traced('process_prompt')
+    def process_prompt(self, input_text):
+        """Generate, validate, and parse response into structured output or return an error."""
+        pairs = self._fast_parse(input_text)
+        if pairs is not None:
+            return pairs
+
+        response = self._generate_response(input_text)
+        return self._parse_response(response)
+
+    @traced('process_prompts')
+    def process_prompts(self, prompts, batch_size=16):
+        """
+            Batched process_prompt, results keep the order of prompts.
+            Prompts are bucketed by token length so each batch pads as little as possible.
+        """
+        results = [self._fast_parse(prompt) for prompt in prompts]
+        pending = [i for i, res in enumerate(results) if res is None]
+        if not pending:
+            return results
+
+        lengths = [len(ids) for ids in self.tokenizer([prompts[i] for i in pending], truncation=True)['input_ids']]
+        order = [pending[j] for j in sorted(range(len(pending)), key=lambda j: lengths[j])]
+
+        for start in range(0, len(order), batch_size):
+            bucket = order[start:start + batch_size]
+            responses = self._generate_responses([prompts[i] for i in bucket])
+            for i, response in zip(bucket, responses):
+                results[i] = self._parse_response(response)
+
+        return results
     
-def evaluate_model(model: LLM, test_data: pd.DataFrame):
+def evaluate_model(model: LLM, test_data: pd.DataFrame, batch_size=16):
     """
     Evaluate model performance using standard metrics.
-    Returns dictionary with metrics and error analysis.
+    Returns dictionary with metrics, throughput, latency and error analysis.
     """
     results = {
         'success_rate': 0,
         'error_rate': 0,
         'metrics': {},
+        'throughput': 0,
+        'latency': {},
         'errors': []
     }
     
@@ -97,22 +244,38 @@ def evaluate_model(model: LLM, test_data: pd.DataFrame):
     successes = 0
     y_true = []
     y_pred = []
-    
-    for _, row in test_data.iterrows():
-        # Parse ground truth
+
+    # Parse ground truth
+    rows = []
+    for prompt, output in zip(test_data['input'], test_data['output']):
         try:
-            true_pairs = ast.literal_eval(row['output'])
+            rows.append((prompt, ast.literal_eval(output)))
         except:
-            print(f"Error parsing ground truth: {row['output']}")
-            continue
-            
-        # Get model prediction
-        pred = model.process_prompt(row['input'])
-        
+            print(f"Error parsing ground truth: {output}")
+
+    # Get model predictions in length-bucketed batches, every prompt in a batch shares its latency
+    order = sorted(range(len(rows)), key=lambda i: len(rows[i][0]))
+    preds = [None] * len(rows)
+    latencies = []
+    start = time.perf_counter()
+
+    for b in range(0, len(order), batch_size):
+        bucket = order[b:b + batch_size]
+        batch_start = time.perf_counter()
+        batch_preds = model.process_prompts([rows[i][0] for i in bucket], batch_size=batch_size)
+        batch_time = time.perf_counter() - batch_start
+
+        for i, pred in zip(bucket, batch_preds):
+            preds[i] = pred
+        latencies.extend([batch_time] * len(bucket))
+
+    elapsed = time.perf_counter() - start
+
+    for (prompt, true_pairs), pred in zip(rows, preds):
         # Record errors
         if isinstance(pred, str):
             results['errors'].append({
-                'input': row['input'],
+                'input': prompt,
                 'error': pred,
                 'expected': true_pairs
             })
@@ -142,8 +305,11 @@ def evaluate_model(model: LLM, test_data: pd.DataFrame):
         'recall': recall_score(y_true, y_pred, zero_division=0),
         'f1': f1_score(y_true, y_pred, zero_division=0)
     }
+
+    results['throughput'] = len(rows) / elapsed if elapsed > 0 else 0.0
+    results['latency'] = {
+        'p50': float(np.percentile(latencies, 50)) if latencies else 0.0,
+        'p95': float(np.percentile(latencies, 95)) if latencies else 0.0
+    }
     
     return results
-
-
-
@@ -0,0 +1,130 @@
+import time
+import queue
+import threading
+
+from collections import defaultdict
+
+STAGES = ('parse', 'perceive', 'plan', 'execute')
+_STOP = object()
+
+
+class TaskPipeline:
+    """
+        Threaded parse -> perceive -> plan -> execute pipeline with bounded queues between stages.
+        Parsing and detection of upcoming tasks run while the arm executes the current one.
+        Each stage function runs on its own thread, so stages that talk to the simulator
+        must use their own remote API client.
+
+        parse_fn(prompt) -> list of (item, location) pairs or an error string
+        perceive_fn(item) -> item coordinates or a falsy value
+        plan_fn(task) -> task, may attach precomputed data for execution
+        execute_fn(task) -> success
+
+        Tasks are dicts with 'item', 'location' and, after perception, 'coords'.
+    """
+    def __init__(self, parse_fn, perceive_fn, execute_fn, plan_fn=None, queue_size=4):
+        self.fns = {
+            'parse': parse_fn,
+            'perceive': perceive_fn,
+            'plan': plan_fn if plan_fn else (lambda task: task),
+            'execute': execute_fn
+        }
+        self.queues = {stage: queue.Queue(maxsize=queue_size) for stage in STAGES}
+        self.timings = defaultdict(list)
+        self.results = []
+
+        self._pending = 0
+        self._idle = threading.Condition()
+        self._started = time.perf_counter()
+
+        self.threads = [threading.Thread(target=self._run, args=(stage,), daemon=True) for stage in STAGES]
+        for t in self.threads:
+            t.start()
+
+    def submit(self, prompt):
+        """Queue a prompt, blocks while the parse queue is full"""
+        self._add_pending(1)
+        self.queues['parse'].put(prompt)
+
+    def _add_pending(self, n):
+        with self._idle:
+            self._pending += n
+            if self._pending == 0:
+                self._idle.notify_all()
+
+    def _forward(self, stage, item):
+        next_stage = STAGES[STAGES.index(stage) + 1]
+        self.queues[next_stage].put(item)
+
+    def _run(self, stage):
+        q = self.queues[stage]
+        while True:
+            item = q.get()
+            if item is _STOP:
+                if stage != STAGES[-1]:
+                    self._forward(stage, _STOP)
+                return
+
+            try:
+                start = time.perf_counter()
+                out = self.fns[stage](item['item'] if stage == 'perceive' else item)
+                self.timings[stage].append(time.perf_counter() - start)
+                self._handle(stage, item, out)
+            except Exception as e:
+                print(f'Pipeline stage {stage} failed: {e}')
+                self.results.append({'stage': stage, 'input': item, 'success': False})
+                self._add_pending(-1)
+
+    def _handle(self, stage, item, out):
+        if stage == 'parse':
+            if not isinstance(out, list):
+                print(out)
+                self._add_pending(-1)
+                return
+
+            # One task per pair, the prompt itself is done
+            self._add_pending(len(out) - 1)
+            for pair in out:
+                print(f'Creating task for item: {pair[0]} and location: {pair[1]}')
+                self._forward(stage, {'item': pair[0], 'location': pair[1]})
+
+        elif stage == 'perceive':
+            if not out:
+                self._add_pending(-1)
+                return
+            item['coords'] = out
+            self._forward(stage, item)
+
+        elif stage == 'plan':
+            self._forward(stage, out)
+
+        else:
+            if not out:
+                print('Something went wrong!')
+            self.results.append({'stage': stage, 'input': item['item'], 'success': bool(out)})
+            self._add_pending(-1)
+
+    def wait(self):
+        """Block until every submitted prompt has been executed"""
+        with self._idle:
+            self._idle.wait_for(lambda: self._pending == 0)
+
+    def close(self):
+        """Finish the queued work and stop the stage threads"""
+        self.wait()
+        self.queues['parse'].put(_STOP)
+        for t in self.threads:
+            t.join()
+
+    def stats(self):
+        """Per-stage call counts and latencies next to the total wall time"""
+        stats = {}
+        for stage in STAGES:
+            t = self.timings[stage]
+            stats[stage] = {
+                'count': len(t),
+                'total': sum(t),
+                'mean': sum(t) / len(t) if t else 0.0
+            }
+        stats['wall'] = time.perf_counter() - self._started
+        return stats
@@ -0,0 +1,189 @@
+import heapq
+import hashlib
+import numpy as np
+
+
+def interpolate_edge(a, b, resolution):
+    """Configs along the straight joint-space segment a -> b, excluding a, spaced at most resolution apart"""
+    steps = max(1, int(np.ceil(np.abs(b - a).max() / resolution)))
+    t = np.arange(1, steps + 1)[:, None] / steps
+    return a + t * (b - a)
+
+
+def densify(configs, resolution):
+    """Resample a list of configs so consecutive waypoints are at most resolution apart"""
+    configs = np.asarray(configs, dtype=np.float64)
+    dense = [configs[:1]]
+    for a, b in zip(configs[:-1], configs[1:]):
+        dense.append(interpolate_edge(a, b, resolution))
+    return np.concatenate(dense)
+
+
+class Roadmap:
+    """
+        Probabilistic roadmap over the joint space of a fixed workcell.
+        check_fn(configs) -> boolean validity mask is used for all collision queries,
+        so a whole batch of nodes or edge waypoints costs a single remote call.
+        key identifies the scene and settings it was built for, see make_key.
+    """
+    def __init__(self, nodes, edges, weights, resolution=0.05, key=''):
+        self.nodes = np.asarray(nodes, dtype=np.float64)
+        self.edges = np.asarray(edges, dtype=np.int64).reshape(-1, 2)
+        self.weights = np.asarray(weights, dtype=np.float64)
+        self.resolution = resolution
+        self.key = key
+
+        self.adjacency = [[] for _ in range(len(self.nodes))]
+        for (i, j), w in zip(self.edges, self.weights):
+            self.adjacency[i].append((j, w))
+            self.adjacency[j].append((i, w))
+
+    @staticmethod
+    def make_key(fingerprint, limits, n_samples, k, resolution, seed=0):
+        """Hash the scene fingerprint, joint limits and build settings, a roadmap is stale once any of them change"""
+        h = hashlib.sha1()
+        numbers = [v for v in fingerprint if isinstance(v, (int, float))]
+        h.update(np.round(np.asarray(numbers, dtype=np.float64), 4).tobytes())
+        h.update(np.round(np.asarray(limits, dtype=np.float64), 4).tobytes())
+        h.update(repr((n_samples, k, resolution, seed)).encode())
+        return h.hexdigest()
+
+    @classmethod
+    def build(cls, check_fn, limits, n_samples=2000, k=10, resolution=0.05, batch_size=2000, seed=0, key=''):
+        """Sample collision-free nodes and connect each one to its k nearest neighbours"""
+        rng = np.random.default_rng(seed)
+        limits = np.asarray(limits, dtype=np.float64)
+
+        # Nodes
+        samples = rng.uniform(limits[:, 0], limits[:, 1], size=(n_samples, len(limits)))
+        valid = np.concatenate([check_fn(samples[i:i + batch_size]) for i in range(0, n_samples, batch_size)])
+        nodes = samples[valid]
+        print(f'Roadmap: {len(nodes)}/{n_samples} valid nodes')
+
+        # Candidate edges to the k nearest neighbours
+        candidates = set()
+        for start in range(0, len(nodes), 512):
+            dist = np.linalg.norm(nodes[start:start + 512, None, :] - nodes[None, :, :], axis=2)
+            nearest = np.argsort(dist, axis=1)[:, 1:k + 1]
+            for row, neighbours in enumerate(nearest):
+                i = start + row
+                candidates.update((min(i, j), max(i, j)) for j in neighbours)
+        candidates = sorted(candidates)
+
+        # Check edge waypoints in large batches
+        edges = []
+        pending, owners = [], []
+        def flush():
+            if not pending:
+                return
+            mask = check_fn(np.concatenate(pending))
+            offset = 0
+            for edge, n in owners:
+                if mask[offset:offset + n].all():
+                    edges.append(edge)
+                offset += n
+            pending.clear()
+            owners.clear()
+
+        queued = 0
+        for i, j in candidates:
+            waypoints = interpolate_edge(nodes[i], nodes[j], resolution)[:-1]
+            if len(waypoints) == 0:
+                edges.append((i, j))
+                continue
+            pending.append(waypoints)
+            owners.append(((i, j), len(waypoints)))
+            queued += len(waypoints)
+            if queued >= batch_size:
+                flush()
+                queued = 0
+        flush()
+
+        edges = np.array(edges, dtype=np.int64).reshape(-1, 2)
+        weights = np.linalg.norm(nodes[edges[:, 0]] - nodes[edges[:, 1]], axis=1)
+        print(f'Roadmap: {len(edges)}/{len(candidates)} valid edges')
+
+        return cls(nodes, edges, weights, resolution, key)
+
+    def save(self, file_path):
+        np.savez(file_path, nodes=self.nodes, edges=self.edges, weights=self.weights, resolution=self.resolution, key=self.key)
+
+    @classmethod
+    def load(cls, file_path):
+        with np.load(file_path) as data:
+            return cls(data['nodes'], data['edges'], data['weights'], float(data['resolution']), str(data['key']))
+
+    def _connect(self, config, check_fn, k):
+        """Indices and distances of the nearest nodes reachable from config by a valid straight edge"""
+        if len(self.nodes) == 0:
+            return []
+
+        dist = np.linalg.norm(self.nodes - config, axis=1)
+        nearest = np.argsort(dist)[:k]
+
+        segments = [interpolate_edge(config, self.nodes[i], self.resolution) for i in nearest]
+        mask = check_fn(np.concatenate(segments))
+
+        connected, offset = [], 0
+        for i, seg in zip(nearest, segments):
+            if mask[offset:offset + len(seg)].all():
+                connected.append((int(i), float(dist[i])))
+            offset += len(seg)
+        return connected
+
+    def _search(self, starts, goals):
+        """Dijkstra from the start connections to the goal connections, returns node indices"""
+        goal_cost = dict(goals)
+        best = {}
+        parent = {}
+        heap = []
+        for i, d in starts:
+            if d < best.get(i, np.inf):
+                best[i] = d
+                parent[i] = None
+                heapq.heappush(heap, (d, i))
+
+        end, end_cost = None, np.inf
+        while heap:
+            d, i = heapq.heappop(heap)
+            if d > best[i] or d >= end_cost:
+                continue
+            if i in goal_cost and d + goal_cost[i] < end_cost:
+                end, end_cost = i, d + goal_cost[i]
+            for j, w in self.adjacency[i]:
+                nd = d + w
+                if nd < best.get(j, np.inf):
+                    best[j] = nd
+                    parent[j] = i
+                    heapq.heappush(heap, (nd, j))
+
+        if end is None:
+            return None
+
+        route = []
+        while end is not None:
+            route.append(end)
+            end = parent[end]
+        return route[::-1]
+
+    def query(self, start, goal, check_fn, k=10):
+        """Flat path from start to goal through the roadmap, or None if they can't be connected"""
+        start = np.asarray(start, dtype=np.float64)
+        goal = np.asarray(goal, dtype=np.float64)
+
+        # Straight line first
+        direct = interpolate_edge(start, goal, self.resolution)
+        if check_fn(direct).all():
+            configs = [start, goal]
+        else:
+            starts = self._connect(start, check_fn, k)
+            goals = self._connect(goal, check_fn, k)
+            if not starts or not goals:
+                return None
+
+            route = self._search(starts, goals)
+            if route is None:
+                return None
+            configs = [start] + [self.nodes[i] for i in route] + [goal]
+
+        return densify(configs, self.resolution).reshape(-1).tolist()
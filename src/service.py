@@ -0,0 +1,300 @@
+import json
+import time
+import queue
+import itertools
+import threading
+
+import numpy as np
+
+from collections import OrderedDict, deque
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+_STOP = object()
+FINISHED = ('done', 'failed', 'cancelled')
+
+
+class QueueFull(Exception):
+    """Raised by submit when no more jobs can be queued"""
+
+
+class JobService:
+    """
+        Bounded job queue in front of the arm, fed concurrently by any number of clients.
+        Waiting prompts are parsed ahead in batches while earlier jobs execute, only execution (detection, which must
+        see the scene left by the previous job, and pick and place) runs one task at a time on the thread that owns
+        the simulator. At most queue_size jobs wait for parsing and queue_size parsed jobs wait for the arm, submit
+        fails with QueueFull beyond that.
+
+        parse_fn(prompts) -> one list of (item, location) pairs or error string per prompt
+        execute_fn(task) -> success, task is a dict with 'item', 'location' and its 'index' in the job
+
+        Jobs go queued -> parsing -> parsed -> running -> done or failed. A job stops at its first failed task.
+        Jobs still waiting when the service is closed with cancel=True end up cancelled.
+    """
+    def __init__(self, parse_fn, execute_fn, queue_size=16, parse_batch=8, history=1000):
+        self.parse_fn = parse_fn
+        self.execute_fn = execute_fn
+        self.parse_batch = parse_batch
+        self.history = history
+
+        self.queues = {'parse': queue.Queue(maxsize=queue_size), 'execute': queue.Queue(maxsize=queue_size)}
+        self.jobs = OrderedDict()
+        self.lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self.counts = {'submitted': 0, 'rejected': 0, 'done': 0, 'failed': 0, 'cancelled': 0}
+        self.cancelled = False
+        self.latencies = {name: deque(maxlen=10000) for name in ('queued', 'parse', 'run', 'total')}
+
+        self.threads = [
+            threading.Thread(target=self._parse_loop, daemon=True),
+            threading.Thread(target=self._execute_loop, daemon=True)
+        ]
+        for t in self.threads:
+            t.start()
+
+    def submit(self, prompt):
+        """Queue a prompt and return its job description, raises QueueFull instead of blocking"""
+        with self.lock:
+            if self.cancelled:
+                self.counts['rejected'] += 1
+                raise QueueFull('The service is shutting down')
+            job = {'id': str(next(self._ids)), 'prompt': prompt, 'status': 'queued', 'tasks': [], 'error': None,
+                   'submitted': time.perf_counter()}
+            self.jobs[job['id']] = job
+
+        try:
+            self.queues['parse'].put_nowait(job)
+        except queue.Full:
+            with self.lock:
+                del self.jobs[job['id']]
+                self.counts['rejected'] += 1
+            raise QueueFull(f"{self.queues['parse'].maxsize} jobs are already waiting")
+
+        with self.lock:
+            self.counts['submitted'] += 1
+            self._trim()
+            return self._describe(job)
+
+    def _trim(self):
+        """Forget the oldest finished jobs beyond the history size"""
+        excess = len(self.jobs) - self.history
+        for job_id in [job_id for job_id, job in self.jobs.items() if job['status'] in FINISHED][:max(excess, 0)]:
+            del self.jobs[job_id]
+
+    def _parse_loop(self):
+        q = self.queues['parse']
+        while True:
+            # Everything waiting is parsed in one batch
+            batch = [q.get()]
+            while len(batch) < self.parse_batch and batch[-1] is not _STOP:
+                try:
+                    batch.append(q.get_nowait())
+                except queue.Empty:
+                    break
+            jobs = [job for job in batch if job is not _STOP]
+
+            with self.lock:
+                for job in jobs:
+                    job['status'] = 'parsing'
+
+            start = time.perf_counter()
+            try:
+                results = self.parse_fn([job['prompt'] for job in jobs]) if jobs else []
+            except Exception as e:
+                results = [f'Error: {e}'] * len(jobs)
+            parse_s = time.perf_counter() - start
+
+            # Results are matched to prompts by position, a short or long list can't be matched at all
+            if len(results) != len(jobs):
+                results = [f'Error: parser returned {len(results)} results for {len(jobs)} prompts'] * len(jobs)
+
+            for job, res in zip(jobs, results):
+                with self.lock:
+                    job['parse_s'] = parse_s
+                    self.latencies['parse'].append(parse_s)
+                    if self.cancelled:
+                        self._finish(job, 'cancelled', 'Service stopped')
+                        continue
+                    if not isinstance(res, list):
+                        self._finish(job, 'failed', str(res))
+                        continue
+                    job['tasks'] = [{'item': item, 'location': location, 'index': i, 'status': 'pending'}
+                                    for i, (item, location) in enumerate(res)]
+                    job['status'] = 'parsed'
+
+                # Blocks while the arm is behind, which in turn fills the parse queue
+                self.queues['execute'].put(job)
+
+            if len(jobs) < len(batch):
+                self.queues['execute'].put(_STOP)
+                return
+
+    def _execute_loop(self):
+        q = self.queues['execute']
+        while True:
+            job = q.get()
+            if job is _STOP:
+                return
+
+            with self.lock:
+                if self.cancelled:
+                    self._finish(job, 'cancelled', 'Service stopped')
+                    continue
+                job['status'] = 'running'
+                job['started'] = time.perf_counter()
+
+            error, status = None, 'failed'
+            for task in job['tasks']:
+                with self.lock:
+                    # Stop after the current task when the service is closed
+                    if self.cancelled:
+                        error, status = 'Service stopped', 'cancelled'
+                        break
+                    task['status'] = 'running'
+                try:
+                    success = bool(self.execute_fn(task))
+                except Exception as e:
+                    success, error = False, str(e)
+
+                with self.lock:
+                    task['status'] = 'done' if success else 'failed'
+                if not success:
+                    error = error or f"Task {task['item']} -> {task['location']} failed"
+                    break
+
+            with self.lock:
+                for task in job['tasks']:
+                    if task['status'] == 'pending':
+                        task['status'] = 'skipped'
+                self._finish(job, status if error else 'done', error)
+
+    def _finish(self, job, status, error=None):
+        """Called with the lock held"""
+        job['status'] = status
+        job['error'] = error
+        job['finished'] = time.perf_counter()
+        self.counts[status] += 1
+
+        self.latencies['total'].append(job['finished'] - job['submitted'])
+        if 'started' in job:
+            self.latencies['queued'].append(job['started'] - job['submitted'])
+            self.latencies['run'].append(job['finished'] - job['started'])
+
+    def _describe(self, job):
+        """JSON-friendly copy of a job, called with the lock held"""
+        now = time.perf_counter()
+        done = sum(task['status'] == 'done' for task in job['tasks'])
+        return {
+            'id': job['id'],
+            'prompt': job['prompt'],
+            'status': job['status'],
+            'progress': f"{done}/{len(job['tasks'])}" if job['tasks'] else None,
+            'tasks': [{k: task[k] for k in ('item', 'location', 'status')} for task in job['tasks']],
+            'error': job['error'],
+            'queued_s': job.get('started', job.get('finished', now)) - job['submitted'],
+            'parse_s': job.get('parse_s'),
+            'run_s': job['finished'] - job['started'] if 'started' in job and 'finished' in job else None,
+            'total_s': job['finished'] - job['submitted'] if 'finished' in job else None
+        }
+
+    def status(self, job_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            return self._describe(job) if job else None
+
+    def list_jobs(self):
+        with self.lock:
+            return [{'id': job['id'], 'status': job['status']} for job in self.jobs.values()]
+
+    def stats(self):
+        """Queue depths, job counts and latency percentiles in seconds"""
+        with self.lock:
+            latencies = {
+                name: {'count': len(values), 'p50': float(np.percentile(values, 50)), 'p95': float(np.percentile(values, 95))}
+                for name, values in self.latencies.items() if values
+            }
+            return {
+                'waiting_parse': self.queues['parse'].qsize(),
+                'waiting_arm': self.queues['execute'].qsize(),
+                **self.counts,
+                'latency': latencies
+            }
+
+    def close(self, cancel=False):
+        """
+            Stop the worker threads after finishing the queued jobs, or with cancel=True after the task that is
+            running, cancelling every job that is still waiting
+        """
+        if cancel:
+            with self.lock:
+                self.cancelled = True
+
+            # Jobs waiting for the arm are cancelled by the execute loop as it drains its queue
+            q = self.queues['parse']
+            while True:
+                try:
+                    job = q.get_nowait()
+                except queue.Empty:
+                    break
+                with self.lock:
+                    self._finish(job, 'cancelled', 'Service stopped')
+
+        self.queues['parse'].put(_STOP)
+        for t in self.threads:
+            t.join()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """
+        POST /jobs          {"prompt": "..."} or a plain text prompt -> 202 with the job, 503 when the queue is full
+        GET  /jobs/<id>     status, progress and timings of a job
+        GET  /jobs          ids and statuses of the known jobs
+        GET  /stats         queue depths, counts and latency percentiles
+    """
+    def _send(self, code, body, headers=None):
+        data = json.dumps(body).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        if self.path.rstrip('/') != '/jobs':
+            return self._send(404, {'error': 'Not found'})
+
+        raw = self.rfile.read(int(self.headers.get('Content-Length', 0))).decode()
+        try:
+            prompt = json.loads(raw)['prompt']
+        except (ValueError, KeyError, TypeError):
+            prompt = raw
+        if not isinstance(prompt, str) or not prompt.strip():
+            return self._send(400, {'error': 'Expected a prompt'})
+
+        try:
+            self._send(202, self.server.service.submit(prompt.strip()))
+        except QueueFull as e:
+            self._send(503, {'error': str(e)}, {'Retry-After': '1'})
+
+    def do_GET(self):
+        path = self.path.rstrip('/')
+        if path == '/jobs':
+            return self._send(200, self.server.service.list_jobs())
+        if path == '/stats':
+            return self._send(200, self.server.service.stats())
+        if path.startswith('/jobs/'):
+            job = self.server.service.status(path[len('/jobs/'):])
+            return self._send(200, job) if job else self._send(404, {'error': 'Unknown job'})
+        self._send(404, {'error': 'Not found'})
+
+    def log_message(self, format, *args):
+        pass
+
+
+def make_server(service, host='127.0.0.1', port=8000):
+    """HTTP front end of a JobService, every request is handled on its own thread"""
+    server = ThreadingHTTPServer((host, port), _Handler)
+    server.service = service
+    return server
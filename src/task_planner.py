@@ -0,0 +1,59 @@
+import itertools
+import numpy as np
+
+
+def joint_distance(a, b):
+    return float(np.linalg.norm(np.asarray(a, dtype=np.float64) - np.asarray(b, dtype=np.float64)))
+
+
+def sequence_cost(tasks, home_config, bin_configs):
+    """
+        Joint-space travel of a task sequence when the arm stays at the last bin between tasks.
+        Each task goes bin -> pick -> bin (the pick path reversed), then through home to the
+        next bin only when the bin changes, and the sequence ends at home.
+    """
+    cost = 0.0
+    location = None
+    for task in tasks:
+        here = home_config if location is None else bin_configs[location]
+        cost += 2 * joint_distance(here, task['pick_config'])
+
+        if location != task['location']:
+            if location is not None:
+                cost += joint_distance(bin_configs[location], home_config)
+            cost += joint_distance(home_config, bin_configs[task['location']])
+        location = task['location']
+
+    if location is not None:
+        cost += joint_distance(bin_configs[location], home_config)
+    return cost
+
+
+def independent_cost(tasks, home_config, bin_configs):
+    """Joint-space travel when every task starts and ends at home"""
+    return sum(
+        2 * joint_distance(home_config, t['pick_config']) + 2 * joint_distance(home_config, bin_configs[t['location']])
+        for t in tasks
+    )
+
+
+def order_tasks(tasks, home_config, bin_configs, max_exhaustive=7):
+    """
+        Order pick and place tasks to minimize joint-space travel.
+        Tasks are dicts with 'location' and 'pick_config', small batches are searched exhaustively.
+    """
+    if len(tasks) <= 1:
+        return list(tasks), sequence_cost(tasks, home_config, bin_configs)
+
+    if len(tasks) <= max_exhaustive:
+        best = min(itertools.permutations(tasks), key=lambda order: sequence_cost(order, home_config, bin_configs))
+        return list(best), sequence_cost(best, home_config, bin_configs)
+
+    # Greedy nearest next pick from wherever the arm is parked
+    remaining = list(tasks)
+    ordered = []
+    while remaining:
+        i = min(range(len(remaining)), key=lambda i: sequence_cost(ordered + [remaining[i]], home_config, bin_configs))
+        ordered.append(remaining.pop(i))
+
+    return ordered, sequence_cost(ordered, home_config, bin_configs)
@@ -0,0 +1,89 @@
+import numpy as np
+
+from roadmap import interpolate_edge, densify
+
+
+def shortcut(configs, check_fn, resolution=0.05, max_batch=4000):
+    """
+        Greedy shortcutting: from each kept waypoint jump to the farthest later waypoint joined by a collision-free
+        straight segment. Candidate segments are checked farthest first, many per check_fn call.
+    """
+    configs = np.asarray(configs, dtype=np.float64)
+    n = len(configs)
+    kept = [0]
+    i = 0
+
+    while i < n - 1:
+        nxt = i + 1  # Consecutive waypoints come from the planner and are already valid
+        candidates = list(range(n - 1, i + 1, -1))
+
+        while candidates:
+            # Fill one batch with as many candidate segments as fit
+            batch, segments, size = [], [], 0
+            while candidates and (not batch or size + len(segments[-1]) <= max_batch):
+                j = candidates.pop(0)
+                segment = interpolate_edge(configs[i], configs[j], resolution)
+                batch.append(j)
+                segments.append(segment)
+                size += len(segment)
+
+            valid = check_fn(np.concatenate(segments))
+            bounds = np.cumsum([0] + [len(s) for s in segments])
+            reachable = [j for j, a, b in zip(batch, bounds[:-1], bounds[1:]) if valid[a:b].all()]
+            if reachable:
+                nxt = reachable[0]
+                break
+
+        kept.append(nxt)
+        i = nxt
+
+    return configs[kept]
+
+
+def time_parameterize(configs, max_vel, max_accel, resolution=0.02):
+    """
+        Time-optimal timing of a piecewise linear joint path under per-joint velocity and acceleration limits.
+        The path is densified, every sample gets a speed cap (segment velocity limits, and the acceleration needed to turn
+        at corners), then forward and backward passes bound speed changes by the segment acceleration limits.
+        Returns the dense configs and their timestamps, starting and ending at rest.
+    """
+    max_vel = np.asarray(max_vel, dtype=np.float64)
+    max_accel = np.asarray(max_accel, dtype=np.float64)
+
+    configs = densify(configs, resolution)
+    steps = np.diff(configs, axis=0)
+    lengths = np.linalg.norm(steps, axis=1)
+
+    # Drop repeated waypoints
+    keep = np.concatenate([[True], lengths > 1e-9])
+    configs, steps, lengths = configs[keep], steps[lengths > 1e-9], lengths[lengths > 1e-9]
+    if len(configs) < 2:
+        return configs, np.zeros(len(configs))
+
+    # Path speed and acceleration limits on each segment, from the joint limits along its direction
+    directions = np.abs(steps / lengths[:, None])
+    with np.errstate(divide='ignore'):
+        seg_vel = np.min(max_vel / directions, axis=1)
+        seg_accel = np.min(max_accel / directions, axis=1)
+
+        # Turning at a sample changes each joint's velocity by speed * |direction change| over about one segment
+        turn = np.abs(np.diff(steps / lengths[:, None], axis=0))
+        ds = np.minimum(lengths[:-1], lengths[1:])
+        corner = np.min(np.sqrt(max_accel * ds[:, None] / turn), axis=1)
+
+    cap = np.zeros(len(configs))
+    cap[1:-1] = np.minimum(np.minimum(seg_vel[:-1], seg_vel[1:]), corner)
+
+    # Forward and backward passes: v_next^2 <= v^2 + 2 a L
+    speed = cap.copy()
+    for k in range(len(lengths)):
+        speed[k + 1] = min(speed[k + 1], np.sqrt(speed[k] ** 2 + 2 * seg_accel[k] * lengths[k]))
+    for k in range(len(lengths) - 1, -1, -1):
+        speed[k] = min(speed[k], np.sqrt(speed[k + 1] ** 2 + 2 * seg_accel[k] * lengths[k]))
+
+    # Constant acceleration on each segment, a segment starting and ending at rest accelerates then brakes
+    ends = speed[:-1] + speed[1:]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        durations = np.where(ends > 0, 2 * lengths / ends, 2 * np.sqrt(lengths / seg_accel))
+    times = np.concatenate([[0.0], np.cumsum(durations)])
+    return configs, times
@@ -3,6 +3,7 @@ import numpy as np
 import math
 import matplotlib.pyplot as plt
 from scipy.spatial.transform import Rotation as R
+from instrumentation import traced, CallCounter
 
 def euler_to_quaternion(euler, seq='xyz'):
     """Conver euler angles to a quaternion"""
@@ -25,6 +26,10 @@ def call_lua_function(sim, script_handle, func_name, *args):
         print(f"Error calling Lua function '{func_name}': {e}")
         raise
 
+def get_table_height(sim, robot='/UR5'):
+    """World height of the table surface, the robot base is mounted on it"""
+    return sim.getObjectMatrix(sim.getObject(robot), -1)[11]
+
 def create_red_dot(sim, position, size=0.02):
     """Create a red dot (sphere) in the scene at a given position."""
     # Convert position to a Python list
@@ -36,15 +41,16 @@ def create_red_dot(sim, position, size=0.02):
     sim.setShapeColor(sphere, None, sim.colorcomponent_ambient_diffuse, [1, 0, 0])  # Red color
     return sphere
 
-def detect_objects(sim, detector, camera, target=None, isTall=False, visualize=False):
+@traced('detect_objects')
+def detect_objects(sim, detector, camera, target=None, visualize=False):
     """Detect objects and return interest points"""
 
     # Get camera data
-    rgb, flipped, resX, resY = camera.get_rgb_img()
-    depth, _ = camera.get_depth_map()
+    frame = camera.capture()
+    flipped, depth, resY = frame.flipped, frame.depth, frame.resY
 
     # Get yolo results
-    annotated_img, results = detector.detect_objects(flipped, [target] if target != None else None)
+    annotated_img, results = detector.detect_objects(flipped, [target] if target != None else None, annotate=visualize)
 
     world_coordinates = None
 
@@ -52,7 +58,7 @@ def detect_objects(sim, detector, camera, target=None, isTall=False, visualize=F
     if results[0]:
         result = results[0].boxes
         if len(result) == 1:
-            world_coordinates = get_ip(sim, detector, camera, depth, result, resY, isTall)
+            world_coordinates = get_ip(sim, detector, camera, depth, result, resY)
     else:
         print(f'Could not detect {target} in the scene')
         return False
@@ -65,7 +71,59 @@ def detect_objects(sim, detector, camera, target=None, isTall=False, visualize=F
 
     return world_coordinates 
 
-def get_ip(sim, detector, camera, depth, result, resY, isTall=False):
+@traced('detect_objects_batch')
+def detect_objects_batch(sim, detector, camera, targets, visualize=False):
+    """Detect several items from a single capture, returns interest points keyed by item"""
+
+    # Get camera data once for all items
+    frame = camera.capture()
+    flipped, depth, resY = frame.flipped, frame.depth, frame.resY
+
+    # Single yolo pass over every requested class
+    targets = list(dict.fromkeys(targets))
+    annotated_img, results = detector.detect_objects(flipped, targets, annotate=visualize)
+
+    boxes = results[0].boxes
+    names = [detector.model.names[int(c)] for c in boxes.cls]
+
+    world_coordinates = {}
+    for target in targets:
+        idx = [i for i, name in enumerate(names) if name == target]
+        if len(idx) != 1:
+            print(f'Could not detect {target} in the scene')
+            continue
+        coords = get_ip(sim, detector, camera, depth, boxes[idx[0]], resY)
+        if coords is not None:
+            world_coordinates[target] = coords
+
+    if visualize:
+        # Display annotated image
+        plt.imshow(annotated_img)
+        plt.title("YOLO Detections")
+        plt.show()
+
+    return world_coordinates
+
+def estimate_grasp_point(points, table_height=None, top_percentile=95, band=0.01, clearance=0.005):
+    """
+        Grasp point from the world points inside a detection box.
+        The top surface is the band below a high height percentile, robust to single noisy depth samples,
+        and the grasp point is its median position.
+        Points at table height are background and are dropped first, returns None if nothing is left.
+    """
+    points = points.reshape(-1, 3)
+    if table_height is not None:
+        points = points[points[:, 2] > table_height + clearance]
+    if len(points) == 0:
+        return None
+
+    top = np.percentile(points[:, 2], top_percentile)
+    surface = points[points[:, 2] >= top - band]
+
+    x, y = np.median(surface[:, 0]), np.median(surface[:, 1])
+    return [float(x), float(y), float(top)]
+
+def get_ip(sim, detector, camera, depth, result, resY):
     """"Returns interest point for picking up the object"""
 
     x1, y1, x2, y2 = result.xyxy[0].tolist()  # Bounding box corners
@@ -75,19 +133,21 @@ def get_ip(sim, detector, camera, depth, result, resY, isTall=False):
     y1 = resY - y1 - 1
     y2 = resY - y2 - 1
     y1, y2 = min(y1, y2), max(y1, y2)
-    
-    # If its a tall item return the top, else the center of the box is our interest point    
-    if not isTall:
-        cx, cy = int((x1 + x2) / 2), int((y1 + y2) / 2) + 5  # Center of the bounding box
-    else:
-        cx, cy = int((x1 + x2) / 2), y2 - 3
+
+    # Boxes touching the frame edge reach one pixel past it
+    resX = depth.shape[1]
+    x1, x2 = max(x1, 0), min(x2, resX - 1)
+    y1, y2 = max(y1, 0), min(y2, resY - 1)
+    if x1 > x2 or y1 > y2:
+        return None
 
     # Get the class name
     class_id = int(result.cls)
     class_name = detector.model.names[class_id]
 
-    # Convert pixel to world coordinates
+    # Back-project the whole box and take the top surface of the item as our interest point
     print('Returning interest point for ', {class_name})
-    world_coords = camera.pixel_to_world((cx, cy), depth)
+    points = camera.depth_to_points(depth, (x1, y1, x2, y2))
+    world_coords = estimate_grasp_point(points, camera.table_height)
 
     return world_coords
@@ -1,13 +1,44 @@
 import cv2
+import utils
 import numpy as np
 
+from functools import cached_property
+
+class RGBDFrame:
+    """
+        RGB-D pair from a single simulation step.
+        rgb and depth are read-only views over the received buffers, the flipped and
+        normalized variants are only computed when accessed.
+    """
+    def __init__(self, img, depth, resolution, timestamp):
+        self.resX, self.resY = resolution[0], resolution[1]
+        self.timestamp = timestamp
+        self.rgb = np.frombuffer(img, dtype=np.uint8).reshape(self.resY, self.resX, 3)
+        self.depth = np.frombuffer(depth, dtype=np.float32).reshape(self.resY, self.resX)
+
+    @cached_property
+    def flipped(self):
+        return cv2.flip(cv2.cvtColor(self.rgb, cv2.COLOR_BGR2RGB), 0)
+
+    @cached_property
+    def depth_normalized(self):
+        # Normalize to 0-255 for visualization
+        depth_normalized = cv2.normalize(cv2.flip(self.depth, 0), None, 0, 255, cv2.NORM_MINMAX)
+        return depth_normalized.astype(np.uint8)
+
 class Camera():
-    def __init__(self, sim, visionSensorHandle):
+    def __init__(self, sim, visionSensorHandle, script=None, table_height=None):
         self.sim = sim
         self.handle = visionSensorHandle
+        self.script = script  # Arm control script, used for single-call captures
+        self.table_height = table_height  # World height of the table surface, points at or below it are background
         self.K, self.near, self.far = self.get_intrinsics()
         self.extrinsic = self.sim.getObjectMatrix(self.handle, -1) # Returns list can be reshaped to 3X4
 
+        # Homogeneous extrinsic for local back-projection
+        self.extrinsic_matrix = np.eye(4)
+        self.extrinsic_matrix[:3, :] = np.asarray(self.extrinsic).reshape(3, 4)
+
     def get_intrinsics(self):
         """Calculate the intrinsic matrix of the camera"""
         # Get resolution
@@ -41,6 +72,17 @@ class Camera():
 
         return intrinsic_matrix, near, far
     
+    def capture(self):
+        """Synchronized RGB-D frame, a single remote call when the control script is known"""
+        if self.script is not None:
+            img, depth, resolution, timestamp = utils.call_lua_function(self.sim, self.script, 'captureRGBD', self.handle)
+        else:
+            img, resolution = self.sim.getVisionSensorImg(self.handle)
+            depth, _ = self.sim.getVisionSensorDepth(self.handle)
+            timestamp = self.sim.getSimulationTime()
+
+        return RGBDFrame(img, depth, resolution, timestamp)
+
     def get_rgb_img(self):
         """Get rgb image from vision sensor"""
         img, resolution = self.sim.getVisionSensorImg(self.handle)
@@ -60,12 +102,8 @@ class Camera():
         
         return depth, depth_normalized
 
-    def pixel_to_world(self, pixel, depth):
-        """Calculate 3d location of pixel"""
-        # Get pixel parameters
-        u, v = pixel
-        z = depth[v][u]
-
+    def _back_project(self, u, v, z):
+        """Camera-frame points for pixel coordinates and raw depth values, all arrays of the same shape"""
         # Intrinsics
         fx, fy = self.K[0,0], self.K[1,1]
         cx, cy = self.K[0,2], self.K[1,2]
@@ -76,12 +114,29 @@ class Camera():
         # Compute 3d coordinates
         x_c = (cx - u) * z / fx
         y_c = (v - cy) * z / fy
-        z_c = z
 
-        # Homogenous coords
-        camera_coords = [x_c, y_c, z_c, 1]
+        return np.stack([x_c, y_c, z], axis=-1)
+
+    def depth_to_points(self, depth, roi=None):
+        """
+            Back-project the depth map, or the (x1, y1, x2, y2) roi of it, to world coordinates.
+            Returns an (H, W, 3) array matching the depth pixels.
+        """
+        x1, y1, x2, y2 = roi if roi is not None else (0, 0, depth.shape[1] - 1, depth.shape[0] - 1)
+        v, u = np.mgrid[y1:y2 + 1, x1:x2 + 1]
+        camera_points = self._back_project(u, v, depth[y1:y2 + 1, x1:x2 + 1])
+
+        # Conver to world with the cached extrinsic
+        R, t = self.extrinsic_matrix[:3, :3], self.extrinsic_matrix[:3, 3]
+        return camera_points @ R.T + t
+
+    def pixel_to_world(self, pixel, depth):
+        """Calculate 3d location of pixel"""
+        # Get pixel parameters
+        u, v = pixel
+        camera_coords = np.append(self._back_project(u, v, depth[v][u]), 1.0)
 
         # Conver to world
-        world_coords = self.sim.multiplyVector(self.extrinsic, camera_coords)
+        world_coords = self.extrinsic_matrix @ camera_coords
 
-        return world_coords[:3]
\ No newline at end of file
+        return world_coords[:3].tolist()
\ No newline at end of file
@@ -1,32 +1,105 @@
 from ultralytics import YOLO
+from collections import OrderedDict
+import os
+import hashlib
+import time
 import cv2
 import torch
 
 class YOLOv8Detector:
-    def __init__(self, model_path="yolov8x.pt"):
-        self.model = YOLO(model_path)
+    def __init__(self, model_path="yolov8x.pt", imgsz=640, export=None, cache_size=8):
+        """
+            imgsz: inference input size, smaller is faster on CPU
+            export: None, 'onnx' or 'int8' (OpenVINO int8) to run an exported model
+            cache_size: number of frames whose detections are kept, 0 disables the cache
+        """
         self.device = 'cuda' if torch.cuda.is_available() else 'cpu'
-        self.model.to(self.device)
-        self.model.eval()
+        self.imgsz = imgsz
+
+        if export:
+            # Export once next to the weights and load the exported model instead
+            self.model = YOLO(self._exported_model(model_path, imgsz, export), task='detect')
+        else:
+            self.model = YOLO(model_path)
+            self.model.to(self.device)
+            self.model.eval()
+
+        # Detections keyed by a fingerprint of the frame and the requested classes
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.last_timing = {}
+
+    @staticmethod
+    def _exported_model(model_path, imgsz, export):
+        """
+            Path of the exported model for these weights and input size, exporting only when it is missing.
+            Exports have a fixed input size, so it is part of the name.
+        """
+        stem = os.path.splitext(model_path)[0]
+        fmt, exported_path = {
+            'onnx': ({'format': 'onnx'}, f'{stem}_{imgsz}.onnx'),
+            'int8': ({'format': 'openvino', 'int8': True}, f'{stem}_{imgsz}_int8_openvino_model')
+        }[export]
+
+        if not os.path.exists(exported_path):
+            print(f'Exporting {model_path} to {exported_path}, this only happens once...')
+            os.replace(YOLO(model_path).export(imgsz=imgsz, **fmt), exported_path)
+        return exported_path
+
+    def _fingerprint(self, rgb_image, target_objects):
+        """Cheap frame hash over a strided subsample of the pixels"""
+        h = hashlib.blake2b(rgb_image[::4, ::4].tobytes(), digest_size=16)
+        h.update(repr(sorted(target_objects) if target_objects else None).encode())
+        return h.hexdigest()
+
+    def _annotate(self, results):
+        # Convert back to RGB
+        return cv2.cvtColor(results[0].plot(), cv2.COLOR_BGR2RGB)
+
+    def detect_objects(self, rgb_image, target_objects=None, annotate=True):
+        """Returns the annotated image (None unless annotate is set) and the yolo results"""
+        start = time.perf_counter()
+        key = self._fingerprint(rgb_image, target_objects) if self.cache_size else None
+        fingerprint_ms = (time.perf_counter() - start) * 1000
+
+        if key in self.cache:
+            self.cache.move_to_end(key)
+            annotated_image, results = self.cache[key]
+            if annotate and annotated_image is None:
+                annotated_image = self._annotate(results)
+                self.cache[key] = (annotated_image, results)
+
+            self.last_timing = {'fingerprint': fingerprint_ms, 'cached': True}
+            return annotated_image, results
 
-    def detect_objects(self, rgb_image, target_objects=None):
         # Convert RGB to BGR for OpenCV compatibility
         bgr_image = cv2.cvtColor(rgb_image, cv2.COLOR_RGB2BGR)
 
         # Detect objects
         if target_objects:
             # Mapping class names to indices
-            class_name_to_index = {v: k for k, v in self.model.model.names.items()}
+            class_name_to_index = {v: k for k, v in self.model.names.items()}
             target_class_indices = [class_name_to_index[obj] for obj in target_objects]
-            results = self.model.predict(source=bgr_image, classes=target_class_indices, save=False, verbose=False, device=self.device)
+            results = self.model.predict(source=bgr_image, classes=target_class_indices, imgsz=self.imgsz, save=False, verbose=False, device=self.device)
         else:
             # Detect all objects
-            results = self.model.predict(source=bgr_image, classes=None, save=False, verbose=False, device=self.device)
+            results = self.model.predict(source=bgr_image, classes=None, imgsz=self.imgsz, save=False, verbose=False, device=self.device)
 
-        # Annotate the image with detection results
-        annotated_image = results[0].plot()
+        # Annotate the image with detection results only when someone looks at it
+        start = time.perf_counter()
+        annotated_image = self._annotate(results) if annotate else None
+        annotate_ms = (time.perf_counter() - start) * 1000
 
-        # Convert back to RGB
-        annotated_image = cv2.cvtColor(annotated_image, cv2.COLOR_BGR2RGB)
+        self.last_timing = {
+            'fingerprint': fingerprint_ms,
+            **results[0].speed,  # preprocess / inference / postprocess in ms
+            'annotate': annotate_ms,
+            'cached': False
+        }
+
+        if key:
+            self.cache[key] = (annotated_image, results)
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
 
         return annotated_image, results